@@ -0,0 +1,567 @@
+import argparse
+import datetime
+import html
+import json
+import random
+import re
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from xid_scanner import find_xid_references
+
+##
+#
+#   This file is a local stand-in for Canvas, so the fixer can be measured and regression tested without a live
+#   Canvas or a Duo push. It serves synthetic courses: the course and settings pages, the link validator (page and
+#   JSON endpoint), pages, assignments, discussions, question banks and quizzes with a fake rich content editor,
+#   the course file listing and lookup, quiz questions and the item API endpoints. Edits are kept in memory so a run
+#   can be checked afterwards. API requests can be rate limited like Canvas does it: every request takes from a
+#   leaking quota, reports it in the `X-Rate-Limit-Remaining` and `X-Request-Cost` headers and is refused with
+#   403 "Rate Limit Exceeded" once the quota is used up.
+#   Start it with `python3 -m benchmarks.mock_canvas` and set CANVAS_BASE_URL to its address.
+#
+##
+
+PNG = (b"\x89PNG\r\n\x1a\n\x00\x00\x00\rIHDR\x00\x00\x00\x01\x00\x00\x00\x01\x08\x06\x00\x00\x00\x1f\x15\xc4\x89"
+       b"\x00\x00\x00\rIDATx\x9cc\xf8\x0f\x00\x00\x01\x01\x00\x05\x18\xd8N\x00\x00\x00\x00IEND\xaeB`\x82")
+
+PAGE_SIZE = 100
+
+# Canvas's rate limit: the quota, what it recovers per second, and what is taken up front while a request runs
+RATE_LIMIT = 700
+LEAK_RATE = 10
+PREFLIGHT_COST = 50
+
+# A fake TinyMCE: editors are content editable divs with the class the fixer looks for, and `tinyMCE.activeEditor`
+# is the last one clicked. Ctrl+Shift+F opens a "Course Images" panel that searches the course files.
+EDITOR_SCRIPT = """
+window.tinyMCE = {activeEditor: null};
+function makeEditor(element) {
+    var editor = {
+        getContent: function () { return element.innerHTML; },
+        setContent: function (content) { element.innerHTML = content; }
+    };
+    element.addEventListener("click", function () { tinyMCE.activeEditor = editor; });
+    tinyMCE.activeEditor = editor;
+    return editor;
+}
+function editorMarkup(id, content) {
+    return '<div class="tox-edit-area__iframe" id="' + id + '" contenteditable="true">' + content + '</div>';
+}
+function send(method, url, body) {
+    var request = new XMLHttpRequest();
+    request.open(method, url, false);
+    request.setRequestHeader("Content-Type", "application/x-www-form-urlencoded");
+    request.send(body);
+    return request.responseText;
+}
+document.addEventListener("keydown", function (event) {
+    if ((event.ctrlKey || event.metaKey) && event.shiftKey && event.key.toLowerCase() === "f") {
+        document.body.classList.add("tox-fullscreen");
+        document.getElementById("rte_panel").innerHTML = '<div title="Course Images" tabindex="0">Course Images</div>';
+        document.querySelector("div[title='Course Images']").addEventListener("click", showImageSearch);
+    } else if (event.key === "Escape") {
+        document.body.classList.remove("tox-fullscreen");
+        document.getElementById("rte_panel").innerHTML = "";
+    }
+});
+function showImageSearch() {
+    var panel = document.getElementById("rte_panel");
+    panel.innerHTML = '<input placeholder="Search">' +
+        '<div data-testid="instructure_links-ImagesPanel"><span></span></div>';
+    panel.querySelector("input").addEventListener("input", function (event) {
+        var files = JSON.parse(send("GET", FILES_URL + "?search_term=" + encodeURIComponent(event.target.value)));
+        var results = panel.querySelector("div[data-testid='instructure_links-ImagesPanel'] span");
+        results.innerHTML = "";
+        files.forEach(function (file) {
+            var button = document.createElement("button");
+            button.innerHTML = '<img alt="' + file.display_name + '" src="' + file.url + '">';
+            button.addEventListener("click", function () {
+                tinyMCE.activeEditor.setContent('<img src="' + file.url + '" alt="' + file.display_name + '">');
+            });
+            results.appendChild(button);
+        });
+    });
+}
+"""
+
+DOCUMENT = """<!DOCTYPE html>
+<html><head><title>{title}</title>
+<style>
+.edit_question_link {{ display: none; }}
+.question_holder:hover .edit_question_link {{ display: inline; }}
+.tox-edit-area__iframe {{ min-height: 40px; border: 1px solid #ccc; }}
+</style>
+<script>var FILES_URL = "/api/v1/courses/{course_id}/files";</script>
+<script>{script}</script>
+</head><body>
+<div id="rte_panel"></div>
+{body}
+</body></html>
+"""
+
+# Item page with an edit button that opens the editor, and a submit button that saves through the API
+ITEM_BODY = """
+<div id="content">{content}</div>
+<button class="{edit_class}" onclick="openEditor()">Edit</button>
+<div id="editor"></div>
+<script>
+function openEditor() {{
+    var editor = document.getElementById("editor");
+    editor.innerHTML = editorMarkup("item_ifr", document.getElementById("content").innerHTML) +
+        '<button class="btn submit" onclick="save()">Save</button>';
+    makeEditor(document.getElementById("item_ifr"));
+}}
+function save() {{
+    send("PUT", "{api_url}", "{form_field}=" + encodeURIComponent(tinyMCE.activeEditor.getContent()));
+    document.getElementById("content").innerHTML = tinyMCE.activeEditor.getContent();
+    document.getElementById("editor").innerHTML = "";
+}}
+</script>
+"""
+
+# Question holders open an editor for the question text and its answers when their edit link is clicked
+QUESTIONS_SCRIPT = """
+function editQuestion(link) {
+    var holder = link.closest(".question_holder");
+    var question = holder.querySelector(".question");
+    var answers = question.querySelectorAll(".answer");
+    var form = '<form class="question_form" onsubmit="return saveQuestion(this)">' +
+        editorMarkup("question_content_ifr", question.querySelector(".question_text").innerHTML) +
+        '<div class="form_answers">';
+    answers.forEach(function (answer) {
+        form += '<div class="answer' + (answer.dataset.correct === "true" ? ' correct_answer' : '') + '">' +
+            '<div class="answer_html">' + answer.innerHTML + '</div>' +
+            '<a class="edit_html" href="#" onclick="return editAnswer(this)">Edit</a>' +
+            '<a class="select_answer_link" href="#" onclick="return false">Correct</a></div>';
+    });
+    form += '</div><button type="submit">Update Question</button></form>';
+    holder.insertAdjacentHTML("beforeend", form);
+    makeEditor(document.getElementById("question_content_ifr"));
+    return false;
+}
+function editAnswer(link) {
+    var answer = link.closest(".answer");
+    var content = answer.querySelector(".answer_html");
+    content.outerHTML = editorMarkup("answer_ifr_" + Date.now(), content.innerHTML);
+    makeEditor(answer.querySelector(".tox-edit-area__iframe"));
+    return false;
+}
+function saveQuestion(form) {
+    var holder = form.closest(".question_holder");
+    var question = holder.querySelector(".question");
+    var answers = Array.prototype.map.call(form.querySelectorAll(".form_answers .answer"), function (answer) {
+        var content = answer.querySelector(".tox-edit-area__iframe, .answer_html");
+        return content.innerHTML;
+    });
+    var text = form.querySelector("#question_content_ifr").innerHTML;
+    send("POST", QUESTIONS_URL + "/" + question.dataset.id,
+         "text=" + encodeURIComponent(text) + "&answers=" + encodeURIComponent(JSON.stringify(answers)));
+    question.querySelector(".question_text").innerHTML = text;
+    question.querySelectorAll(".answer").forEach(function (answer, index) { answer.innerHTML = answers[index]; });
+    form.remove();
+    return false;
+}
+"""
+
+QUESTION_HOLDER = """
+<div class="question_holder" id="question_holder_{id}">
+<div class="question" id="question_{id}" data-id="{id}">
+<div class="question_text">{text}</div>
+<div class="answers">{answers}</div>
+</div>
+<a class="edit_question_link" href="#" onclick="return editQuestion(this)">Edit</a>
+</div>
+"""
+
+QUESTION_ANSWER = '<div class="answer" data-correct="{correct}">{text}</div>'
+
+
+class SyntheticCourse:
+    """A course made of pages, assignments, discussions, question banks and quizzes, `xid_ratio` of which contain
+    `xids_per_item` xid images of the course's files."""
+
+    def __init__(self, course_id, items=20, questions_per_bank=5, xids_per_item=2, xid_ratio=1.0, seed=0):
+        rng = random.Random("{}-{}".format(course_id, seed))
+        self.course_id = course_id
+        self.files = []
+        self.pages = {}
+        self.assignments = {}
+        self.discussions = {}
+        self.banks = {}
+        self.quizzes = {}
+        self.validation_state = "completed"
+        self.validation_ready = 0
+
+        def content():
+            parts = ["<p>Synthetic content {}</p>".format(rng.randrange(10 ** 6))]
+            if rng.random() < xid_ratio:
+                for _ in range(xids_per_item):
+                    parts.append(self.__xid_image())
+            return "".join(parts)
+
+        def question(question_id):
+            answers = [{"text": content() if rng.random() < 0.3 else "Answer {}".format(i), "correct": i == 0}
+                       for i in range(4)]
+            return {"id": question_id, "text": content(), "answers": answers}
+
+        kinds = ("page", "assignment", "discussion", "bank", "quiz")
+        for i in range(items):
+            kind = kinds[i % len(kinds)]
+            if kind == "page":
+                self.pages["page-{}".format(i)] = content()
+            elif kind == "assignment":
+                self.assignments[str(i)] = content()
+            elif kind == "discussion":
+                self.discussions[str(i)] = content()
+            elif kind == "bank":
+                self.banks[str(i)] = [question(i * 1000 + q) for q in range(questions_per_bank)]
+            else:
+                self.quizzes[str(i)] = [question(i * 1000 + q) for q in range(questions_per_bank)]
+
+    def __xid_image(self):
+        file_id = len(self.files) + 1
+        name = "image{}".format(file_id)
+        self.files.append({"id": file_id, "display_name": name + ".png", "filename": name + ".png"})
+        return '<img src="/courses/{}/file_contents/course%20files/xid-{}_1/{}" alt="{}">'.format(
+            self.course_id, file_id, name, name)
+
+    def get_issues(self):
+        """Returns the link validation issues of the course, in the format of the link validation endpoint."""
+        issues = []
+
+        def add(item_type, url, texts):
+            links = [{"url": reference.url, "reason": "missing_item"}
+                     for text in texts for reference in find_xid_references(text)]
+            if links:
+                issues.append({"type": item_type, "content_url": url, "invalid_links": links})
+
+        prefix = "/courses/{}".format(self.course_id)
+        for url, body in self.pages.items():
+            add("wiki_page", "{}/pages/{}".format(prefix, url), [body])
+        for item_id, body in self.assignments.items():
+            add("assignment", "{}/assignments/{}".format(prefix, item_id), [body])
+        for item_id, body in self.discussions.items():
+            add("discussion_topic", "{}/discussion_topics/{}".format(prefix, item_id), [body])
+        for bank_id, questions in self.banks.items():
+            add("assessment_question", "{}/question_banks/{}".format(prefix, bank_id), question_texts(questions))
+        for quiz_id, questions in self.quizzes.items():
+            add("quiz_question", "{}/quizzes/{}".format(prefix, quiz_id), question_texts(questions))
+        return issues
+
+    def count_xid_references(self):
+        """Returns the number of xid references left in the course."""
+        texts = list(self.pages.values()) + list(self.assignments.values()) + list(self.discussions.values())
+        for questions in list(self.banks.values()) + list(self.quizzes.values()):
+            texts.extend(question_texts(questions))
+        return sum(len(find_xid_references(text)) for text in texts)
+
+
+def question_texts(questions):
+    return [text for q in questions for text in [q["text"]] + [a["text"] for a in q["answers"]]]
+
+
+def render_questions(questions):
+    return "".join(QUESTION_HOLDER.format(
+        id=q["id"], text=q["text"],
+        answers="".join(QUESTION_ANSWER.format(correct="true" if a["correct"] else "false", text=a["text"])
+                        for a in q["answers"])) for q in questions)
+
+
+class MockCanvas:
+    """Serves synthetic courses over HTTP on a local port. `validation_delay` is how long a started link validation
+    takes to complete, in seconds.
+    If `rate_limit` is given, API requests are rate limited with that quota, each costing `request_cost` and taking
+    `api_delay` seconds. `throttled` counts the refused requests."""
+
+    def __init__(self, courses, host="127.0.0.1", port=0, validation_delay=0, rate_limit=None, request_cost=5,
+                 api_delay=0):
+        self.courses = {course.course_id: course for course in courses}
+        self.validation_delay = validation_delay
+        self.rate_limit = rate_limit
+        self.request_cost = request_cost
+        self.api_delay = api_delay
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.throttled = 0
+        self.__used = 0
+        self.__leaked_at = time.monotonic()
+        self.__server = ThreadingHTTPServer((host, port), make_handler(self))
+        self.__server.daemon_threads = True
+        self.__thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.__server.server_address[:2]
+        return "http://{}:{}".format(host, port)
+
+    def start(self):
+        self.__thread = threading.Thread(target=self.__server.serve_forever, daemon=True)
+        self.__thread.start()
+        return self
+
+    def stop(self):
+        self.__server.shutdown()
+        self.__server.server_close()
+
+    def __leak(self):
+        now = time.monotonic()
+        self.__used = max(0.0, self.__used - (now - self.__leaked_at) * LEAK_RATE)
+        self.__leaked_at = now
+
+    def start_request(self):
+        """Take the up front cost of an API request from the quota. Returns False if the request is throttled."""
+        with self.lock:
+            self.__leak()
+            if self.__used + PREFLIGHT_COST > self.rate_limit:
+                self.throttled += 1
+                return False
+            self.__used += PREFLIGHT_COST
+            return True
+
+    def finish_request(self):
+        """Replace the up front cost of an API request with its real cost. Returns its rate limit headers."""
+        with self.lock:
+            self.__leak()
+            self.__used += self.request_cost - PREFLIGHT_COST
+            return {"X-Request-Cost": "{:.1f}".format(self.request_cost),
+                    "X-Rate-Limit-Remaining": "{:.1f}".format(self.rate_limit - self.__used)}
+
+    def count_xid_references(self):
+        with self.lock:
+            return sum(course.count_xid_references() for course in self.courses.values())
+
+
+def make_handler(canvas):
+    """Returns a request handler class serving the given MockCanvas."""
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+        def __send(self, status, body, content_type="text/html; charset=utf-8", headers=None):
+            data = body if isinstance(body, bytes) else body.encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(data)))
+            # Cookies so API clients created from a browser session have something to share
+            self.send_header("Set-Cookie", "canvas_session=mock; Path=/")
+            self.send_header("Set-Cookie", "_csrf_token=mock%3Dtoken; Path=/")
+            for name, value in dict(self.__rate_headers, **(headers or {})).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(data)
+
+        def __json(self, value, headers=None):
+            self.__send(200, json.dumps(value), "application/json", headers)
+
+        def __page(self, course, title, body, script=""):
+            self.__send(200, DOCUMENT.format(title=html.escape(title), course_id=course.course_id,
+                                             script=EDITOR_SCRIPT + script, body=body))
+
+        def __not_found(self):
+            self.__send(404, DOCUMENT.format(title="Page Not Found", course_id=0, script="", body="Not found"))
+
+        def __form(self):
+            length = int(self.headers.get("Content-Length") or 0)
+            return urllib.parse.parse_qs(self.rfile.read(length).decode("utf-8"))
+
+        def __route(self, method):
+            with canvas.lock:
+                canvas.requests += 1
+            self.__rate_headers = {}
+            url = urllib.parse.urlsplit(self.path)
+            query = urllib.parse.parse_qs(url.query)
+            if url.path == "/robots.txt":
+                return self.__send(200, "User-agent: *\n", "text/plain")
+
+            match = re.match(r"^(/api/v1)?/courses/(\d+)(/.*)?$", url.path)
+            course = canvas.courses.get(match.group(2)) if match else None
+            if course is None:
+                return self.__not_found()
+            if match.group(1):
+                if canvas.rate_limit is not None and not canvas.start_request():
+                    return self.__send(403, "403 Forbidden (Rate Limit Exceeded)", "text/plain",
+                                       {"X-Rate-Limit-Remaining": "0.0"})
+                time.sleep(canvas.api_delay)
+                if canvas.rate_limit is not None:
+                    self.__rate_headers = canvas.finish_request()
+            with canvas.lock:
+                if match.group(1):
+                    return self.__api(method, course, match.group(3) or "", query)
+                return self.__ui(method, course, match.group(3) or "")
+
+        def __ui(self, method, course, path):
+            prefix = "/courses/{}".format(course.course_id)
+            if path == "":
+                return self.__page(course, "Course {}".format(course.course_id),
+                                   '<a href="{}/settings">Settings</a>'.format(prefix))
+            if path == "/settings":
+                return self.__page(course, "Course Settings",
+                                   '<a href="{}/link_validator">Validate Links in Content</a>'.format(prefix))
+            if path == "/link_validator":
+                results = "".join(
+                    '<div class="result"><h2><a href="{}">Item</a></h2><span>{}</span><ul>{}</ul></div>'.format(
+                        issue["content_url"], ISSUE_LABELS[issue["type"]],
+                        "".join('<li><a href="{0}">{0}</a></li>'.format(html.escape(link["url"]))
+                                for link in issue["invalid_links"]))
+                    for issue in course.get_issues())
+                return self.__page(course, "Link Validator",
+                                   '<a href="#">Link Validation</a><div id="results">{}</div>'.format(results))
+            if path == "/link_validation":
+                return self.__link_validation(method, course)
+
+            match = re.match(r"^/(pages|assignments|discussion_topics)/([^/]+)$", path)
+            if match:
+                collection, item_id = match.groups()
+                bodies, edit_class, form_field = ITEM_PAGES[collection]
+                body = getattr(course, bodies).get(item_id)
+                if body is None:
+                    return self.__not_found()
+                api_url = "/api/v1{}/{}/{}".format(prefix, collection, item_id)
+                return self.__page(course, "Item", ITEM_BODY.format(content=body, edit_class=edit_class,
+                                                                   api_url=api_url, form_field=form_field))
+
+            match = re.match(r"^/(question_banks|quizzes)/(\d+)(/questions/(\d+))?$", path)
+            if match:
+                questions = (course.banks if match.group(1) == "question_banks" else course.quizzes).get(
+                    match.group(2))
+                if questions is None:
+                    return self.__not_found()
+                if method == "POST" and match.group(4):
+                    return self.__save_question(questions, int(match.group(4)))
+                script = QUESTIONS_SCRIPT + 'var QUESTIONS_URL = "{}{}";'.format(prefix, match.group(0))
+                if match.group(1) == "question_banks":
+                    return self.__page(course, "Question Bank", render_questions(questions), script)
+                # Quizzes only list their questions after opening the editor and its Questions tab
+                body = ('<button class="edit_assignment_link" onclick="this.nextElementSibling.hidden = false">'
+                        'Edit</button><a href="#" hidden onclick="document.getElementById(\'questions\').innerHTML'
+                        ' = QUESTIONS; return false">Questions</a><div id="questions"></div>'
+                        '<script>var QUESTIONS = {};</script>'.format(json.dumps(render_questions(questions))))
+                return self.__page(course, "Quiz", body, script)
+            if re.match(r"^/files/\d+/preview$", path):
+                return self.__send(200, PNG, "image/png")
+            return self.__not_found()
+
+        def __save_question(self, questions, question_id):
+            form = self.__form()
+            for question in questions:
+                if question["id"] == question_id:
+                    question["text"] = form.get("text", [""])[0]
+                    for answer, text in zip(question["answers"], json.loads(form.get("answers", ["[]"])[0])):
+                        answer["text"] = text
+                    return self.__json(question)
+            return self.__not_found()
+
+        def __link_validation(self, method, course):
+            if method == "POST":
+                course.validation_state = "running"
+                course.validation_ready = time.time() + canvas.validation_delay
+                return self.__json({})
+            if course.validation_state == "running" and time.time() >= course.validation_ready:
+                course.validation_state = "completed"
+            if course.validation_state != "completed":
+                return self.__json({"workflow_state": course.validation_state})
+            completed_at = datetime.datetime.fromtimestamp(course.validation_ready, datetime.timezone.utc)
+            return self.__json({"workflow_state": "completed", "updated_at": completed_at.isoformat(),
+                                "results": {"issues": course.get_issues()}})
+
+        def __api(self, method, course, path, query):
+            if path == "/files":
+                files = course.files
+                search = query.get("search_term", [""])[0]
+                if search:
+                    files = [f for f in files if search.lower() in f["display_name"].lower()]
+                per_page = int(query.get("per_page", [PAGE_SIZE])[0])
+                page = int(query.get("page", [1])[0])
+                listed = [dict(f, url="/courses/{}/files/{}/preview".format(course.course_id, f["id"]))
+                          for f in files[(page - 1) * per_page:page * per_page]]
+                headers = {}
+                if page * per_page < len(files):
+                    headers["Link"] = '<{}/api/v1/courses/{}/files?page={}&per_page={}>; rel="next"'.format(
+                        canvas.base_url, course.course_id, page + 1, per_page)
+                return self.__json(listed, headers)
+
+            match = re.match(r"^/files/(\d+)$", path)
+            if match:
+                file = next((f for f in course.files if str(f["id"]) == match.group(1)), None)
+                return self.__json(file) if file is not None else self.__not_found()
+
+            match = re.match(r"^/quizzes/(\d+)/questions$", path)
+            if match:
+                questions = course.quizzes.get(match.group(1))
+                if questions is None:
+                    return self.__not_found()
+                return self.__json([{"id": q["id"], "question_text": q["text"],
+                                     "answers": [{"html": a["text"], "weight": 100 if a["correct"] else 0}
+                                                 for a in q["answers"]]} for q in questions])
+
+            match = re.match(r"^/(pages|assignments|discussion_topics)/([^/]+)$", path)
+            if match is None:
+                return self.__not_found()
+            collection, item_id = match.groups()
+            bodies, _, form_field = ITEM_PAGES[collection]
+            items = getattr(course, bodies)
+            if item_id not in items:
+                return self.__not_found()
+            field = API_FIELDS[collection]
+            if method == "PUT":
+                items[item_id] = self.__form().get(form_field, [""])[0]
+            return self.__json({"id": item_id, field: items[item_id]})
+
+        def do_GET(self):
+            self.__route("GET")
+
+        def do_POST(self):
+            self.__route("POST")
+
+        def do_PUT(self):
+            self.__route("PUT")
+
+    return Handler
+
+
+# Link validation issue type -> label shown on the link validator page
+ISSUE_LABELS = {
+    "wiki_page": "Page",
+    "assignment": "Assignment",
+    "discussion_topic": "Discussion",
+    "assessment_question": "Assessment Question",
+    "quiz_question": "Quiz Question",
+}
+
+# Item collection -> (SyntheticCourse attribute, edit button class, form field of the update)
+ITEM_PAGES = {
+    "pages": ("pages", "edit-wiki", "wiki_page[body]"),
+    "assignments": ("assignments", "edit_assignment_link", "assignment[description]"),
+    "discussion_topics": ("discussions", "edit-btn", "message"),
+}
+
+API_FIELDS = {"pages": "body", "assignments": "description", "discussion_topics": "message"}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve synthetic courses as a local mock Canvas.")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--courses", type=int, default=1, help="number of courses, numbered from 1")
+    parser.add_argument("--items", type=int, default=20, help="items per course")
+    parser.add_argument("--questions", type=int, default=5, help="questions per question bank or quiz")
+    parser.add_argument("--xids", type=int, default=2, help="xid images per broken item")
+    args = parser.parse_args()
+
+    courses = [SyntheticCourse(str(i), args.items, args.questions, args.xids) for i in range(1, args.courses + 1)]
+    canvas = MockCanvas(courses, port=args.port)
+    print("Mock Canvas running at {}, set CANVAS_BASE_URL to use it".format(canvas.base_url))
+    canvas.start()
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        canvas.stop()
+
+
+if __name__ == "__main__":
+    main()
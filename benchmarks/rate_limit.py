@@ -0,0 +1,102 @@
+import argparse
+import asyncio
+import threading
+import time
+
+import requests
+
+from benchmarks.mock_canvas import MockCanvas, SyntheticCourse, RATE_LIMIT
+from canvas_api import CanvasAPI, CanvasAPIException
+
+##
+#
+#   This file checks the rate limited HTTP client (http_client.py) against the mock Canvas with its rate limit turned
+#   on: many threads (or asyncio tasks) read item bodies at once, and the run reports how many requests Canvas
+#   throttled, how many calls still failed and the throughput. `--naive` sends the same requests with a plain
+#   requests session for comparison. Run it from the repository root with `python3 -m benchmarks.rate_limit -h`.
+#
+##
+
+
+def get_paths(course):
+    return ["/api/v1/courses/{}/pages/{}".format(course.course_id, url) for url in course.pages] + \
+           ["/api/v1/courses/{}/assignments/{}".format(course.course_id, i) for i in course.assignments]
+
+
+def run_threads(canvas, paths, threads, requests_per_thread, naive):
+    """Send the requests from threads. Returns the number of calls that failed and the rate limiter used."""
+    failures = []
+    api = CanvasAPI(canvas.base_url, token="benchmark")
+    session = requests.Session()
+
+    def work(offset):
+        for i in range(requests_per_thread):
+            path = paths[(offset + i) % len(paths)]
+            if naive:
+                if session.get(canvas.base_url + path).status_code >= 400:
+                    failures.append(path)
+                continue
+            try:
+                api.get(path[len("/api/v1"):])
+            except CanvasAPIException:
+                failures.append(path)
+
+    workers = [threading.Thread(target=work, args=(t,)) for t in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return len(failures), api.get_client().get_limiter()
+
+
+def run_tasks(canvas, paths, tasks, requests_per_task):
+    """Send the requests from asyncio tasks. Returns the number of calls that failed and the rate limiter used."""
+    api = CanvasAPI(canvas.base_url, token="benchmark")
+    client = api.get_client()
+
+    async def work(offset):
+        failed = 0
+        for i in range(requests_per_task):
+            response = await client.request_async("GET", canvas.base_url + paths[(offset + i) % len(paths)])
+            failed += response.status_code >= 400
+        return failed
+
+    async def run():
+        return sum(await asyncio.gather(*(work(t) for t in range(tasks))))
+
+    return asyncio.run(run()), client.get_limiter()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check the HTTP client against a rate limited mock Canvas.")
+    parser.add_argument("--threads", type=int, default=16, help="threads (or tasks) sending requests at once")
+    parser.add_argument("--requests", type=int, default=20, help="requests per thread")
+    parser.add_argument("--cost", type=float, default=1, help="quota each request costs")
+    parser.add_argument("--delay", type=float, default=0.05, help="seconds each request takes")
+    parser.add_argument("--rate-limit", type=float, default=RATE_LIMIT, help="quota of the mock Canvas")
+    parser.add_argument("--naive", action="store_true", help="use a plain requests session instead of the client")
+    parser.add_argument("--async", dest="use_async", action="store_true", help="send requests from asyncio tasks")
+    args = parser.parse_args()
+
+    course = SyntheticCourse("1", items=50)
+    canvas = MockCanvas([course], rate_limit=args.rate_limit, request_cost=args.cost, api_delay=args.delay).start()
+    paths = get_paths(course)
+
+    start = time.perf_counter()
+    if args.use_async:
+        failed, limiter = run_tasks(canvas, paths, args.threads, args.requests)
+    else:
+        failed, limiter = run_threads(canvas, paths, args.threads, args.requests, args.naive)
+    elapsed = time.perf_counter() - start
+    canvas.stop()
+
+    total = args.threads * args.requests
+    print("{} calls in {:.1f} s: {:.0f} calls/s, {} failed".format(total, elapsed, total / elapsed, failed))
+    print("Requests throttled by Canvas: {}".format(canvas.throttled))
+    if not args.naive:
+        print("Requests sent: {}, final concurrency limit: {}, quota left: {}".format(
+            limiter.requests, limiter.get_limit(), limiter.remaining))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+import argparse
+import random
+import timeit
+
+from bs4 import BeautifulSoup as bs
+
+from xid_scanner import get_xid_image_name, replace_xid_images
+
+##
+#
+#   This file compares the single pass xid scanner (xid_scanner.py) with the BeautifulSoup tree walk it replaced, on
+#   large synthetic documents. Run it from the repository root with `python3 -m benchmarks.scanner`.
+#
+##
+
+PARAGRAPH = "<p>Lorem ipsum <b>dolor</b> sit amet, <a href=\"/courses/1/pages/intro\">consectetur</a> adipiscing.</p>\n"
+IMAGE = "<img src=\"/courses/1/file_contents/course%20files/xid-{0}_1/image{0}\" alt=\"Image {0}\">\n"
+CLEAN_IMAGE = "<img src=\"/courses/1/files/{0}/preview\" alt=\"File {0}\">\n"
+
+
+def make_document(size, xid_ratio, seed=0):
+    """Returns a synthetic HTML document of about `size` bytes where `xid_ratio` of the elements are xid images."""
+    rng = random.Random(seed)
+    parts = []
+    length = 0
+    i = 0
+    while length < size:
+        roll = rng.random()
+        if roll < xid_ratio:
+            part = IMAGE.format(i)
+        elif roll < 2 * xid_ratio:
+            part = CLEAN_IMAGE.format(i)
+        else:
+            part = PARAGRAPH
+        parts.append(part)
+        length += len(part)
+        i += 1
+    return "<div>\n" + "".join(parts) + "</div>"
+
+
+def resolve_image(image_name):
+    return "<img src=\"/courses/1/files/{0}/preview\" alt=\"{0}\" />".format(image_name)
+
+
+def replace_xid_images_soup(html, resolve_image):
+    """The BeautifulSoup implementation of `replace_xid_images` that the scanner replaced, for comparison."""
+    soup = bs(html, "html.parser")
+    images = [img for img in soup.find_all("img") if "xid" in (img.get("src") or "")]
+    if len(images) == 0:
+        return html, 0
+
+    replacements = {}
+    for image in images:
+        image_name = get_xid_image_name(image["src"])
+        if image_name not in replacements:
+            replacements[image_name] = resolve_image(image_name)
+
+    for image in images:
+        image.replaceWith(bs(replacements[get_xid_image_name(image["src"])], "html.parser"))
+    return str(soup), len(images)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the xid scanner against BeautifulSoup.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000],
+                        help="document sizes in bytes")
+    parser.add_argument("--xid-ratio", type=float, default=0.05, help="share of elements that are xid images")
+    parser.add_argument("--repeat", type=int, default=5, help="runs per measurement, the best one is kept")
+    args = parser.parse_args()
+
+    print("{:>10}{:>8}{:>14}{:>14}{:>10}".format("bytes", "xids", "soup (ms)", "scanner (ms)", "speedup"))
+    for size in args.sizes:
+        document = make_document(size, args.xid_ratio)
+        _, xids = replace_xid_images(document, resolve_image)
+        soup_count = replace_xid_images_soup(document, resolve_image)[1]
+        if soup_count != xids:
+            print("Warning: the scanner found {} xid images, BeautifulSoup found {}".format(xids, soup_count))
+
+        soup = min(timeit.repeat(lambda: replace_xid_images_soup(document, resolve_image), number=1,
+                                 repeat=args.repeat))
+        scanner = min(timeit.repeat(lambda: replace_xid_images(document, resolve_image), number=1,
+                                    repeat=args.repeat))
+        print("{:>10}{:>8}{:>14.2f}{:>14.2f}{:>9.1f}x".format(size, xids, soup * 1000, scanner * 1000,
+                                                              soup / scanner))
+
+
+if __name__ == "__main__":
+    main()
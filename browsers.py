@@ -0,0 +1,229 @@
+import functools
+import os
+import threading
+
+import psutil
+from selenium import webdriver
+from selenium.common.exceptions import WebDriverException
+from selenium.webdriver.chrome.options import Options
+from selenium.webdriver.chrome.service import Service
+from webdriver_manager.chrome import ChromeDriverManager
+
+GOOGLE_CHROME_PATH = os.environ.get('GOOGLE_CHROME_BIN', "/app/.apt/usr/bin/google_chrome")
+
+MAX_ITEMS_PER_BROWSER = 500
+MAX_BROWSER_RSS_MB = 1500
+
+##
+#
+#   This file manages the headless Chrome browsers used by the fixer.
+#   The ChromeDriver binary is resolved once per process, and a pool keeps browsers running between runs so a new
+#   run doesn't pay for a cold start. Browsers are health-checked when handed out and replaced once they have handled
+#   too many items or grown too large.
+#
+##
+
+
+@functools.lru_cache(maxsize=None)
+def resolve_driver_path():
+    """Returns the path to the ChromeDriver binary, downloading it if needed. Only resolved once per process."""
+    return ChromeDriverManager().install()
+
+
+def create_browser(log_network=False):
+    """Start a new headless Chrome browser.
+    `log_network` enables the performance log that ResourceFilter reads its counters from."""
+    options = Options()
+    options.add_argument("--window-size=1920,1080")
+    options.add_argument("--start-maximized")
+    options.add_argument('--no-sandbox')
+    options.add_argument('--disable-gpu')
+    options.add_argument('--disable-dev-shm-usage')
+    options.binary_location = GOOGLE_CHROME_PATH
+    options.headless = True
+    if log_network:
+        options.set_capability("goog:loggingPrefs", {"performance": "ALL"})
+    service = Service(resolve_driver_path())
+    return webdriver.Chrome(service=service, options=options)
+
+
+def get_browser_rss_mb(driver):
+    """Returns the memory used by a browser and all of its processes in megabytes, or 0 if it can't be measured."""
+    try:
+        process = psutil.Process(driver.service.process.pid)
+        processes = [process] + process.children(recursive=True)
+    except (AttributeError, psutil.Error):
+        return 0
+
+    total = 0
+    for p in processes:
+        try:
+            total += p.memory_info().rss
+        except psutil.Error:
+            continue
+    return total / (1024 * 1024)
+
+
+def is_healthy(driver):
+    """Return true if the browser still responds to commands."""
+    try:
+        driver.current_url
+    except WebDriverException:
+        return False
+    return True
+
+
+def quit_browser(driver):
+    """Quit a browser, ignoring errors from browsers that have already died."""
+    try:
+        driver.quit()
+    except WebDriverException:
+        pass
+
+
+class BrowserPool:
+    """A pool of up to `max_size` browsers, `warm` of which are started ahead of time.
+    Browsers are replaced after `max_items` items or once they use more than `max_rss_mb` megabytes."""
+
+    def __init__(self, max_size, warm=1, create=create_browser, max_items=MAX_ITEMS_PER_BROWSER,
+                 max_rss_mb=MAX_BROWSER_RSS_MB):
+        self.__max_size = max_size
+        self.__warm = min(warm, max_size)
+        self.__create = create
+        self.__max_items = max_items
+        self.__max_rss_mb = max_rss_mb
+        self.__idle = []
+        self.__items = {}
+        self.__count = 0
+        self.__closed = False
+        self.__condition = threading.Condition()
+
+    def get_max_size(self):
+        return self.__max_size
+
+    def prewarm(self):
+        """Start browsers in the background until `warm` of them are idle."""
+        threading.Thread(target=self.__fill, daemon=True).start()
+
+    def __fill(self):
+        while True:
+            with self.__condition:
+                if self.__closed or len(self.__idle) >= self.__warm or self.__count >= self.__max_size:
+                    return
+                self.__count += 1
+            try:
+                self.__add_idle(self.__start_browser())
+            except Exception as e:
+                print("Unable to prewarm a browser: {}".format(e))
+                return
+
+    def __start_browser(self):
+        try:
+            driver = self.__create()
+        except Exception:
+            with self.__condition:
+                self.__count -= 1
+                self.__condition.notify_all()
+            raise
+        self.__items[id(driver)] = 0
+        return driver
+
+    def __add_idle(self, driver):
+        with self.__condition:
+            self.__idle.append(driver)
+            self.__condition.notify_all()
+
+    def __discard(self, driver):
+        """Quit a browser of the pool. Browsers that were already discarded are only quit again."""
+        quit_browser(driver)
+        with self.__condition:
+            if self.__items.pop(id(driver), None) is not None:
+                self.__count -= 1
+            self.__condition.notify_all()
+
+    def acquire(self, timeout=None):
+        """Returns a healthy browser, starting one if the pool isn't full and waiting for one otherwise.
+        Returns None if no browser became available within `timeout` seconds."""
+        while True:
+            with self.__condition:
+                if not self.__condition.wait_for(lambda: self.__idle or self.__count < self.__max_size, timeout):
+                    return None
+                driver = self.__idle.pop() if self.__idle else None
+                if driver is None:
+                    self.__count += 1
+
+            if driver is None:
+                driver = self.__start_browser()
+            elif not is_healthy(driver):
+                print("Replacing a browser that stopped responding")
+                self.__discard(driver)
+                continue
+
+            # Keep a browser ready for the next run
+            self.prewarm()
+            return driver
+
+    def should_recycle(self, driver):
+        """Return true if a browser has handled too many items or uses too much memory."""
+        return self.__items.get(id(driver), 0) >= self.__max_items or get_browser_rss_mb(driver) > self.__max_rss_mb
+
+    def add_items(self, driver, items=1):
+        """Count items handled by a browser that is in use, so `should_recycle` knows about them right away."""
+        if id(driver) in self.__items:
+            self.__items[id(driver)] += items
+
+    def release(self, driver):
+        """Return a browser to the pool.
+        Browsers are cleaned up before being reused and replaced if they need recycling."""
+        if id(driver) not in self.__items:
+            # Already discarded, for example by a `replace` that failed
+            quit_browser(driver)
+            return
+        if self.__closed:
+            self.__discard(driver)
+            return
+        if not is_healthy(driver) or self.should_recycle(driver):
+            print("Recycling browser")
+            self.__discard(driver)
+            self.prewarm()
+            return
+
+        try:
+            # Close stray tabs and forget the previous run's login
+            for handle in driver.window_handles[1:]:
+                driver.switch_to.window(handle)
+                driver.close()
+            driver.switch_to.window(driver.window_handles[0])
+            driver.delete_all_cookies()
+            driver.get("about:blank")
+        except WebDriverException:
+            self.__discard(driver)
+            self.prewarm()
+            return
+        self.__add_idle(driver)
+
+    def renew(self, driver):
+        """Release a browser that is still in use and acquire another if it needs recycling.
+        Returns the browser to keep using."""
+        if is_healthy(driver) and not self.should_recycle(driver):
+            return driver
+        self.release(driver)
+        return self.acquire()
+
+    def replace(self, driver):
+        """Replace a browser that is still in use, without checking whether it needs recycling again.
+        The new browser is started before the old one is quit, so if it can't be started the exception is raised
+        and the old browser is left as it was. Returns the new browser."""
+        with self.__condition:
+            self.__count += 1
+        new_driver = self.__start_browser()
+        self.__discard(driver)
+        return new_driver
+
+    def close(self):
+        """Quit every idle browser. Browsers that are in use are quit when they are released."""
+        with self.__condition:
+            self.__closed = True
+            idle, self.__idle = self.__idle, []
+        for driver in idle:
+            self.__discard(driver)
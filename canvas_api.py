@@ -0,0 +1,200 @@
+import html
+import os
+import re
+import urllib.parse
+
+import requests
+
+from http_client import HTTPClient, get_rate_limiter
+
+##
+#
+#   This file contains a small client for the Canvas REST API.
+#   It is used by the "api" backend of the XID Fixer, which edits item bodies directly instead of driving
+#   the rich content editor in the browser. It can authenticate with either an access token or the cookies
+#   of a browser session that is already logged into Canvas. Requests go through the rate limited HTTP client in
+#   http_client.py.
+#
+##
+
+PAGE_SIZE = 100
+
+# Item type -> (API collection, field holding the HTML body, form field used to update it)
+ITEM_ENDPOINTS = {
+    "page": ("pages", "body", "wiki_page[body]"),
+    "assignment": ("assignments", "description", "assignment[description]"),
+    "discussion": ("discussion_topics", "message", "message"),
+}
+
+ITEM_URL_PATTERN = re.compile(r"/courses/(\d+)/(pages|assignments|discussion_topics)/([^/?#]+)")
+
+
+class CanvasAPIException(Exception):
+    """Exception raised when a Canvas API request fails."""
+
+    def __init__(self, message, status_code=None):
+        self.message = message
+        self.status_code = status_code
+
+    def __str__(self):
+        return self.message
+
+
+def parse_item_url(url):
+    """Returns a tuple of the course ID and item ID (or page URL) for a Canvas item link.
+    Raises a CanvasAPIException if the link is not a page, assignment or discussion."""
+    match = ITEM_URL_PATTERN.search(urllib.parse.urlparse(url).path)
+    if match is None:
+        raise CanvasAPIException("Unable to parse item link {}.".format(url))
+    return match.group(1), match.group(3)
+
+
+class CanvasAPI:
+    """Client for the subset of the Canvas REST API used by the fixer."""
+
+    def __init__(self, base_url, token=None, cookies=None):
+        self.__base_url = base_url.rstrip("/")
+        self.__client = HTTPClient(get_rate_limiter(self.__base_url))
+        self.__session = self.__client.get_session()
+        self.__session.headers["Accept"] = "application/json"
+
+        if token:
+            self.__session.headers["Authorization"] = "Bearer {}".format(token)
+
+        for cookie in cookies or []:
+            self.__session.cookies.set(cookie["name"], cookie["value"], domain=cookie.get("domain"),
+                                       path=cookie.get("path", "/"))
+            # Browser sessions must echo Canvas's CSRF cookie back as a header on writes
+            if cookie["name"] == "_csrf_token":
+                self.__session.headers["X-CSRF-Token"] = urllib.parse.unquote(cookie["value"])
+
+    @classmethod
+    def from_driver(cls, driver, base_url):
+        """Create an API client that shares the session of a logged in Selenium driver."""
+        return cls(base_url, cookies=driver.get_cookies())
+
+    def get_base_url(self):
+        return self.__base_url
+
+    def get_client(self):
+        return self.__client
+
+    @staticmethod
+    def __check(url, response):
+        if response.status_code >= 400:
+            raise CanvasAPIException("Request to {} failed with status {}.".format(url, response.status_code),
+                                     response.status_code)
+        return response
+
+    def __send(self, method, url, **kwargs):
+        """Send a request and return the response, raising a CanvasAPIException on failure."""
+        try:
+            response = self.__client.request(method, url, **kwargs)
+        except requests.RequestException as e:
+            raise CanvasAPIException("Request to {} failed: {}".format(url, e))
+        return self.__check(url, response)
+
+    def __request(self, method, path, **kwargs):
+        """Send a request to the API and return the decoded JSON response."""
+        return self.__send(method, self.__base_url + "/api/v1" + path, **kwargs).json()
+
+    def get(self, path, params=None):
+        return self.__request("GET", path, params=params)
+
+    def get_paginated(self, path, params=None):
+        """Yield every entry of a paginated list endpoint, following the `next` links Canvas returns."""
+        params = dict(params or {})
+        params.setdefault("per_page", PAGE_SIZE)
+        url = self.__base_url + "/api/v1" + path
+        try:
+            for response in self.__client.iter_pages(url, params=params):
+                yield from self.__check(response.url, response).json()
+        except requests.RequestException as e:
+            raise CanvasAPIException("Request to {} failed: {}".format(url, e))
+
+    def put(self, path, data=None):
+        return self.__request("PUT", path, data=data)
+
+    def get_html(self, url):
+        """Returns the HTML of a Canvas page (outside of the API), as the logged in user sees it."""
+        return self.__send("GET", url, headers={"Accept": "text/html"}).text
+
+    def get_link_validation(self, course_id):
+        """Returns the progress of the course's link validation job, or an empty dict if it was never run.
+        Note that link validation lives outside of the /api/v1 namespace."""
+        return self.__send("GET", "{}/courses/{}/link_validation".format(self.__base_url, course_id)).json()
+
+    def start_link_validation(self, course_id):
+        """Queue a new link validation job for the course."""
+        self.__send("POST", "{}/courses/{}/link_validation".format(self.__base_url, course_id))
+
+    def get_item_body(self, course_id, item_type, item_id):
+        """Returns the HTML body of a page, assignment or discussion."""
+        collection, field, _ = ITEM_ENDPOINTS[item_type]
+        item = self.get("/courses/{}/{}/{}".format(course_id, collection, item_id))
+        return item.get(field) or ""
+
+    def update_item_body(self, course_id, item_type, item_id, body):
+        """Replace the HTML body of a page, assignment or discussion."""
+        collection, _, form_field = ITEM_ENDPOINTS[item_type]
+        self.put("/courses/{}/{}/{}".format(course_id, collection, item_id), data={form_field: body})
+
+    def find_course_file(self, course_id, name):
+        """Returns the course file whose name matches `name`, or None if it has not been uploaded."""
+        files = self.get("/courses/{}/files".format(course_id), params={"search_term": name})
+        for file in files:
+            if name in (file.get("display_name"), file.get("filename")):
+                return file
+        for file in files:
+            if name in file.get("display_name", ""):
+                return file
+        return None
+
+    def get_file_image_markup(self, course_id, file):
+        """Returns the `<img>` markup the rich content editor inserts for a course file."""
+        return ('<img src="{0}/courses/{1}/files/{2}/preview" alt="{3}" '
+                'data-api-endpoint="{0}/api/v1/courses/{1}/files/{2}" data-api-returntype="File" />').format(
+            self.__base_url, course_id, file["id"], html.escape(file.get("display_name", "")))
+
+
+class FileNameIndex:
+    """Index of files by name, matching xid image names with or without their file extension."""
+
+    def __init__(self):
+        self.__files = {}
+
+    def __len__(self):
+        return len(self.__files)
+
+    def add(self, name, file):
+        """Index a file under a name. The first file added under a name wins."""
+        if not name:
+            return
+        self.__files.setdefault(name, file)
+        # xid sources usually omit the extension of the uploaded file
+        self.__files.setdefault(os.path.splitext(name)[0], file)
+
+    def lookup(self, name):
+        """Returns the file with the given name, or None if there is no such file."""
+        return self.__files.get(name) or self.__files.get(urllib.parse.unquote(name))
+
+
+class CourseFileIndex(FileNameIndex):
+    """Index of a course's files by name, built once from the paginated file listing.
+    This replaces searching the "Course Images" panel of the rich content editor for every xid image."""
+
+    def __init__(self, api, course_id):
+        super().__init__()
+        self.__api = api
+        self.__course_id = course_id
+
+        for file in api.get_paginated("/courses/{}/files".format(course_id)):
+            self.add(file.get("display_name"), file)
+            self.add(file.get("filename"), file)
+
+    def get_image_markup(self, name):
+        """Returns the replacement `<img>` markup for the file with the given name, or None if it is missing."""
+        file = self.lookup(name)
+        if file is None:
+            return None
+        return self.__api.get_file_image_markup(self.__course_id, file)
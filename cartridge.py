@@ -0,0 +1,139 @@
+import html
+import posixpath
+import re
+import shutil
+import urllib.parse
+import zipfile
+from xml.sax.saxutils import escape
+
+from canvas_api import FileNameIndex
+from xid_scanner import replace_xid_images
+
+##
+#
+#   This file fixes xid images offline, in an exported course package (Common Cartridge .imscc or a plain zip)
+#   before it is imported into Canvas, instead of editing every item of a live course.
+#   Package entries are streamed one at a time into a new package: HTML entries are rewritten directly, HTML stored in
+#   XML entries (discussions, quizzes, ...) is unescaped, rewritten and escaped again, and everything else is copied
+#   as is. xid images are replaced with the file of the same name included in the package, using the same
+#   replacement logic as the live fixer.
+#
+##
+
+# Common Cartridge links to files in the package's web resources folder through this prefix
+FILE_BASE = "$IMS-CC-FILEBASE$"
+WEB_RESOURCES = "web_resources/"
+
+HTML_EXTENSIONS = (".html", ".htm")
+XML_EXTENSIONS = (".xml", ".qti")
+
+CDATA_PATTERN = re.compile(r"<!\[CDATA\[(.*?)\]\]>", re.DOTALL)
+# XML text between two tags. Escaped HTML can't contain "<", so this never spans markup.
+TEXT_PATTERN = re.compile(r">([^<]+)<")
+
+COPY_BUFFER_SIZE = 1024 * 1024
+
+
+class PackageFileIndex(FileNameIndex):
+    """Index of the files included in a course package by name.
+    Files are linked through the Common Cartridge file base, relative to the web resources folder."""
+
+    def __init__(self, names):
+        super().__init__()
+        for name in names:
+            if not name.endswith("/") and not name.lower().endswith(HTML_EXTENSIONS + XML_EXTENSIONS):
+                self.add(posixpath.basename(name), name)
+
+    def get_image_markup(self, name):
+        """Returns the replacement `<img>` markup for the included file with the given name, or None if there is
+        no such file."""
+        path = self.lookup(name)
+        if path is None:
+            return None
+        if path.startswith(WEB_RESOURCES):
+            path = path[len(WEB_RESOURCES):]
+        return '<img src="{}/{}" alt="{}" />'.format(FILE_BASE, urllib.parse.quote(path),
+                                                    html.escape(posixpath.basename(path)))
+
+
+def rewrite_html(text, resolve_image):
+    """Returns the HTML with its xid images replaced and the number of images replaced."""
+    if "xid" not in text:
+        return text, 0
+    return replace_xid_images(text, resolve_image)
+
+
+def rewrite_xml(text, resolve_image):
+    """Returns the XML with the xid images of the HTML it contains replaced, and the number of images replaced.
+    HTML is looked for in CDATA sections and escaped in text nodes. The rest of the document is left untouched."""
+    if "xid" not in text:
+        return text, 0
+    replaced = 0
+
+    def rewrite_text(match):
+        nonlocal replaced
+        if "xid" not in match.group(1) or "&lt;img" not in match.group(1):
+            return match.group(0)
+        content, count = rewrite_html(html.unescape(match.group(1)), resolve_image)
+        if count == 0:
+            return match.group(0)
+        replaced += count
+        return ">" + escape(content) + "<"
+
+    # Splitting on CDATA sections leaves their contents at odd indexes
+    parts = CDATA_PATTERN.split(text)
+    for i in range(len(parts)):
+        if i % 2 == 0:
+            parts[i] = TEXT_PATTERN.sub(rewrite_text, parts[i])
+        else:
+            content, count = rewrite_html(parts[i], resolve_image)
+            replaced += count
+            parts[i] = "<![CDATA[" + content + "]]>"
+    return "".join(parts), replaced
+
+
+def fix_package(source, destination):
+    """Write a copy of the course package at `source` to `destination` with its xid images replaced.
+    Returns a dict with the number of `entries` rewritten, images `replaced` and the `missing` image names that
+    have no matching file in the package."""
+    report = {"entries": 0, "replaced": 0, "missing": set()}
+
+    def resolve_image(name):
+        markup = index.get_image_markup(name)
+        if markup is None:
+            report["missing"].add(name)
+        return markup
+
+    with zipfile.ZipFile(source) as package, \
+            zipfile.ZipFile(destination, "w", compression=zipfile.ZIP_DEFLATED) as fixed:
+        index = PackageFileIndex(package.namelist())
+        for info in package.infolist():
+            name = info.filename.lower()
+            if name.endswith(HTML_EXTENSIONS):
+                rewrite = rewrite_html
+            elif name.endswith(XML_EXTENSIONS):
+                rewrite = rewrite_xml
+            else:
+                rewrite = None
+
+            if rewrite is not None:
+                try:
+                    text = package.read(info).decode("utf-8")
+                except UnicodeDecodeError:
+                    rewrite = None
+
+            if info.is_dir():
+                fixed.writestr(info, b"")
+                continue
+            if rewrite is None:
+                with package.open(info) as entry, fixed.open(info, "w") as copy:
+                    shutil.copyfileobj(entry, copy, COPY_BUFFER_SIZE)
+                continue
+
+            text, count = rewrite(text, resolve_image)
+            if count > 0:
+                report["entries"] += 1
+                report["replaced"] += count
+            fixed.writestr(info, text.encode("utf-8"))
+
+    return report
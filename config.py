@@ -0,0 +1,62 @@
+import os
+
+from browsers import MAX_BROWSER_RSS_MB, MAX_ITEMS_PER_BROWSER
+from discovery import SECONDS_PER_ITEM, get_seconds_per_item
+from memo import RewriteMemo, MAX_MEMO_BYTES
+from resource_filter import ResourceFilter, DEFAULT_BLOCKED_TYPES, DEFAULT_DENY_PATTERNS
+from timing import read_jsonl
+
+WARM_BROWSERS = int(os.environ.get('XID_WARM_BROWSERS', 1))
+JOURNAL_PATH = os.environ.get('XID_JOURNAL_PATH', "xid_journal.sqlite3")
+VALIDATION_CACHE_DIR = os.environ.get('XID_VALIDATION_CACHE_DIR', "link_validation_cache")
+# Set XID_BLOCK_RESOURCES to 1 to stop browsers from loading what the fixer never needs (see resource_filter.py)
+BLOCK_RESOURCES = os.environ.get('XID_BLOCK_RESOURCES', "0") == "1"
+WAIT_TIMEOUT_SCALE = float(os.environ.get('XID_WAIT_TIMEOUT_SCALE', 1.0))
+TIMINGS_PATH = os.environ.get('XID_TIMINGS_PATH')
+# Browsers are restarted between items once they use more memory or have handled more items than this
+BROWSER_RSS_MB = int(os.environ.get('XID_BROWSER_RSS_MB', MAX_BROWSER_RSS_MB))
+BROWSER_MAX_ITEMS = int(os.environ.get('XID_BROWSER_MAX_ITEMS', MAX_ITEMS_PER_BROWSER))
+# Set XID_MEMO_PATH to an empty string to turn the rewrite memo off
+MEMO_PATH = os.environ.get('XID_MEMO_PATH', "xid_memo.sqlite3")
+MEMO_MAX_MB = int(os.environ.get('XID_MEMO_MAX_MB', MAX_MEMO_BYTES // (1024 * 1024)))
+# An access token lets courses be listed through the Canvas API without logging in (see discovery.py)
+API_TOKEN = os.environ.get('CANVAS_API_TOKEN')
+
+##
+#
+#   This file contains the settings shared by every way of running the fixer (the worker processes behind the web UI
+#   and the command line), read from environment variables.
+#
+##
+
+
+def get_env_list(name, default):
+    """Returns a comma separated list from an environment variable."""
+    value = os.environ.get(name)
+    return default if value is None else [v.strip() for v in value.split(",") if v.strip()]
+
+
+def get_resource_filter():
+    """Returns the resource filter configured for this process, or None if resource blocking is disabled."""
+    if not BLOCK_RESOURCES:
+        return None
+    return ResourceFilter(blocked_types=get_env_list('XID_BLOCK_TYPES', DEFAULT_BLOCKED_TYPES),
+                          deny=get_env_list('XID_BLOCK_DENY', DEFAULT_DENY_PATTERNS),
+                          allow=get_env_list('XID_BLOCK_ALLOW', []))
+
+
+def get_memo():
+    """Returns the rewrite memo configured for this process, or None if it is turned off."""
+    if not MEMO_PATH:
+        return None
+    return RewriteMemo(MEMO_PATH, max_bytes=MEMO_MAX_MB * 1024 * 1024)
+
+
+def get_item_seconds():
+    """Returns the average time an item took in the timings file, or a rough guess if there are no timings."""
+    if TIMINGS_PATH and os.path.exists(TIMINGS_PATH):
+        with open(TIMINGS_PATH) as f:
+            seconds = get_seconds_per_item(read_jsonl(f))
+        if seconds is not None:
+            return seconds
+    return SECONDS_PER_ITEM
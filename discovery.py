@@ -0,0 +1,101 @@
+import heapq
+from collections import namedtuple
+
+from canvas_api import CanvasAPIException
+from link_validation import parse_link_validation_results
+
+##
+#
+#   This file finds the courses to fix and decides the order they are fixed in.
+#   Courses are listed through the Canvas API for an account or a term, and the work in each course is estimated from
+#   the xid items of its last link validation (from the local cache or the results Canvas already has, never by
+#   starting a new one). The queue is then ordered largest first, which keeps every worker busy until the end of
+#   the run, or smallest first, to get many courses done early, and an estimated finish time is worked out by
+#   simulating the workers taking courses off the queue.
+#
+##
+
+LARGEST_FIRST = "largest"
+SMALLEST_FIRST = "smallest"
+AS_GIVEN = "given"
+POLICIES = (LARGEST_FIRST, SMALLEST_FIRST, AS_GIVEN)
+
+# Rough costs used for estimates when there are no timings to go by
+SECONDS_PER_ITEM = 30
+SECONDS_PER_COURSE = 60
+
+# A course to fix. `items` is its estimated number of xid items and `known` is false if it had to be guessed.
+CourseEstimate = namedtuple("CourseEstimate", ["course", "name", "items", "known"])
+# A course in a schedule, with the estimated `start` and `finish` of its fix in seconds from the start of the run
+ScheduledCourse = namedtuple("ScheduledCourse", ["course", "name", "items", "known", "start", "finish"])
+
+
+def list_courses(api, account=None, term=None):
+    """Returns `(course ID, name)` for every course of an account, or of the user if there is no account,
+    optionally only those of an enrollment term."""
+    if account is not None:
+        params = {"enrollment_term_id": term} if term is not None else {}
+        courses = api.get_paginated("/accounts/{}/courses".format(account), params=params)
+    else:
+        courses = api.get_paginated("/courses", params={"enrollment_type": "teacher"})
+        if term is not None:
+            courses = (c for c in courses if str(c.get("enrollment_term_id")) == str(term))
+    return [(str(c["id"]), c.get("name") or "") for c in courses]
+
+
+def estimate_items(course_id, cache=None, api=None):
+    """Returns the number of xid items in a course from its last link validation, or None if it was never validated.
+    Cached results are used no matter their age, since they are only an estimate."""
+    entry = cache.get_entry(course_id) if cache is not None else None
+    if entry is not None:
+        return len(entry[1])
+    if api is None:
+        return None
+
+    try:
+        progress = api.get_link_validation(course_id)
+    except CanvasAPIException as e:
+        print("Unable to read the link validation of course {}: {}".format(course_id, e))
+        return None
+    if progress.get("workflow_state") != "completed":
+        return None
+    return len(parse_link_validation_results(progress.get("results"), api.get_base_url()))
+
+
+def estimate_courses(courses, cache=None, api=None):
+    """Returns a CourseEstimate for each `(course ID, name)`. Courses that were never validated are assumed to be
+    as large as the average known course."""
+    counts = [estimate_items(course_id, cache, api) for course_id, _ in courses]
+    known = [count for count in counts if count is not None]
+    average = round(sum(known) / len(known)) if known else 0
+    return [CourseEstimate(course_id, name, average if count is None else count, count is not None)
+            for (course_id, name), count in zip(courses, counts)]
+
+
+def get_seconds_per_item(timings):
+    """Returns the average time spent on an item in the given StageTimings, or None if no item was timed."""
+    items = {}
+    for timing in timings:
+        if timing.url is not None:
+            items[timing.url] = items.get(timing.url, 0) + timing.duration
+    return sum(items.values()) / len(items) if items else None
+
+
+def schedule(estimates, policy=LARGEST_FIRST, workers=1, seconds_per_item=SECONDS_PER_ITEM,
+             seconds_per_course=SECONDS_PER_COURSE):
+    """Order courses with a policy and estimate when each of them is done, with `workers` workers each taking the
+    next course off the queue as soon as they are free.
+    Returns a list of ScheduledCourses in queue order and the estimated length of the whole run in seconds."""
+    if policy == LARGEST_FIRST:
+        estimates = sorted(estimates, key=lambda e: e.items, reverse=True)
+    elif policy == SMALLEST_FIRST:
+        estimates = sorted(estimates, key=lambda e: e.items)
+
+    free_at = [0.0] * max(1, workers)
+    scheduled = []
+    for estimate in estimates:
+        start = heapq.heappop(free_at)
+        finish = start + seconds_per_course + estimate.items * seconds_per_item
+        heapq.heappush(free_at, finish)
+        scheduled.append(ScheduledCourse(*estimate, start, finish))
+    return scheduled, max(free_at)
@@ -0,0 +1,49 @@
+import json
+
+from xid_scanner import XID_ATTRIBUTES
+
+##
+#
+#   This file contains batched DOM queries for the fixer.
+#   Each query is a single `execute_script` call that returns a structured snapshot of the page (including the
+#   elements the fixer needs to interact with), instead of one WebDriver round trip per element and attribute.
+#
+##
+
+# Matches every element with an attribute that may hold an xid reference, like `find_xid_references` does
+XID_SELECTOR = ", ".join(["{}[{}*=xid]".format(tag, attribute) for tag, attributes in XID_ATTRIBUTES.items()
+                          for attribute in attributes] + ["[style*=xid]"])
+
+QUESTION_EDITOR_SCRIPT = """
+var hasXid = function (element) {
+    return element.querySelector(%s) !== null;
+};
+var form = document.getElementsByClassName("form_answers")[0];
+return {
+    editors: Array.prototype.map.call(document.getElementsByClassName("tox-edit-area__iframe"), function (editor) {
+        return {id: editor.id, element: editor};
+    }),
+    answers: Array.prototype.map.call(form ? form.getElementsByClassName("answer") : [], function (answer, index) {
+        return {
+            index: index,
+            xid: hasXid(answer),
+            correct: answer.classList.contains("correct_answer"),
+            visible: answer.offsetParent !== null,
+            element: answer
+        };
+    })
+};
+""" % json.dumps(XID_SELECTOR)
+
+
+def snapshot_question_editor(driver):
+    """Returns a snapshot of the open question editor: its rich content editors (`id`, `element`) and answers
+    (`index`, `xid`, `correct`, `visible`, `element`)."""
+    return driver.execute_script(QUESTION_EDITOR_SCRIPT)
+
+
+def question_editor_ready(driver):
+    """Returns a snapshot of the question editor once its rich content editors have loaded, False otherwise.
+    Meant to be used as a WebDriverWait condition."""
+    snapshot = snapshot_question_editor(driver)
+    return snapshot if len(snapshot["editors"]) > 0 else False
@@ -0,0 +1,114 @@
+from dataclasses import asdict, dataclass
+from typing import Any, Dict, Optional, Tuple
+
+from timing import StageTiming
+
+##
+#
+#   This file contains the events reported while fixing courses.
+#   `XIDFixer.do_course` yields them, `run_courses` merges the events of every worker, and the UI follows them to
+#   show progress. Every event carries the course it belongs to, so the events of concurrent courses can be told apart.
+#
+##
+
+# Progress kinds
+WAITING_FOR_DUO = "waiting_for_duo"
+DUO_SUCCESS = "duo_success"
+TOTAL_ITEMS = "total_items"
+
+# Item statuses
+ITEM_SUCCESS = "success"
+ITEM_FAILED = "failed"
+ITEM_SKIPPED = "skipped"
+
+# Error codes
+ERR_LOGIN_FAIL = "login_fail"
+ERR_LOGIN_NOT_INTERACTABLE = "login_not_interactable"
+ERR_DUO_FAIL = "duo_fail"
+ERR_COURSE_DNE = "course_dne"
+ERR_TIMEOUT_FAIL = "timeout_fail"
+ERR_BROWSER_FAIL = "browser_fail"
+# The login information of a queued job was lost when the UI restarted
+ERR_LOGIN_EXPIRED = "login_expired"
+
+# Errors that will happen again for every course, so there is no point in starting more courses
+FATAL_ERRORS = (ERR_LOGIN_FAIL, ERR_LOGIN_NOT_INTERACTABLE, ERR_DUO_FAIL)
+
+
+@dataclass(frozen=True)
+class CourseEvent:
+    course: str
+
+
+@dataclass(frozen=True)
+class CourseStarted(CourseEvent):
+    """A worker picked up the course."""
+
+
+@dataclass(frozen=True)
+class Progress(CourseEvent):
+    """The course reached a step of its fix. `value` is the item count for TOTAL_ITEMS and None otherwise."""
+    kind: str
+    value: Optional[int] = None
+
+
+@dataclass(frozen=True)
+class ItemResult(CourseEvent):
+    """An item was fixed, failed or skipped. `reason` explains failures and skips."""
+    url: str
+    status: str
+    reason: Optional[str] = None
+
+
+@dataclass(frozen=True)
+class ItemVerified(CourseEvent):
+    """A fixed item was read back after the course (see verify.py). It passed if no xid references
+    (`xid_references`) or broken image sources (`broken_images`) are left. `reason` explains unreadable items."""
+    url: str
+    passed: bool
+    xid_references: int = 0
+    broken_images: Tuple[str, ...] = ()
+    reason: Optional[str] = None
+
+
+@dataclass(frozen=True)
+class CourseError(CourseEvent):
+    """The course stopped early with one of the error codes above."""
+    code: str
+
+    @property
+    def fatal(self):
+        return self.code in FATAL_ERRORS
+
+
+@dataclass(frozen=True)
+class StageTimed(CourseEvent):
+    """A stage of the fix finished (see timing.py)."""
+    timing: StageTiming
+
+
+@dataclass(frozen=True)
+class ResourceUsage(CourseEvent):
+    """Requests blocked and loaded by an item (see ResourceFilter.collect)."""
+    counters: Dict[str, Any]
+
+
+@dataclass(frozen=True)
+class MemoUsage(CourseEvent):
+    """How many of the course's rewrites were reused from the memo (see memo.py) and how many were computed."""
+    hits: int
+    misses: int
+
+
+@dataclass(frozen=True)
+class CourseDone(CourseEvent):
+    """Every item of the course was attempted."""
+
+
+def event_to_dict(event):
+    """Returns a JSON serializable dict of an event's fields, with the event's class name as `type`."""
+    record = {"type": type(event).__name__}
+    record.update(asdict(event))
+    if isinstance(event, StageTimed):
+        record["timing"] = event.timing._asdict()
+    return record
@@ -1,4 +1,9 @@
+import os
+import re
 import time
+import urllib.parse
+from collections import namedtuple
+from concurrent.futures import TimeoutError as FutureTimeoutError
 from sys import platform
 
 from selenium import webdriver
@@ -7,13 +12,51 @@ from selenium.webdriver.common.by import By
 from selenium.webdriver.common.action_chains import ActionChains
 from selenium.webdriver.common.keys import Keys
 from selenium.common.exceptions import NoSuchElementException, TimeoutException, \
-    MoveTargetOutOfBoundsException, ElementNotInteractableException, ElementClickInterceptedException
-import selenium.webdriver.support.ui as ui
+    MoveTargetOutOfBoundsException, ElementNotInteractableException, ElementClickInterceptedException, \
+    NoAlertPresentException, WebDriverException
 from bs4 import BeautifulSoup as bs
 
+from browsers import get_browser_rss_mb, is_healthy
+
+from canvas_api import CanvasAPI, CanvasAPIException, CourseFileIndex, ITEM_ENDPOINTS, parse_item_url
+from dom_queries import question_editor_ready
+from events import CourseDone, CourseError, ItemResult, MemoUsage, Progress, ResourceUsage, StageTimed, \
+    WAITING_FOR_DUO, DUO_SUCCESS, TOTAL_ITEMS, ITEM_SUCCESS, ITEM_FAILED, ITEM_SKIPPED, ERR_LOGIN_FAIL, \
+    ERR_LOGIN_NOT_INTERACTABLE, ERR_DUO_FAIL, ERR_COURSE_DNE, ERR_TIMEOUT_FAIL, ERR_BROWSER_FAIL
+from journal import COMPLETED, FAILED
+from timing import StageTimer, STAGE_LOGIN, STAGE_DUO_WAIT, STAGE_VALIDATOR_REFRESH, STAGE_NAVIGATION, \
+    STAGE_EDITOR_OPEN, STAGE_IMAGE_RESOLUTION, STAGE_SAVE, STAGE_VERIFICATION
+from wait import WaitPolicy, page_settled
+from link_validation import XIDItem
+from session import CanvasSession
+from verify import ItemVerifier
+from xid_scanner import find_xid_references, replace_xid_images
+
 LOGIN_TIMEOUT = 120
+# Lets the worker tab navigate away from an editor with unsaved changes without a "Leave site?" prompt
+ALLOW_UNLOAD_SCRIPT = """
+window.onbeforeunload = null;
+window.addEventListener("beforeunload", function (e) { e.stopImmediatePropagation(); }, true);
+"""
 REFRESH_TIMEOUT = 600
-BASE_URL = "https://boisestatecanvas.instructure.com"
+HOVER_TIMEOUT = 15
+# Can be pointed at another Canvas instance, like the mock Canvas in benchmarks/mock_canvas.py
+BASE_URL = os.environ.get('CANVAS_BASE_URL', "https://boisestatecanvas.instructure.com").rstrip("/")
+
+BACKEND_SELENIUM = "selenium"
+BACKEND_API = "api"
+
+# Text shown on a link validator result -> item type, checked in order.
+# Normally I would navigate to the correct element and do a switch on the text,
+# but Canvas uses non-human-readable class names for these elements and I don't want the system to break
+# if the class names are nondeterministic, which seems likely.
+ITEM_TYPES = (
+    ("Assessment Question", "assessment_question"),
+    ("Quiz Question", "quiz_question"),
+    ("Page", "page"),
+    ("Assignment", "assignment"),
+    ("Discussion", "discussion"),
+)
 
 
 ##
@@ -54,79 +97,192 @@ def get_course_link(course_id):
     return BASE_URL + "/courses/" + course_id
 
 
-class XIDFixer:
-    """Main class for fixing XID links."""
+def get_course_id(course):
+    """Returns the course ID for a course ID or course link."""
+    if course.isnumeric():
+        return course
+    match = re.search(r"/courses/(\d+)", course)
+    return match.group(1) if match else None
+
+
+def parse_link_validator_results(html, page_url):
+    """Parse the link validator page into a list of XIDItems, keeping only results with xid links.
+    Links are made absolute relative to `page_url`."""
+    items = []
+    for result in bs(html, "html.parser").find_all(class_="result"):
+        xid_links = [urllib.parse.urljoin(page_url, a.get("href", "")) for a in result.find_all("a")
+                     if "xid" in a.get_text()]
+        if len(xid_links) == 0:
+            continue
+
+        heading = result.find("h2")
+        link = heading.find("a", href=True) if heading is not None else None
+        if link is None:
+            print("Result without an item link found, skipping.")
+            continue
+
+        text = [str(string) for string in result.find_all(string=True)]
+        item_type = next((t for label, t in ITEM_TYPES if any(label in string for string in text)), None)
+        items.append(XIDItem(urllib.parse.urljoin(page_url, link["href"]).split("#")[0], item_type, xid_links))
+    return items
+
+
+# What a question pool pre-scan found in one question, see `scan_question_pool`
+QuestionScan = namedtuple("QuestionScan", ["question_id", "visible", "xid_in_text", "xid_in_answers"])
+
+
+def has_xid_reference(element):
+    """Return true if the given soup element contains an xid reference (an image, link, frame, inline style...)."""
+    return len(find_xid_references(str(element))) > 0
 
-    def __init__(self, driver):
+
+def scan_question_pool(html):
+    """Scan every question holder of a question pool page in one pass.
+    Returns a QuestionScan per holder, in page order."""
+    scans = []
+    for index, holder in enumerate(bs(html, "html.parser").find_all(class_="question_holder")):
+        question = holder.find(id=re.compile(r"^question_\d+"))
+        question_id = holder.get("id") or (question["id"] if question is not None else str(index))
+        visible = "display:none" not in (holder.get("style") or "").replace(" ", "")
+
+        xid_in_answers = any(has_xid_reference(answer) for answer in holder.find_all(class_="answer"))
+        # Any other xid reference is treated as part of the question text
+        xid_in_text = has_xid_reference(holder) and (not xid_in_answers or any(
+            has_xid_reference(text) for text in holder.find_all(class_="question_text")))
+        scans.append(QuestionScan(question_id, visible, xid_in_text, xid_in_answers))
+    return scans
+
+
+class XIDFixer:
+    """Main class for fixing XID links.
+    `backend` selects how pages, assignments and discussions are edited: BACKEND_SELENIUM drives the rich
+    content editor, BACKEND_API edits them through the Canvas REST API and falls back to the browser on failure.
+    If a `journal` (see journal.py) is given, finished items and questions are recorded in it and skipped on reruns.
+    If a `link_validator` (a LinkValidationPoller) is given, link validation runs as a background job through the
+    Canvas API instead of waiting on the link validator page, and `validation_cache` results are reused when
+    revalidation isn't forced. When it is, validations that finished after `fresh_after` (a Unix time, like when the
+    fix was queued) are used rather than started again.
+    If a `session` (a CanvasSession) is given, the login is captured once and reused for every later course, by every
+    fixer sharing the session and by the API client.
+    If a `resource_filter` (a ResourceFilter) is given, unneeded page resources are blocked in the worker tab and
+    a ResourceUsage event with the item's request counters follows every item fixed in the browser.
+    If a `memo` (a RewriteMemo) is given, rewrites are remembered and reused whenever the same HTML comes up again in
+    the course, and a MemoUsage event with the course's hits and misses precedes CourseDone.
+    If `verify` is set, the items fixed in a course are read back once the course is done and an ItemVerified event
+    is yielded for each of them before CourseDone.
+    `wait_policy` (a WaitPolicy) controls how every wait polls the page.
+    Items are opened one after another in a single worker tab. If `browsers` (the BrowserPool the driver came from)
+    is given, the browser is replaced between items once it stops responding or needs recycling, and the login is
+    carried over to the new one; `get_driver` returns the browser in use.
+    Every stage of the fix is timed and reported in StageTimed events (see timing.py)."""
+
+    def __init__(self, driver, backend=BACKEND_SELENIUM, journal=None, link_validator=None, validation_cache=None,
+                 session=None, resource_filter=None, wait_policy=None, memo=None, browsers=None,
+                 verify=False, fresh_after=None):
         self.__driver = driver
+        self.__browsers = browsers
+        self.__main_window = None
+        self.__worker_tab = None
+        self.__wait = wait_policy if wait_policy is not None else WaitPolicy()
+        self.__timer = StageTimer()
+        self.__resource_filter = resource_filter
+        self.__session = session
+        self.__session_version = None
+        self.__logged_in = False
+        self.__backend = backend
+        self.__journal = journal
+        self.__link_validator = link_validator
+        self.__validation_cache = validation_cache
+        self.__fresh_after = fresh_after
+        self.__validated_at = None
+        self.__memo = memo
+        self.__verify = verify
+        self.__memo_hits = 0
+        self.__memo_misses = 0
+        self.__course = None
+        self.__course_id = None
+        self.__api = None
+        self.__file_index = None
 
     def __replace_xid_in_tinymce(self, tinymce):
-        """Replace all xid links in the provided tinymce context."""
+        """Replace all xid links in the provided tinymce context.
+        Every image is resolved first, then the editor content is written back with a single `setContent`."""
 
         tinymce.click()
 
         original_text = self.__driver.execute_script("return tinyMCE.activeEditor.getContent()")
 
-        soup = bs(original_text, "html.parser")
-        try:
-            images = [img for img in soup.find_all("img") if "xid" in (img["src"] or "")]
-        except KeyError:
-            print("Image without source found. That's weird.")
-            images = []
-
-        # Clear the editor's content (we will replace it later)
-        if len(images) > 0:
-            self.__driver.execute_script("tinyMCE.activeEditor.setContent('')")
-
-        for image in images:
-            image_name = image["src"].split("/")[-1]
-            print(image_name)
-
-            def after_course_images(driver):
-                ui.WebDriverWait(driver, 10).until(
-                    lambda d: d.find_element(By.CSS_SELECTOR, "div[title='Course Images']")).click()
+        with self.__timer.stage(STAGE_IMAGE_RESOLUTION):
+            new_text, replaced = self.__rewrite(original_text, self.__resolve_image, self.__resolve_file)
+            if replaced > 0:
+                self.__driver.execute_script("tinyMCE.activeEditor.setContent(arguments[0])", new_text)
+                print("Content replaced ({} images)".format(replaced))
+
+    def __rewrite(self, html, resolve_image, resolve_file):
+        """Replace the xid references in some HTML, reusing the memo's rewrite of the same HTML if there is one.
+        Returns a tuple of the new HTML and the number of references that were replaced."""
+        if self.__memo is None:
+            return replace_xid_images(html, resolve_image, resolve_file)
+
+        remembered = self.__memo.get(self.__course_id, html)
+        if remembered is not None:
+            self.__memo_hits += 1
+            return remembered
+
+        self.__memo_misses += 1
+        new_html, replaced = replace_xid_images(html, resolve_image, resolve_file)
+        if replaced > 0:
+            self.__memo.put(self.__course_id, html, new_html, replaced)
+        return new_html, replaced
+
+    def __resolve_image(self, image_name):
+        """Returns the replacement markup for an xid image.
+        The course file index is used when possible, avoiding the RTE image search entirely."""
+        print(image_name)
+        markup = self.__file_index.get_image_markup(image_name) if self.__file_index is not None else None
+        if markup is None:
+            markup = self.__find_image_in_rte(image_name)
+        return markup
+
+    def __resolve_file(self, image_name):
+        """Returns the replacement markup for a file referred to outside of an image (a link, frame or style), or None
+        to leave the reference as it is. Only the course file index is used, the RTE image search only finds images."""
+        return self.__file_index.get_image_markup(image_name) if self.__file_index is not None else None
+
+    def __find_image_in_rte(self, image_name):
+        """Insert the named image into the empty active editor through the "Course Images" panel
+        and return the markup the editor generated for it."""
+        self.__driver.execute_script("tinyMCE.activeEditor.setContent('')")
+        markup = []
+
+        def after_course_images():
+            driver = self.__driver
+            self.__wait.on(driver, 10).until(
+                lambda d: d.find_element(By.CSS_SELECTOR, "div[title='Course Images']")).click()
+
+            wait = self.__wait.on(driver, 10)
+            search = wait.until(lambda d: d.find_element(By.CSS_SELECTOR, "input[placeholder='Search']"))
+            search.send_keys(image_name)
+
+            # Wait for the results to update and click the image with the xid provided
+            try:
+                wait.until(lambda d: self.__find_search_result(image_name)).click()
+            except TimeoutException as e:
+                raise XIDException("The xid image {} does not appear to have been uploaded.".format(image_name), e)
 
-                wait = ui.WebDriverWait(driver, 10)
-                search = wait.until(lambda d: d.find_element(By.CSS_SELECTOR, "input[placeholder='Search']"))
-                search.send_keys(image_name)
+            # Copy the inserted image's markup
+            markup.append(driver.execute_script("return tinyMCE.activeEditor.getContent()"))
 
-                time.sleep(1)  # Wait 1 second for image results to update
+        self.__open_course_images_in_rte(after_course_images)
+        return markup[0]
 
-                # Find most relevant image with the xid provided
-                try:
-                    results = wait.until(lambda d: self.__wait_for_search_results())
-                except TimeoutException as e:
-                    raise XIDException("Failed to find image {}.".format(image_name), e)
-                else:
-                    for result in results.find_elements(By.TAG_NAME, "button"):
-                        try:
-                            if image_name in result.find_element(By.TAG_NAME, "img").get_attribute("alt"):
-                                result.click()
-                                break
-                        except NoSuchElementException as e:
-                            raise XIDException(
-                                "The xid image {} does not appear to have been uploaded.".format(image_name), e)
-
-                # Copy image source and clear tinyMCE
-                image_source = driver.execute_script("return tinyMCE.activeEditor.getContent()")
-                image_soup = bs(image_source, "html.parser")
-
-                image.replaceWith(image_soup)
-
-                driver.execute_script(
-                    "tinyMCE.activeEditor.setContent('{}')".format(str(soup).replace("\n", "").replace("'", "\\'")))
-                print("Content replaced")
-
-            self.__open_course_images_in_rte(after_course_images)
-
-    def __wait_for_search_results(self):
-        """Wait for image search results to appear."""
+    def __find_search_result(self, image_name):
+        """Returns the image search result for the given image once it appears, False otherwise."""
         container = self.__driver.find_element(By.CSS_SELECTOR,
                                                "div[data-testid='instructure_links-ImagesPanel']").find_element(
             By.CSS_SELECTOR, "span")
-        if exists_css_selector(container, "div"):
-            return container
-        return False
+        results = container.find_elements(By.XPATH, ".//button[.//img[contains(@alt, '{}')]]".format(image_name))
+        return results[0] if len(results) > 0 else False
 
     def __open_course_images_in_rte(self, callback):
         """Perform a string of key actions that will open the Course Images button in tinyMCE."""
@@ -134,7 +290,7 @@ class XIDFixer:
         ActionChains(self.__driver).key_down(command_key).key_down(Keys.SHIFT) \
             .send_keys("f") \
             .key_up(command_key).key_up(Keys.SHIFT).perform()  # Enter fullscreen
-        ui.WebDriverWait(self.__driver, 10).until(lambda driver: driver.find_element(By.CLASS_NAME, "tox-fullscreen"))
+        self.__wait.on(self.__driver, 10).until(lambda driver: driver.find_element(By.CLASS_NAME, "tox-fullscreen"))
         ActionChains(self.__driver).key_down(Keys.ALT).send_keys(Keys.F10).key_up(
             Keys.ALT).perform()  # Focus on toolbar
         ActionChains(self.__driver).send_keys(Keys.TAB, Keys.TAB, Keys.ARROW_RIGHT).perform()  # Go to Images
@@ -146,7 +302,7 @@ class XIDFixer:
     def __go_to_course_link_validator(self):
         """Navigate to course link validation page"""
         try:
-            settings_link = ui.WebDriverWait(self.__driver, LOGIN_TIMEOUT) \
+            settings_link = self.__wait.on(self.__driver, LOGIN_TIMEOUT) \
                 .until(lambda d: d.find_element(By.LINK_TEXT, "Settings"))
             settings_link.click()
         except TimeoutException:
@@ -171,9 +327,9 @@ class XIDFixer:
         ActionChains(self.__driver).move_to_element(element).perform()
 
     def __hover_and_click(self, hover_element, click_element):
-        """Hover over the given element and click on another (or the same) element."""
+        """Hover over the given element and click on another (or the same) element once it is displayed."""
         self.__hover(hover_element)
-        time.sleep(0.1)
+        self.__wait.on(click_element, 1).until(lambda e: e.is_displayed())
         ActionChains(self.__driver).click(click_element).perform()
 
     def __find_elements_by_text(self, text, element=None):
@@ -184,74 +340,97 @@ class XIDFixer:
 
     def __check_login_fail(self):
         try:
-            result = ui.WebDriverWait(self.__driver, 5).until(
+            result = self.__wait.on(self.__driver, 5).until(
                 lambda d: exists_css_selector(d, ".toast-message > .login_error")
             )
         except TimeoutException:
             return False
         return result
 
-    def __handle_assessment_question_pool(self, start_index=0):
+    def __handle_assessment_question_pool(self, url, start_index=0):
         """Handle an assessment question with one or more broken xid links.
-        Note that assessment question links actually navigate to question pools and not individual questions."""
-        questions = [q for q in ui.WebDriverWait(self.__driver, 10).until(
-            lambda d: d.find_elements(By.CLASS_NAME, "question_holder")) if
-                     "display: none" not in q.get_attribute("style")]
-        print("Questions: {}".format(len(questions)))
+        Note that assessment question links actually navigate to question pools and not individual questions.
+        The whole pool is pre-scanned from the page source so only questions with xid images are edited.
+        Questions before `start_index` and questions the journal has recorded as completed are skipped."""
+        holders = self.__wait.on(self.__driver, 10).until(
+            lambda d: d.find_elements(By.CLASS_NAME, "question_holder"))
+        scans = scan_question_pool(self.__driver.page_source)
+        if len(scans) != len(holders):
+            raise XIDException("The question pool changed while it was being scanned.")
+
+        questions = [(holder, scan) for holder, scan in zip(holders, scans) if scan.visible]
+        broken = sum(1 for _, scan in questions if scan.xid_in_text or scan.xid_in_answers)
+        print("Questions: {} ({} with xid images)".format(len(questions), broken))
 
         self.__driver.execute_script("window.scrollTo(0,0)")
 
-        for q_index, question in enumerate(questions):
-            if q_index < start_index:
-                return
+        failed_questions = 0
+        for q_index, (question, scan) in enumerate(questions):
+            if q_index < start_index or not (scan.xid_in_text or scan.xid_in_answers):
+                continue
+
+            if self.__was_fixed(url, scan.question_id):
+                print("Question {} was fixed in a previous run, skipping.".format(q_index + 1))
+                continue
+
             print("Fixing question {} -------------------- ".format(q_index + 1))
             try:
-                self.__fix_single_question(question)
+                self.__fix_single_question(question, scan)
             except XIDException as e:
                 print("ERROR IN QUESTION: {}".format(e.message))
+                failed_questions += 1
+                self.__record(url, FAILED, part=scan.question_id)
                 continue
+            self.__record(url, COMPLETED, part=scan.question_id)
 
-    def __fix_single_question(self, question):
-        """Fix a single assessment question."""
-        hovered = False
-        attempts = 0
-        while not hovered and attempts < 500:
-            try:
-                self.__hover_and_click(question,
-                                       question.find_element(By.CSS_SELECTOR, "a[class*=edit_question_link]"))
-                hovered = True
-            except (MoveTargetOutOfBoundsException, ElementNotInteractableException, NoSuchElementException):
-                attempts += 1
+        if failed_questions > 0:
+            raise XIDException("{} of {} questions failed to fix.".format(failed_questions, broken))
 
-        if attempts == 500:
-            raise XIDException("Ran out of hover attempts")
+    def __fix_single_question(self, question, scan):
+        """Fix a single assessment question. `scan` tells which parts of the question have xid images."""
+        def hover_and_click(q):
+            self.__hover_and_click(q, q.find_element(By.CSS_SELECTOR, "a[class*=edit_question_link]"))
+            return True
 
-        # Try to fix the question text
-        wait = ui.WebDriverWait(self.__driver, 30)
-        try:
-            editors = wait.until(lambda d: d.find_elements(By.CLASS_NAME, "tox-edit-area__iframe"))
-        except TimeoutException as e:
-            raise XIDException("Unable to find editor for this question.", e)
+        with self.__timer.stage(STAGE_EDITOR_OPEN):
+            try:
+                self.__wait.on(question, HOVER_TIMEOUT, ignored_exceptions=(
+                    MoveTargetOutOfBoundsException, ElementNotInteractableException, NoSuchElementException,
+                    TimeoutException)).until(hover_and_click)
+            except TimeoutException as e:
+                raise XIDException("Ran out of hover attempts", e)
+
+            # Try to fix the question text. One snapshot describes every editor and answer of the open question.
+            wait = self.__wait.on(self.__driver, 30)
+            try:
+                snapshot = wait.until(question_editor_ready)
+            except TimeoutException as e:
+                raise XIDException("Unable to find editor for this question.", e)
 
-        tinymce = None
-        for i, editor in enumerate(editors):
-            if editor.get_attribute("id") != "quiz_description_ifr":
-                print("Choosing editor {}/{}".format(i + 1, len(editors)))
-                tinymce = editor
-                break
+        if scan.xid_in_text:
+            editors = snapshot["editors"]
+            tinymce = None
+            for i, editor in enumerate(editors):
+                if editor["id"] != "quiz_description_ifr":
+                    print("Choosing editor {}/{}".format(i + 1, len(editors)))
+                    tinymce = editor["element"]
+                    break
 
-        self.__replace_xid_in_tinymce(tinymce)
+            self.__replace_xid_in_tinymce(tinymce)
 
         # Find broken links in answers
-        for answer in self.__driver.find_element(By.CLASS_NAME, "form_answers").find_elements(By.CLASS_NAME, "answer"):
-            if any("xid" in i.get_attribute("src") for i in answer.find_elements(By.TAG_NAME, "img")):
-                mark_correct = "correct_answer" in answer.get_attribute("class")
-                ui.WebDriverWait(self.__driver, 5).until((EC.visibility_of(answer)))
+        answers = snapshot["answers"] if scan.xid_in_answers else []
+        for answer_snapshot in answers:
+            if answer_snapshot["xid"]:
+                answer = answer_snapshot["element"]
+                mark_correct = answer_snapshot["correct"]
+                if not answer_snapshot["visible"]:
+                    self.__wait.on(self.__driver, 5).until((EC.visibility_of(answer)))
                 self.__driver.execute_script("arguments[0].setAttribute('class', 'answer hover')", answer)
                 try:
-                    ui.WebDriverWait(answer, 5).until(
+                    self.__wait.on(answer, 5).until(
                         lambda d: d.find_element(By.CSS_SELECTOR, "a[class='edit_html']")).click()
-                    tinymce = ui.WebDriverWait(answer, 30).until(
+                    tinymce = self.__wait.on(answer, 30).until(
                         lambda d: d.find_element(By.CLASS_NAME, "tox-edit-area__iframe")
                     )
                 except (ElementNotInteractableException, TimeoutException) as e:
@@ -263,12 +442,12 @@ class XIDFixer:
                     # Still, might be good to let the professor know.
                     print("Element has been covered. Attempting to clear screen.")
                     widget = self.__driver.find_element(By.CLASS_NAME, "ui-widget")
-                    ui.WebDriverWait(widget, 5).until(
+                    self.__wait.on(widget, 5).until(
                         lambda d: self.__find_elements_by_text("Update question without regrading")[0]).click()
                     self.__find_elements_by_text("Update", element=widget)[0].click()
-                    ui.WebDriverWait(answer, 5).until(
+                    self.__wait.on(answer, 5).until(
                         lambda d: d.find_element(By.CSS_SELECTOR, "a[class='edit_html']")).click()
-                    tinymce = ui.WebDriverWait(answer, 30).until(
+                    tinymce = self.__wait.on(answer, 30).until(
                         lambda d: d.find_element(By.CLASS_NAME, "tox-edit-area__iframe")
                     )
 
@@ -276,66 +455,116 @@ class XIDFixer:
                 if mark_correct:
                     answer.find_element(By.CLASS_NAME, "select_answer_link").click()
 
-        self.__driver.find_element(By.CSS_SELECTOR, "button[type=submit]").click()
+        with self.__timer.stage(STAGE_SAVE):
+            self.__driver.find_element(By.CSS_SELECTOR, "button[type=submit]").click()
 
-        # Check for errors
-        try:
-            ui.WebDriverWait(self.__driver, 2).until(lambda d: d.find_element(By.CLASS_NAME, "errorBox"))
-        except (TimeoutException, NoSuchElementException):
-            pass
-        else:
-            print("Error message detected. It is likely that this edit failed to save.")
+            # Check for errors once the save request has finished
+            try:
+                self.__wait.on(self.__driver, 10).until(page_settled)
+            except TimeoutException:
+                print("The question is still saving.")
+            if exists_css_selector(self.__driver, ".errorBox"):
+                print("Error message detected. It is likely that this edit failed to save.")
 
-    def __handle_quiz_question(self):
+    def __handle_quiz_question(self, url):
         """Handle a quiz question. Most of the flow is shared with assessment question pools."""
-        ui.WebDriverWait(self.__driver, 10).until(
+        self.__wait.on(self.__driver, 10).until(
             lambda d: self.__driver.find_element(By.CLASS_NAME, "edit_assignment_link")).click()
         self.__driver.find_element(By.LINK_TEXT, "Questions").click()
-        self.__handle_assessment_question_pool()
+        self.__handle_assessment_question_pool(url)
 
     def __handle_page(self):
         """Handle a page with an xid link."""
-        ui.WebDriverWait(self.__driver, 10).until(
-            lambda d: d.find_element(By.CLASS_NAME, "edit-wiki")).click()
-        tinymce = ui.WebDriverWait(self.__driver, 10).until(
-            lambda d: d.find_element(By.CLASS_NAME, "tox-edit-area__iframe")
-        )
+        with self.__timer.stage(STAGE_EDITOR_OPEN):
+            self.__wait.on(self.__driver, 10).until(
+                lambda d: d.find_element(By.CLASS_NAME, "edit-wiki")).click()
+            tinymce = self.__wait.on(self.__driver, 10).until(
+                lambda d: d.find_element(By.CLASS_NAME, "tox-edit-area__iframe")
+            )
         self.__replace_xid_in_tinymce(tinymce)
-        self.__driver.find_element(By.CSS_SELECTOR, "button[class*=submit]").click()
+        with self.__timer.stage(STAGE_SAVE):
+            self.__driver.find_element(By.CSS_SELECTOR, "button[class*=submit]").click()
 
     def __handle_assignment(self):
         """Handle an assignment with an xid link."""
-        ui.WebDriverWait(self.__driver, 10).until(
-            lambda d: d.find_element(By.CLASS_NAME, "edit_assignment_link")).click()
-        tinymce = ui.WebDriverWait(self.__driver, 10).until(
-            lambda d: d.find_element(By.CLASS_NAME, "tox-edit-area__iframe")
-        )
+        with self.__timer.stage(STAGE_EDITOR_OPEN):
+            self.__wait.on(self.__driver, 10).until(
+                lambda d: d.find_element(By.CLASS_NAME, "edit_assignment_link")).click()
+            tinymce = self.__wait.on(self.__driver, 10).until(
+                lambda d: d.find_element(By.CLASS_NAME, "tox-edit-area__iframe")
+            )
         self.__replace_xid_in_tinymce(tinymce)
-        self.__driver.find_element(By.CSS_SELECTOR, "button[class*=submit]").click()
+        with self.__timer.stage(STAGE_SAVE):
+            self.__driver.find_element(By.CSS_SELECTOR, "button[class*=submit]").click()
 
     def __handle_discussion(self):
         """Handle a discussion topic with an xid link. Very similar to page handling."""
-        ui.WebDriverWait(self.__driver, 10).until(
-            lambda d: self.__driver.find_element(By.CLASS_NAME, "edit-btn")).click()
-        tinymce = ui.WebDriverWait(self.__driver, 10).until(
-            lambda d: self.__driver.find_element(By.CLASS_NAME, "tox-edit-area__iframe")
-        )
+        with self.__timer.stage(STAGE_EDITOR_OPEN):
+            self.__wait.on(self.__driver, 10).until(
+                lambda d: self.__driver.find_element(By.CLASS_NAME, "edit-btn")).click()
+            tinymce = self.__wait.on(self.__driver, 10).until(
+                lambda d: self.__driver.find_element(By.CLASS_NAME, "tox-edit-area__iframe")
+            )
         self.__replace_xid_in_tinymce(tinymce)
-        self.__driver.find_element(By.CSS_SELECTOR, "button[class*=submit]").click()
+        with self.__timer.stage(STAGE_SAVE):
+            self.__driver.find_element(By.CSS_SELECTOR, "button[class*=submit]").click()
+
+    def __api_fix_item(self, url, item_type):
+        """Fix a page, assignment or discussion through the Canvas API.
+        The body is fetched, rewritten in Python and written back with a single request."""
+        course_id, item_id = parse_item_url(url)
+        with self.__timer.stage(STAGE_NAVIGATION):
+            body = self.__api.get_item_body(course_id, item_type, item_id)
+
+        def resolve_file(image_name):
+            if self.__file_index is not None:
+                return self.__file_index.get_image_markup(image_name)
+            file = self.__api.find_course_file(course_id, image_name)
+            return self.__api.get_file_image_markup(course_id, file) if file is not None else None
+
+        def resolve_image(image_name):
+            markup = resolve_file(image_name)
+            if markup is None:
+                raise XIDException("The xid image {} does not appear to have been uploaded.".format(image_name))
+            return markup
+
+        with self.__timer.stage(STAGE_IMAGE_RESOLUTION):
+            new_body, replaced = self.__rewrite(body, resolve_image, resolve_file)
+        print("Replacing {} images through the API".format(replaced))
+        if replaced > 0:
+            with self.__timer.stage(STAGE_SAVE):
+                self.__api.update_item_body(course_id, item_type, item_id, new_body)
+
+    def __timing_events(self):
+        """Yield a StageTimed event for every stage timed since the last call."""
+        for timing in self.__timer.drain():
+            yield StageTimed(self.__course, timing)
+
+    def __record(self, url, status, part=""):
+        """Record the outcome of an item or question in the journal, if there is one."""
+        if self.__journal is not None:
+            self.__journal.record(self.__course_id, url, status, part=part)
+
+    def __was_fixed(self, url, part=""):
+        """Returns true if the journal has the item or question as fixed since the link validation that listed it.
+        An item a later validation still reports as broken is fixed again, since its save didn't take."""
+        return self.__journal is not None and self.__journal.is_completed(self.__course_id, url, part,
+                                                                          after=self.__validated_at)
 
     def __log_in(self, course, username, password):
         """Log into Boise State.
         Returns a tuple with a boolean indicting whether the login was successful and if it fails, an error code is
-        provided in the second entry."""
+        provided in the second entry. `self.__logged_in` is set if the login form had to be submitted."""
         self.__driver.get(get_course_link(course) if course.isnumeric() else course)
 
-        if "Log In" in self.__driver.title:
+        self.__logged_in = "Log In" in self.__driver.title
+        if self.__logged_in:
             try:
                 self.__driver.find_element(By.XPATH,
                                            ".//img[contains(@alt, 'Boise State Logo')]/following-sibling::ion-button") \
                     .click()
 
-                username_input = ui.WebDriverWait(self.__driver, 10).until(
+                username_input = self.__wait.on(self.__driver, 10).until(
                     EC.element_to_be_clickable((By.ID, "userNameInput"))
                 )
                 username_input.send_keys(username)
@@ -343,23 +572,65 @@ class XIDFixer:
                 self.__driver.find_element(By.ID, "submitButton").click()
 
             except ElementNotInteractableException:
-                return False, "err_login_not_interactable"
+                return False, ERR_LOGIN_NOT_INTERACTABLE
 
             if self.__check_login_fail():
-                return False, "err_login_fail"
+                return False, ERR_LOGIN_FAIL
 
             return True, None
         else:
             return True, None
 
     def __get_xid_items(self, revalidate_links):
-        """Get the XID items listed for the course currently in the driver."""
+        """Get the XID items of the current course, preferring cached or background link validation results.
+        Falls back to the link validator page in the driver when the API can't be used.
+        `self.__validated_at` is set to when the validation ran, if that is known.
+        Returns None if the link validation timed out."""
+        self.__validated_at = None
+        if self.__validation_cache is not None and (not revalidate_links or self.__fresh_after is not None):
+            since = self.__fresh_after if revalidate_links else None
+            items = self.__validation_cache.get(self.__course_id, since=since)
+            if items is not None:
+                print("Using cached link validation results")
+                self.__validated_at = self.__get_validation_time(revalidate_links)
+                return items
+
+        if self.__link_validator is not None:
+            try:
+                # The run usually submitted the course up front, and then this only waits for what is left of it
+                future = self.__link_validator.submit(self.__api, self.__course_id, restart=revalidate_links,
+                                                      fresh_after=self.__fresh_after)
+                items = future.result(timeout=REFRESH_TIMEOUT)
+                self.__link_validator.forget(self.__course_id)
+                self.__validated_at = self.__get_validation_time(revalidate_links)
+                return items
+            except FutureTimeoutError:
+                return None
+            except CanvasAPIException as e:
+                print("Unable to validate links through the API, using the link validator page: {}".format(e))
+
+        return self.__get_xid_items_from_page(revalidate_links)
+
+    def __get_validation_time(self, revalidate_links):
+        """Returns when the link validation of the current course ran, from the cache the results were stored in, or
+        now if it was just forced and there is no cache. Returns None if it is unknown."""
+        if self.__validation_cache is not None:
+            entry = self.__validation_cache.get_entry(self.__course_id)
+            if entry is not None:
+                return entry[0]
+        return time.time() if revalidate_links else None
+
+    def __get_xid_items_from_page(self, revalidate_links):
+        """Get the XID items listed for the course currently in the driver.
+        The results page is read once and parsed locally instead of querying each result through the driver.
+        Returns None if the link validation timed out."""
 
         # Find results
         results = self.__driver.find_elements(By.CLASS_NAME, "result")
         if len(results) == 0 or revalidate_links:
             print("Refreshing broken links. This request will time out in 10 minutes.")
-            wait_links = ui.WebDriverWait(self.__driver, REFRESH_TIMEOUT)
+            self.__validated_at = time.time()
+            wait_links = self.__wait.on(self.__driver, REFRESH_TIMEOUT)
             try:
                 self.__driver.find_element(By.PARTIAL_LINK_TEXT, "Link Validation").click()
             except NoSuchElementException:
@@ -368,115 +639,271 @@ class XIDFixer:
             try:
                 results = wait_links.until(lambda driver: driver.find_elements(By.CLASS_NAME, "result"))
             except TimeoutException:
-                return "err_refresh_timeout"
+                return None
 
-        # Filter results to only those with "xid" in the link
-        return [r for r in results if len(r.find_elements(By.PARTIAL_LINK_TEXT, "xid")) != 0]
+        items = parse_link_validator_results(self.__driver.page_source, self.__driver.current_url)
+        if self.__validation_cache is not None:
+            self.__validation_cache.put(self.__course_id, items)
+        return items
 
-    def do_course(self, course, username, password, revalidate_links=False):
-        """Fix all XID links within the given course. Expects valid Boise State identification.
-        This is the only public function in the class.
-        returns a tuple: `failed_items, attempted_items, err`
-        If an error occurs, `err` will have a very brief description that the UI can expand on.
-        """
-        login_result, error = self.__log_in(course, username, password)
+    def __restore_session(self):
+        """Load the shared session into this browser if it has a newer one than the browser has seen."""
+        version = self.__session.get_version()
+        if version != self.__session_version and self.__session.apply(self.__driver):
+            print("Reusing the existing Canvas session")
+        self.__session_version = version
+
+    def __enter_course(self, course, username, password):
+        """Log in if needed and open the course's link validator, yielding progress events.
+        Returns True once the link validator is open, or False after yielding a CourseError."""
+        if self.__session is not None:
+            self.__restore_session()
+
+        with self.__timer.stage(STAGE_LOGIN):
+            login_result, error = self.__log_in(course, username, password)
 
         # Check for failed login case, return fail reason
         if not login_result:
-            yield error, None
-            return
+            yield CourseError(self.__course, error)
+            return False
 
         if "Page Not Found" in self.__driver.title:
             print("Page does not exist")
-            yield "err_course_dne", None
-            return
+            yield CourseError(self.__course, ERR_COURSE_DNE)
+            return False
 
         print("Page exists")
 
-        yield "waiting_for_duo", None
+        if self.__logged_in:
+            yield Progress(self.__course, WAITING_FOR_DUO)
 
-        if self.__go_to_course_link_validator():
-            yield "duo_success", None
+        with self.__timer.stage(STAGE_DUO_WAIT):
+            entered_validator = self.__go_to_course_link_validator()
+        if entered_validator:
+            if self.__logged_in:
+                yield Progress(self.__course, DUO_SUCCESS)
         else:
-            yield "err_duo_fail", None
+            yield CourseError(self.__course, ERR_DUO_FAIL)
+            return False
+
+        if self.__session is not None and (self.__logged_in or not self.__session.is_captured()):
+            self.__session.capture(self.__driver)
+            self.__session_version = self.__session.get_version()
+        return True
+
+    def get_driver(self):
+        """Returns the browser the fixer is using, which changes when it is replaced between items."""
+        return self.__driver
+
+    def __open_worker_tab(self):
+        """Switch to the tab items are opened in, opening it first if this browser doesn't have one yet."""
+        if self.__worker_tab in self.__driver.window_handles:
+            self.__driver.switch_to.window(self.__worker_tab)
+            self.__driver.execute_script(ALLOW_UNLOAD_SCRIPT)
             return
 
-        xid_items = self.__get_xid_items(revalidate_links)
+        handle_count = len(self.__driver.window_handles)
+        self.__driver.switch_to.new_window("tab")
+        self.__wait.on(self.__driver, 10).until(lambda d: len(d.window_handles) != handle_count)
+        self.__worker_tab = self.__driver.current_window_handle
+        if self.__resource_filter is not None:
+            self.__resource_filter.apply(self.__driver)
+
+    def __clean_up_windows(self, close_worker_tab=False):
+        """Close every window but the main window and the worker tab and switch back to the main window.
+        After a failed item the worker tab is closed as well, since it may be stuck on a prompt or a broken page."""
+        try:
+            try:
+                self.__driver.switch_to.alert.dismiss()
+            except NoAlertPresentException:
+                pass
+
+            keep = (self.__main_window,) if close_worker_tab else (self.__main_window, self.__worker_tab)
+            for handle in self.__driver.window_handles:
+                if handle not in keep:
+                    self.__driver.switch_to.window(handle)
+                    self.__driver.execute_script(ALLOW_UNLOAD_SCRIPT)
+                    self.__driver.close()
+            if close_worker_tab:
+                self.__worker_tab = None
+            self.__driver.switch_to.window(self.__main_window)
+        except WebDriverException as e:
+            print("Unable to clean up the browser's windows: {}".format(e))
+
+    def __renew_browser(self, username, password):
+        """Replace the browser if it stopped responding or the pool says it needs recycling (too many items or too
+        much memory), logging the new one in with the old one's cookies or the shared session. Without either, the new
+        browser logs in again like at the start of the course, yielding the same events.
+        Returns False after yielding a CourseError if the browser stopped responding and no new one could be started,
+        or the new one could not log in."""
+        if self.__browsers is None:
+            return True
+
+        healthy = is_healthy(self.__driver)
+        if healthy:
+            if not self.__browsers.should_recycle(self.__driver):
+                return True
+            print("Restarting the browser, it uses {:.0f} MB".format(get_browser_rss_mb(self.__driver)))
+            login = CanvasSession(BASE_URL)
+            login.capture(self.__driver)
+        else:
+            print("Restarting a browser that stopped responding")
+            login = self.__session
+
+        try:
+            driver = self.__browsers.replace(self.__driver)
+        except Exception as e:
+            print("Unable to start a new browser: {}".format(e))
+            # A browser that still responds can keep going until the next item
+            if not healthy:
+                yield CourseError(self.__course, ERR_BROWSER_FAIL)
+            return healthy
 
-        if xid_items == "timeout_fail":
-            yield "err_timeout_fail", None
+        self.__driver = driver
+        self.__worker_tab = None
+        self.__main_window = self.__driver.current_window_handle
+        if login is not None and login.apply(self.__driver):
+            return True
+
+        print("No session to carry over, logging the new browser in again")
+        if self.__session is not None:
+            with self.__session.login_lock:
+                logged_in = yield from self.__enter_course(self.__course, username, password)
+        else:
+            logged_in = yield from self.__enter_course(self.__course, username, password)
+        yield from self.__timing_events()
+        return logged_in
+
+    def do_course(self, course, username, password, revalidate_links=False):
+        """Fix all XID links within the given course. Expects valid Boise State identification.
+        This is the only public function in the class besides `get_driver`.
+        Yields the events of the fix (see events.py). If an error occurs, a CourseError is yielded with a very brief
+        code that the UI can expand on and the fix stops.
+        """
+        self.__course = course
+        self.__memo_hits = 0
+        self.__memo_misses = 0
+        self.__course_id = get_course_id(course) or course
+        self.__timer.set_course(self.__course_id)
+
+        if self.__session is not None:
+            # Only one browser logs in at a time, so the others can reuse its session instead of prompting Duo again
+            with self.__session.login_lock:
+                entered = yield from self.__enter_course(course, username, password)
+        else:
+            entered = yield from self.__enter_course(course, username, password)
+        yield from self.__timing_events()
+        if not entered:
             return
 
-        yield "total_items", len(xid_items)
+        # The browser is logged in now, so its session can be shared with the API client
+        self.__api = self.__session.get_api() if self.__session is not None else None
+        if self.__api is None:
+            self.__api = CanvasAPI.from_driver(self.__driver, BASE_URL)
+
+        with self.__timer.stage(STAGE_VALIDATOR_REFRESH):
+            xid_items = self.__get_xid_items(revalidate_links)
+        yield from self.__timing_events()
+
+        if xid_items is None:
+            yield CourseError(self.__course, ERR_TIMEOUT_FAIL)
+            return
+
+        yield Progress(self.__course, TOTAL_ITEMS, len(xid_items))
+
+        self.__file_index = None
+        try:
+            self.__file_index = CourseFileIndex(self.__api, self.__course_id)
+            print("Indexed {} course file names".format(len(self.__file_index)))
+        except CanvasAPIException as e:
+            print("Unable to index course files, falling back to the image search: {}".format(e))
 
         print("{} xid items found. Beginning fixes...".format(len(xid_items)))
 
-        main_window = self.__driver.current_window_handle
-        fixed_banks = []
+        self.__main_window = self.__driver.current_window_handle
+        if self.__worker_tab == self.__main_window:
+            self.__worker_tab = None
+        fixed_banks = set()
+        fixed_items = []
         failed_items = 0
 
-        # Detect item type and send to proper function.
-        # Normally I would navigate to the correct element and do a switch on the text,
-        # but Canvas uses non-human-readable class names for these elements and I don't want the system to break
-        # if the class names are nondeterministic, which seems likely.
+        # Send each item to the proper function for its type.
         for item in xid_items:
-            handle_count = len(self.__driver.window_handles)
-            try:
-                url = item.find_element(By.TAG_NAME, "h2").find_element(By.TAG_NAME, "a").get_attribute("href")
-                url = url.split("#")[0]
-                if url in fixed_banks:
-                    print("This question has already been fixed "
-                          "because it belongs to the same bank as a previous question.")
-                    yield "item_failed", "already_fixed"
-                    continue
-                fixed_banks.append(url)
-            except Exception as e:
-                print(e)
+            renewed = yield from self.__renew_browser(username, password)
+            if not renewed:
+                return
+            url, item_type = item.url, item.item_type
+            self.__timer.set_item(item_type, url)
+            if url in fixed_banks:
+                print("This question has already been fixed "
+                      "because it belongs to the same bank as a previous question.")
+                yield ItemResult(self.__course, url, ITEM_FAILED, "already_fixed")
+                continue
+            fixed_banks.add(url)
+
+            if self.__was_fixed(url):
+                print("This item was fixed in a previous run, skipping.")
+                yield ItemResult(self.__course, url, ITEM_SKIPPED, "journal")
                 continue
-            # driver.execute_script("window.open('{}', '_blank')".format(url))
 
             try:
-                # Wait until the new tab is open
-                wait = ui.WebDriverWait(self.__driver, 10)
-
-                # Handle different types of pages
-                if len(self.__find_elements_by_text("Assessment Question", element=item)) != 0:
-                    self.__driver.switch_to.new_window("tab")
-                    wait.until(lambda d: len(self.__driver.window_handles) != handle_count)
-                    self.__driver.get(url)
-                    self.__handle_assessment_question_pool()
-                elif len(self.__find_elements_by_text("Quiz Question", element=item)) != 0:
-                    self.__driver.switch_to.new_window("tab")
-                    wait.until(lambda d: len(self.__driver.window_handles) != handle_count)
-                    self.__driver.get(url)
-                    self.__handle_quiz_question()
-                elif len(self.__find_elements_by_text("Page", element=item)) != 0:
-                    self.__driver.switch_to.new_window("tab")
-                    wait.until(lambda d: len(self.__driver.window_handles) != handle_count)
-                    self.__driver.get(url)
+                if self.__backend == BACKEND_API and item_type in ITEM_ENDPOINTS:
+                    try:
+                        self.__api_fix_item(url, item_type)
+                        self.__record(url, COMPLETED)
+                        fixed_items.append((url, item_type))
+                        yield ItemResult(self.__course, url, ITEM_SUCCESS)
+                        yield from self.__timing_events()
+                        continue
+                    except CanvasAPIException as e:
+                        print("API fix failed, falling back to the browser: {}".format(e))
+
+                with self.__timer.stage(STAGE_NAVIGATION):
+                    # Items are opened in the worker tab so the main window stays on the course
+                    if self.__browsers is not None:
+                        self.__browsers.add_items(self.__driver)
+                    self.__open_worker_tab()
+
+                    # Handle different types of pages
+                    if item_type is None:
+                        print("Unrecognized page type!")
+                    else:
+                        self.__driver.get(url)
+
+                if item_type == "assessment_question":
+                    self.__handle_assessment_question_pool(url)
+                elif item_type == "quiz_question":
+                    self.__handle_quiz_question(url)
+                elif item_type == "page":
                     self.__handle_page()
-                elif len(self.__find_elements_by_text("Assignment", element=item)) != 0:
-                    self.__driver.switch_to.new_window("tab")
-                    wait.until(lambda d: len(self.__driver.window_handles) != handle_count)
-                    self.__driver.get(url)
+                elif item_type == "assignment":
                     self.__handle_assignment()
-                elif len(self.__find_elements_by_text("Discussion", element=item)) != 0:
-                    self.__driver.switch_to.new_window("tab")
-                    wait.until(lambda d: len(self.__driver.window_handles) != handle_count)
-                    self.__driver.get(url)
+                elif item_type == "discussion":
                     self.__handle_discussion()
-                else:
-                    print("Unrecognized page type!")
-                    # open a new window so we don't close the main window.
-                    self.__driver.switch_to.new_window("tab")
-                    wait.until(lambda d: len(self.__driver.window_handles) != handle_count)
-
-                self.__driver.close()
-                self.__driver.switch_to.window(main_window)
-                yield "item_success", None
+
+                self.__clean_up_windows()
+                self.__record(url, COMPLETED)
+                fixed_items.append((url, item_type))
+                yield ItemResult(self.__course, url, ITEM_SUCCESS)
             except Exception:
                 failed_items += 1
-                yield "item_failed", "unknown"
-
-        yield "done", None
+                self.__clean_up_windows(close_worker_tab=True)
+                self.__record(url, FAILED)
+                yield ItemResult(self.__course, url, ITEM_FAILED, "unknown")
+
+            if self.__resource_filter is not None:
+                yield ResourceUsage(self.__course, self.__resource_filter.collect(self.__driver))
+            yield from self.__timing_events()
+
+        if self.__verify and fixed_items:
+            print("Verifying {} fixed items...".format(len(fixed_items)))
+            self.__timer.set_item(None, None)
+            with self.__timer.stage(STAGE_VERIFICATION):
+                verified = list(ItemVerifier(self.__api).verify(self.__course, fixed_items))
+            yield from verified
+            yield from self.__timing_events()
+
+        if self.__memo is not None:
+            yield MemoUsage(self.__course, self.__memo_hits, self.__memo_misses)
+        yield CourseDone(self.__course)
         return
@@ -0,0 +1,199 @@
+import asyncio
+import random
+import threading
+import time
+import urllib.parse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+##
+#
+#   This file contains the HTTP client every Canvas API call goes through.
+#   Connections are kept alive in a pool, and the number of requests in flight to a Canvas instance is adapted to its
+#   rate limit: Canvas reports what is left of the caller's quota in `X-Rate-Limit-Remaining` and what each request
+#   cost in `X-Request-Cost`, so more requests are let through while there is plenty left and fewer as it runs low.
+#   Throttled requests (403 "Rate Limit Exceeded") pause every request to that Canvas for a while and are retried.
+#   The limiter is shared by every client of the process, so browsers fixing courses at the same time share one
+#   budget. Clients can be used from threads and, through `request_async`, from asyncio.
+#
+##
+
+REQUEST_TIMEOUT = 30
+MAX_CONCURRENCY = 8
+MAX_RETRIES = 5
+BASE_BACKOFF = 1.0
+MAX_BACKOFF = 30.0
+# Quota (out of Canvas's 700) below which fewer requests are let through, on top of the cost of those in flight
+LOW_WATER = 200
+DEFAULT_REQUEST_COST = 1.0
+
+# Server errors worth retrying for requests that can safely be sent twice
+RETRY_STATUSES = (429, 502, 503, 504)
+IDEMPOTENT_METHODS = ("GET", "HEAD", "OPTIONS", "PUT", "DELETE")
+
+
+def is_throttled(response):
+    """Return true if Canvas refused a request because the caller went over its rate limit."""
+    if response.status_code == 429:
+        return True
+    return response.status_code == 403 and "rate limit exceeded" in response.text.lower()
+
+
+def get_backoff(attempt, retry_after=None):
+    """Returns how long to wait before retrying for the given attempt (counting from 1), with jitter.
+    A `Retry-After` header in seconds is honored if there is one."""
+    try:
+        if retry_after is not None:
+            return min(float(retry_after), MAX_BACKOFF)
+    except ValueError:
+        pass
+    return min(BASE_BACKOFF * 2 ** (attempt - 1), MAX_BACKOFF) * random.uniform(0.5, 1.0)
+
+
+def parse_header_float(response, name):
+    try:
+        return float(response.headers[name])
+    except (KeyError, ValueError):
+        return None
+
+
+class RateLimiter:
+    """Limits the requests in flight to one Canvas instance.
+    The limit grows by about one request per round trip while the quota is comfortable and halves as soon as it runs
+    low or a request is throttled, between 1 and `max_concurrency`. Throttling also pauses new requests."""
+
+    def __init__(self, max_concurrency=MAX_CONCURRENCY, low_water=LOW_WATER):
+        self.__max_concurrency = max_concurrency
+        self.__low_water = low_water
+        self.__condition = threading.Condition()
+        self.__limit = float(max_concurrency)
+        self.__in_flight = 0
+        self.__paused_until = 0
+        self.__failures = 0
+        self.__cost = DEFAULT_REQUEST_COST
+        self.remaining = None
+        self.requests = 0
+        self.throttled = 0
+
+    def get_limit(self):
+        return int(self.__limit)
+
+    def acquire(self):
+        """Wait until another request may be sent."""
+        with self.__condition:
+            while True:
+                pause = self.__paused_until - time.monotonic()
+                if pause > 0:
+                    self.__condition.wait(pause)
+                elif self.__in_flight >= int(self.__limit):
+                    self.__condition.wait()
+                else:
+                    break
+            self.__in_flight += 1
+            self.requests += 1
+
+    def release(self, response=None):
+        """Finish a request, adapting the limit to the rate limit headers of its `response` (None if it failed)."""
+        with self.__condition:
+            self.__in_flight -= 1
+            if response is not None and is_throttled(response):
+                self.throttled += 1
+                self.__failures += 1
+                self.__limit = max(1.0, self.__limit / 2)
+                pause = get_backoff(self.__failures, response.headers.get("Retry-After"))
+                self.__paused_until = max(self.__paused_until, time.monotonic() + pause)
+            elif response is not None:
+                self.__failures = 0
+                cost = parse_header_float(response, "X-Request-Cost")
+                if cost is not None:
+                    # Smooth out the cost, a single slow request shouldn't decide the limit
+                    self.__cost = 0.8 * self.__cost + 0.2 * cost
+                remaining = parse_header_float(response, "X-Rate-Limit-Remaining")
+                if remaining is not None:
+                    self.remaining = remaining
+                    if remaining < self.__low_water + self.__cost * self.__limit:
+                        self.__limit = max(1.0, self.__limit / 2)
+                    else:
+                        self.__limit = min(float(self.__max_concurrency), self.__limit + 1 / self.__limit)
+            self.__condition.notify_all()
+
+
+_LIMITERS = {}
+_LIMITERS_LOCK = threading.Lock()
+
+
+def get_rate_limiter(url):
+    """Returns the process-wide RateLimiter for the host of the given URL."""
+    host = urllib.parse.urlsplit(url).netloc
+    with _LIMITERS_LOCK:
+        if host not in _LIMITERS:
+            _LIMITERS[host] = RateLimiter()
+        return _LIMITERS[host]
+
+
+class HTTPClient:
+    """A pooled HTTP session whose requests are paced by a RateLimiter, retried when throttled and, for idempotent
+    requests, on connection errors and temporary server errors."""
+
+    def __init__(self, limiter, max_retries=MAX_RETRIES, timeout=REQUEST_TIMEOUT):
+        self.__limiter = limiter
+        self.__max_retries = max_retries
+        self.__timeout = timeout
+        self.__session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=MAX_CONCURRENCY, pool_maxsize=MAX_CONCURRENCY)
+        self.__session.mount("http://", adapter)
+        self.__session.mount("https://", adapter)
+
+    def get_session(self):
+        """Returns the underlying requests session, to set headers and cookies on."""
+        return self.__session
+
+    def get_limiter(self):
+        return self.__limiter
+
+    def request(self, method, url, **kwargs):
+        """Send a request and return the response, whatever its status.
+        Raises a requests.RequestException if it couldn't be sent after all retries."""
+        kwargs.setdefault("timeout", self.__timeout)
+        attempt = 0
+        while True:
+            attempt += 1
+            self.__limiter.acquire()
+            response = None
+            try:
+                response = self.__session.request(method, url, **kwargs)
+            except requests.RequestException:
+                if method.upper() not in IDEMPOTENT_METHODS or attempt > self.__max_retries:
+                    raise
+            finally:
+                self.__limiter.release(response)
+
+            if response is None:
+                time.sleep(get_backoff(attempt))
+                continue
+            if attempt > self.__max_retries:
+                return response
+            # The limiter already paused every request for throttled responses
+            if is_throttled(response):
+                continue
+            if response.status_code in RETRY_STATUSES and method.upper() in IDEMPOTENT_METHODS:
+                time.sleep(get_backoff(attempt, response.headers.get("Retry-After")))
+                continue
+            return response
+
+    def iter_pages(self, url, params=None, **kwargs):
+        """Yield the response for every page of a paginated list, following the `next` links of the `Link` header.
+        Stops after the first response that isn't successful, so the caller can handle it."""
+        response = self.request("GET", url, params=params, **kwargs)
+        while True:
+            yield response
+            next_link = response.links.get("next")
+            if not response.ok or next_link is None:
+                return
+            response = self.request("GET", next_link["url"], **kwargs)
+
+    async def request_async(self, method, url, **kwargs):
+        """`request` for asyncio code. The request runs in a worker thread so the event loop isn't blocked."""
+        return await asyncio.to_thread(self.request, method, url, **kwargs)
+
@@ -0,0 +1,240 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+from events import CourseDone, CourseError, CourseStarted, ItemResult, ItemVerified, MemoUsage, Progress, \
+    ResourceUsage, StageTimed, ERR_LOGIN_EXPIRED, ITEM_FAILED, TOTAL_ITEMS
+
+JOBS_PATH = os.environ.get('XID_JOBS_PATH', "xid_jobs.sqlite3")
+
+# Workers mark their running job as alive this often, even while it reports nothing
+HEARTBEAT_INTERVAL = 60
+# Running jobs that haven't been marked alive for this many seconds belong to a worker that died
+STALE_AFTER = 5 * HEARTBEAT_INTERVAL
+
+##
+#
+#   This file contains the persistent queue of course fixes.
+#   The UI submits one job per course and reads their status, while worker processes (see worker.py) claim jobs,
+#   run them and write their progress back. Since the work happens outside of the UI, closing the page or rerunning
+#   it doesn't stop a fix, and the number of worker processes bounds how many browsers run on a host.
+#   Login information is never written to the queue: the UI hands it to its workers directly (see worker.py), so a
+#   worker only claims the jobs of batches it has the login information for. The Canvas session cookies of a running
+#   batch are shared through the queue instead, so only the first worker to need them logs in and prompts Duo, and
+#   they are erased once the batch is over.
+#
+##
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+FINISHED_STATUSES = (DONE, FAILED, CANCELLED)
+
+COLUMNS = ["id", "batch", "course", "status", "message", "error", "total_items", "attempted", "failed",
+           "blocked_requests", "loaded_bytes", "memo_hits", "memo_misses", "verified",
+           "verify_failed", "worker", "submitted", "started", "finished"]
+
+
+class JobQueue:
+    """SQLite-backed queue of course jobs, shared by the UI and the workers.
+    Every process opens its own JobQueue on the same file."""
+
+    def __init__(self, path=JOBS_PATH):
+        self.__lock = threading.Lock()
+        self.__connection = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        with self.__lock:
+            self.__connection.execute("PRAGMA journal_mode=WAL")
+            self.__connection.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, batch TEXT NOT NULL, course TEXT NOT NULL, "
+                "status TEXT NOT NULL, message TEXT, error TEXT, total_items INTEGER NOT NULL DEFAULT 0, "
+                "attempted INTEGER NOT NULL DEFAULT 0, failed INTEGER NOT NULL DEFAULT 0, "
+                "blocked_requests INTEGER NOT NULL DEFAULT 0, loaded_bytes INTEGER NOT NULL DEFAULT 0, "
+                "memo_hits INTEGER NOT NULL DEFAULT 0, memo_misses INTEGER NOT NULL DEFAULT 0, "
+                "verified INTEGER NOT NULL DEFAULT 0, verify_failed INTEGER NOT NULL DEFAULT 0, worker TEXT, "
+                "submitted REAL NOT NULL, started REAL, finished REAL, updated REAL NOT NULL, options TEXT NOT NULL)")
+            self.__connection.execute(
+                "CREATE TABLE IF NOT EXISTS timings ("
+                "job INTEGER NOT NULL, stage TEXT NOT NULL, duration REAL NOT NULL)")
+            self.__connection.execute(
+                "CREATE TABLE IF NOT EXISTS sessions ("
+                "batch TEXT PRIMARY KEY, worker TEXT NOT NULL, cookies TEXT, error TEXT)")
+
+    def __execute(self, query, parameters=()):
+        with self.__lock:
+            return self.__connection.execute(query, parameters).fetchall()
+
+    def submit(self, courses, **options):
+        """Queue one job per course and returns the batch id that groups them.
+        `options` are passed to the worker (`backend`, `revalidate_links`, `restart`, `verify`). The login
+        information for the batch has to be handed to the workers separately."""
+        batch = uuid.uuid4().hex
+        now = time.time()
+        with self.__lock:
+            self.__connection.execute("BEGIN IMMEDIATE")
+            try:
+                for course in courses:
+                    self.__connection.execute(
+                        "INSERT INTO jobs (batch, course, status, submitted, updated, options) "
+                        "VALUES (?, ?, ?, ?, ?, ?)",
+                        (batch, course, QUEUED, now, now, json.dumps(options)))
+                self.__connection.execute("COMMIT")
+            except Exception:
+                self.__connection.execute("ROLLBACK")
+                raise
+        return batch
+
+    def claim(self, worker, batches):
+        """Mark the oldest queued job of the given batches as running by `worker` and returns it as a dict with its
+        options, or None if there is no such job."""
+        batches = list(batches)
+        if len(batches) == 0:
+            return None
+        with self.__lock:
+            self.__connection.execute("BEGIN IMMEDIATE")
+            try:
+                row = self.__connection.execute(
+                    "SELECT id, batch, course, submitted, options FROM jobs WHERE status = ? AND batch IN ({}) "
+                    "ORDER BY id LIMIT 1".format(", ".join("?" * len(batches))), [QUEUED] + batches).fetchone()
+                if row is not None:
+                    now = time.time()
+                    self.__connection.execute(
+                        "UPDATE jobs SET status = ?, worker = ?, started = ?, updated = ? WHERE id = ?",
+                        (RUNNING, worker, now, now, row[0]))
+                self.__connection.execute("COMMIT")
+            except Exception:
+                self.__connection.execute("ROLLBACK")
+                raise
+
+        if row is None:
+            return None
+        return {"id": row[0], "batch": row[1], "course": row[2], "submitted": row[3], "options": json.loads(row[4])}
+
+    def record_event(self, job, event):
+        """Update a running job's progress from one of its events (see events.py)."""
+        now = time.time()
+        if isinstance(event, (CourseStarted, CourseDone)):
+            self.__execute("UPDATE jobs SET message = ?, updated = ? WHERE id = ?",
+                           (type(event).__name__, now, job))
+        elif isinstance(event, Progress):
+            if event.kind == TOTAL_ITEMS:
+                self.__execute("UPDATE jobs SET total_items = ?, message = ?, updated = ? WHERE id = ?",
+                               (event.value, event.kind, now, job))
+            else:
+                self.__execute("UPDATE jobs SET message = ?, updated = ? WHERE id = ?", (event.kind, now, job))
+        elif isinstance(event, ItemResult):
+            self.__execute("UPDATE jobs SET attempted = attempted + 1, failed = failed + ?, updated = ? WHERE id = ?",
+                           (1 if event.status == ITEM_FAILED else 0, now, job))
+        elif isinstance(event, ResourceUsage):
+            self.__execute("UPDATE jobs SET blocked_requests = blocked_requests + ?, "
+                           "loaded_bytes = loaded_bytes + ?, updated = ? WHERE id = ?",
+                           (event.counters["blocked_requests"], event.counters["loaded_bytes"], now, job))
+        elif isinstance(event, ItemVerified):
+            self.__execute("UPDATE jobs SET verified = verified + 1, verify_failed = verify_failed + ?, updated = ? "
+                           "WHERE id = ?", (0 if event.passed else 1, now, job))
+        elif isinstance(event, MemoUsage):
+            self.__execute("UPDATE jobs SET memo_hits = ?, memo_misses = ?, updated = ? WHERE id = ?",
+                           (event.hits, event.misses, now, job))
+        elif isinstance(event, StageTimed):
+            self.__execute("INSERT INTO timings VALUES (?, ?, ?)", (job, event.timing.stage, event.timing.duration))
+        elif isinstance(event, CourseError):
+            self.__execute("UPDATE jobs SET error = ?, updated = ? WHERE id = ?", (event.code, now, job))
+
+    def heartbeat(self, job):
+        """Mark a running job as alive, so it isn't taken for the job of a dead worker while it is quiet."""
+        self.__execute("UPDATE jobs SET updated = ? WHERE id = ? AND status = ?", (time.time(), job, RUNNING))
+
+    def finish(self, job, status, error=None):
+        """End a job."""
+        now = time.time()
+        self.__execute("UPDATE jobs SET status = ?, error = COALESCE(?, error), finished = ?, updated = ? WHERE id = ?",
+                       (status, error, now, now, job))
+
+    def cancel(self, batch):
+        """Cancel the queued jobs of a batch. Running jobs are left to finish."""
+        now = time.time()
+        self.__execute("UPDATE jobs SET status = ?, finished = ?, updated = ? WHERE batch = ? AND status = ?",
+                       (CANCELLED, now, now, batch, QUEUED))
+
+    def cancel_orphans(self):
+        """Cancel every queued job. Meant for when the UI starts: the workers that had the login information of
+        earlier batches went away with the UI that started them, so nothing could claim those jobs."""
+        now = time.time()
+        self.__execute("UPDATE jobs SET status = ?, error = ?, finished = ?, updated = ? WHERE status = ?",
+                       (CANCELLED, ERR_LOGIN_EXPIRED, now, now, QUEUED))
+        self.__execute("DELETE FROM sessions WHERE batch NOT IN (SELECT batch FROM jobs WHERE status = ?)",
+                       (RUNNING,))
+
+    def claim_session(self, batch, worker):
+        """Find out how `worker` gets the Canvas session of a batch. The first worker to ask, or the next one once
+        that worker's jobs in the batch stopped running, is made the one to log in.
+        Returns a dict with the `worker` logging in, the shared `cookies` once it has, and the `error` code if its
+        login failed."""
+        with self.__lock:
+            self.__connection.execute("BEGIN IMMEDIATE")
+            try:
+                self.__connection.execute(
+                    "DELETE FROM sessions WHERE batch = ? AND cookies IS NULL AND error IS NULL AND NOT EXISTS "
+                    "(SELECT 1 FROM jobs WHERE jobs.batch = sessions.batch AND jobs.worker = sessions.worker "
+                    "AND jobs.status = ?)", (batch, RUNNING))
+                self.__connection.execute("INSERT OR IGNORE INTO sessions (batch, worker) VALUES (?, ?)",
+                                          (batch, worker))
+                row = self.__connection.execute("SELECT worker, cookies, error FROM sessions WHERE batch = ?",
+                                                (batch,)).fetchone()
+                self.__connection.execute("COMMIT")
+            except Exception:
+                self.__connection.execute("ROLLBACK")
+                raise
+        return {"worker": row[0], "cookies": json.loads(row[1]) if row[1] is not None else None, "error": row[2]}
+
+    def share_session(self, batch, worker, cookies):
+        """Publish the cookies of a Canvas session `worker` captured for a batch."""
+        self.__execute("INSERT OR REPLACE INTO sessions (batch, worker, cookies) VALUES (?, ?, ?)",
+                       (batch, worker, json.dumps(cookies)))
+
+    def fail_session(self, batch, error):
+        """Record that logging in for a batch failed in a way that would fail for every worker."""
+        self.__execute("UPDATE sessions SET error = ? WHERE batch = ?", (error, batch))
+
+    def release_session(self, batch, worker):
+        """Let another worker log in for a batch if `worker` was to and never shared a session."""
+        self.__execute("DELETE FROM sessions WHERE batch = ? AND worker = ? AND cookies IS NULL AND error IS NULL",
+                       (batch, worker))
+
+    def forget_session(self, batch):
+        """Erase the shared session of a batch that is over."""
+        self.__execute("DELETE FROM sessions WHERE batch = ?", (batch,))
+
+    def requeue_stale(self, max_age=STALE_AFTER):
+        """Put running jobs whose worker stopped reporting back in the queue. Returns how many were requeued."""
+        now = time.time()
+        with self.__lock:
+            cursor = self.__connection.execute(
+                "UPDATE jobs SET status = ?, worker = NULL, started = NULL, updated = ? "
+                "WHERE status = ? AND updated < ?", (QUEUED, now, RUNNING, now - max_age))
+            return cursor.rowcount
+
+    def is_finished(self, batch):
+        """Return true if no job of the batch is queued or running."""
+        return len(self.__execute("SELECT 1 FROM jobs WHERE batch = ? AND status IN (?, ?) LIMIT 1",
+                                  (batch, QUEUED, RUNNING))) == 0
+
+    def get_batch(self, batch):
+        """Returns the jobs of a batch as dicts (see COLUMNS), in the order they were submitted."""
+        rows = self.__execute("SELECT {} FROM jobs WHERE batch = ? ORDER BY id".format(", ".join(COLUMNS)), (batch,))
+        return [dict(zip(COLUMNS, row)) for row in rows]
+
+    def get_timings(self, batch):
+        """Returns `(stage, duration)` for every stage timed by the jobs of a batch."""
+        return self.__execute("SELECT stage, duration FROM timings JOIN jobs ON timings.job = jobs.id "
+                              "WHERE jobs.batch = ?", (batch,))
+
+    def close(self):
+        with self.__lock:
+            self.__connection.close()
@@ -0,0 +1,65 @@
+import hashlib
+import sqlite3
+import threading
+import time
+
+##
+#
+#   This file contains a durable journal of the work done on each course.
+#   Every item (and every question within a question pool) is recorded as completed or failed along with when, so a
+#   rerun after a crash or a failure can skip finished work and resume where it stopped, while items a later link
+#   validation still reports as broken are fixed again.
+#
+##
+
+COMPLETED = "completed"
+FAILED = "failed"
+
+
+def hash_content(content):
+    """Returns a hash identifying the given HTML content."""
+    if content is None:
+        return None
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+class CourseJournal:
+    """SQLite-backed record of the items and questions handled in each course.
+    A single journal can be shared by several workers."""
+
+    def __init__(self, path):
+        self.__lock = threading.Lock()
+        self.__connection = sqlite3.connect(path, check_same_thread=False)
+        with self.__lock, self.__connection:
+            self.__connection.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                "course TEXT NOT NULL, url TEXT NOT NULL, part TEXT NOT NULL, status TEXT NOT NULL, "
+                "updated REAL NOT NULL, PRIMARY KEY (course, url, part))")
+
+    def get_entry(self, course, url, part=""):
+        """Returns the recorded status of an item (or a part of it, like a question) and when it was recorded, or None
+        if it is new."""
+        with self.__lock:
+            return self.__connection.execute(
+                "SELECT status, updated FROM entries WHERE course = ? AND url = ? AND part = ?",
+                (course, url, part)).fetchone()
+
+    def is_completed(self, course, url, part="", after=None):
+        """Returns true if the item was recorded as completed, later than `after` (a Unix time) if given."""
+        entry = self.get_entry(course, url, part)
+        return entry is not None and entry[0] == COMPLETED and (after is None or entry[1] >= after)
+
+    def record(self, course, url, status, part=""):
+        """Record the status of an item or part of an item, replacing any previous entry."""
+        with self.__lock, self.__connection:
+            self.__connection.execute("INSERT OR REPLACE INTO entries (course, url, part, status, updated) "
+                                      "VALUES (?, ?, ?, ?, ?)", (course, url, part, status, time.time()))
+
+    def clear(self, course):
+        """Forget everything recorded for a course, so the next run starts from the top."""
+        with self.__lock, self.__connection:
+            self.__connection.execute("DELETE FROM entries WHERE course = ?", (course,))
+
+    def close(self):
+        with self.__lock:
+            self.__connection.close()
@@ -0,0 +1,190 @@
+import datetime
+import json
+import os
+import threading
+import time
+import urllib.parse
+from collections import namedtuple
+from concurrent.futures import Future
+
+from canvas_api import CanvasAPIException
+
+##
+#
+#   This file runs Canvas course link validation as a background job instead of waiting on the link validator page.
+#   Jobs are started and polled through Canvas's link validation endpoint, so several courses can be validated at
+#   once from a single polling thread, and finished results are cached on disk per course so later runs can reuse
+#   a recent validation. Runs submit every course up front, so validations overlap with fixing earlier courses.
+#
+##
+
+POLL_INTERVAL = 5
+CACHE_MAX_AGE = 24 * 60 * 60
+
+# Link validator issue type -> item type used by the fixer
+ISSUE_TYPES = {
+    "assessment_question": "assessment_question",
+    "quiz_question": "quiz_question",
+    "wiki_page": "page",
+    "assignment": "assignment",
+    "discussion_topic": "discussion",
+}
+
+# A single result of the course link validator that contains xid links
+XIDItem = namedtuple("XIDItem", ["url", "item_type", "xid_links"])
+
+
+def parse_link_validation_results(results, base_url):
+    """Convert the results of a link validation job into a list of XIDItems, keeping only issues with xid links."""
+    items = []
+    for issue in (results or {}).get("issues", []):
+        xid_links = [link["url"] for link in issue.get("invalid_links", []) if "xid" in (link.get("url") or "")]
+        if len(xid_links) == 0 or not issue.get("content_url"):
+            continue
+        url = urllib.parse.urljoin(base_url + "/", issue["content_url"]).split("#")[0]
+        items.append(XIDItem(url, ISSUE_TYPES.get(issue.get("type")), xid_links))
+    return items
+
+
+def get_completed_at(progress):
+    """Returns when Canvas last updated a link validation job as a Unix time, or None if it doesn't say."""
+    try:
+        return datetime.datetime.fromisoformat(progress["updated_at"].replace("Z", "+00:00")).timestamp()
+    except (KeyError, AttributeError, ValueError):
+        return None
+
+
+class LinkValidationCache:
+    """On-disk cache of the xid items found by each course's most recent link validation."""
+
+    def __init__(self, directory, max_age=CACHE_MAX_AGE):
+        self.__directory = directory
+        self.__max_age = max_age
+        os.makedirs(directory, exist_ok=True)
+
+    def __path(self, course_id):
+        return os.path.join(self.__directory, "link_validation_{}.json".format(course_id))
+
+    def get_entry(self, course_id):
+        """Returns a tuple of the cache timestamp and items for a course, or None if nothing is cached."""
+        try:
+            with open(self.__path(course_id)) as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return entry["timestamp"], [XIDItem(*item) for item in entry["items"]]
+
+    def get(self, course_id, since=None):
+        """Returns the cached items of a course, or None if there are none newer than the maximum age, or than
+        `since` (a Unix time) if given."""
+        entry = self.get_entry(course_id)
+        if entry is None or time.time() - entry[0] > self.__max_age or (since is not None and entry[0] < since):
+            return None
+        return entry[1]
+
+    def put(self, course_id, items, timestamp=None):
+        """Cache the items of a course. `timestamp` is when Canvas produced them, now if it isn't known."""
+        path = self.__path(course_id)
+        with open(path + ".tmp", "w") as f:
+            json.dump({"timestamp": timestamp or time.time(), "items": [list(item) for item in items]}, f)
+        os.replace(path + ".tmp", path)
+
+
+class LinkValidationPoller:
+    """Starts and polls the link validation jobs of any number of courses from one background thread.
+    Submitting a course returns a Future that resolves to its list of XIDItems. Submitting it again returns the
+    same Future until it is forgotten, fails or gets older than `max_age`, so a validation submitted ahead of time
+    is picked up when the course is fixed."""
+
+    def __init__(self, cache=None, poll_interval=POLL_INTERVAL, max_age=CACHE_MAX_AGE):
+        self.__cache = cache
+        self.__poll_interval = poll_interval
+        self.__max_age = max_age
+        self.__jobs = {}
+        self.__futures = {}
+        self.__lock = threading.Lock()
+        self.__thread = None
+
+    def __get_future(self, course_id):
+        """Returns the Future of an earlier submission of the course that can be reused, or None."""
+        future, submitted = self.__futures.get(course_id, (None, 0))
+        if future is None or time.time() - submitted > self.__max_age:
+            return None
+        if future.done() and future.exception() is not None:
+            return None
+        return future
+
+    def submit(self, api, course_id, restart=False, fresh_after=None):
+        """Returns a Future for the link validation results of a course.
+        The most recent results Canvas has are used unless `restart` is set or there are none, in which case a
+        new validation is started, unless one is already running. With `restart`, results Canvas completed after
+        `fresh_after` (a Unix time, like when the fix was queued) are still used, since another process must have
+        started that validation for the same run. Raises a CanvasAPIException if the job cannot be started."""
+        with self.__lock:
+            future = self.__get_future(course_id)
+            if future is not None:
+                return future
+            future = Future()
+            self.__futures[course_id] = (future, time.time())
+
+        try:
+            progress = api.get_link_validation(course_id)
+            state = progress.get("workflow_state")
+            completed_at = get_completed_at(progress) if state == "completed" else None
+            fresh = fresh_after is not None and completed_at is not None and completed_at >= fresh_after
+            if state == "completed" and (not restart or fresh):
+                self.__finish(api, course_id, future, progress)
+                return future
+            if state not in ("queued", "running"):
+                api.start_link_validation(course_id)
+        except CanvasAPIException as e:
+            # Anyone else waiting on this submission fails too, and the next submission tries again
+            future.set_exception(e)
+            raise
+
+        with self.__lock:
+            self.__jobs[course_id] = (api, future)
+            if self.__thread is None or not self.__thread.is_alive():
+                self.__thread = threading.Thread(target=self.__run, daemon=True)
+                self.__thread.start()
+        return future
+
+    def forget(self, course_id):
+        """Drop the submission of a course once its results were used, so the next run validates it again."""
+        with self.__lock:
+            self.__futures.pop(course_id, None)
+
+    def __finish(self, api, course_id, future, progress):
+        items = parse_link_validation_results(progress.get("results"), api.get_base_url())
+        if self.__cache is not None:
+            self.__cache.put(course_id, items, get_completed_at(progress))
+        future.set_result(items)
+
+    def __run(self):
+        while True:
+            time.sleep(self.__poll_interval)
+            with self.__lock:
+                if len(self.__jobs) == 0:
+                    self.__thread = None
+                    return
+                jobs = list(self.__jobs.items())
+
+            for course_id, (api, future) in jobs:
+                try:
+                    progress = api.get_link_validation(course_id)
+                except CanvasAPIException as e:
+                    self.__remove(course_id)
+                    future.set_exception(e)
+                    continue
+
+                state = progress.get("workflow_state")
+                if state == "completed":
+                    self.__remove(course_id)
+                    self.__finish(api, course_id, future, progress)
+                elif state == "failed":
+                    self.__remove(course_id)
+                    future.set_exception(CanvasAPIException("Link validation failed for course {}.".format(course_id)))
+
+    def __remove(self, course_id):
+        with self.__lock:
+            del self.__jobs[course_id]
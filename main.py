@@ -0,0 +1,320 @@
+import argparse
+import datetime
+import functools
+import getpass
+import json
+import os
+import sys
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+
+from browsers import BrowserPool, create_browser
+from canvas_api import CanvasAPI, CanvasAPIException
+from cartridge import fix_package
+from config import JOURNAL_PATH, VALIDATION_CACHE_DIR, BLOCK_RESOURCES, WAIT_TIMEOUT_SCALE, TIMINGS_PATH, \
+    BROWSER_RSS_MB, BROWSER_MAX_ITEMS, API_TOKEN, get_item_seconds, get_memo, get_resource_filter
+from discovery import POLICIES, LARGEST_FIRST, estimate_courses, list_courses, schedule
+from events import CourseDone, CourseError, ItemResult, ItemVerified, MemoUsage, StageTimed, event_to_dict, \
+    ITEM_SUCCESS, ITEM_FAILED, ITEM_SKIPPED
+from fixer import BACKEND_SELENIUM, BACKEND_API, BASE_URL, get_course_id
+from journal import CourseJournal
+from link_validation import LinkValidationCache, LinkValidationPoller
+from pool import run_courses
+from session import CanvasSession
+from timing import write_jsonl
+from wait import WaitPolicy
+
+# Events written to the results file unless every event is requested
+RESULT_EVENTS = (ItemResult, ItemVerified, CourseError, CourseDone)
+
+##
+#
+#   This file is the command line interface of the fixer, for running large lists of courses without the web UI
+#   (for example overnight from cron). Courses are read from a file or stdin and the results are written as JSON lines.
+#   A course list can be split across several machines with `--shard i/N`: every machine gets the same list and
+#   picks its share by hashing course IDs, and the result files are combined afterwards with `merge`.
+#   Exported course packages can also be fixed offline, before they are imported, with `cartridge`, and `discover`
+#   lists the courses of an account or term in the order they should be fixed.
+#   Run `python3 main.py -h` for usage.
+#
+##
+
+
+def read_courses(file):
+    """Returns the courses (IDs or URLs) in a text file, separated by whitespace. Lines starting with # are ignored."""
+    courses = []
+    for line in file:
+        if not line.strip().startswith("#"):
+            courses.extend(line.split())
+    return courses
+
+
+def parse_shard(value):
+    """Parse a shard argument like "2/4" into `(index, count)`, where index counts from 1."""
+    try:
+        index, count = (int(part) for part in value.split("/"))
+    except ValueError:
+        raise argparse.ArgumentTypeError("shards look like i/N, for example 2/4")
+    if count < 1 or not 1 <= index <= count:
+        raise argparse.ArgumentTypeError("shard {} is not between 1 and {}".format(index, count))
+    return index, count
+
+
+def select_shard(courses, index, count):
+    """Returns the courses that belong to a shard. The same course always lands in the same shard, no matter the
+    order or content of the rest of the list."""
+    return [c for c in courses if zlib.crc32((get_course_id(c) or c).encode("utf-8")) % count == index - 1]
+
+
+def get_credentials():
+    """Returns the Boise State username and password from XID_USERNAME and XID_PASSWORD, prompting for missing ones on
+    the terminal, even when courses are read from stdin. Returns None if one is missing and there is no terminal."""
+    username = os.environ.get('XID_USERNAME')
+    password = os.environ.get('XID_PASSWORD')
+    if username and password:
+        return username, password
+
+    if sys.stdin.isatty():
+        username = username or input("Username: ")
+        password = password or getpass.getpass("Password: ")
+        return username, password
+    try:
+        with open("/dev/tty", "r+") as tty:
+            if not username:
+                tty.write("Username: ")
+                tty.flush()
+                username = tty.readline().strip()
+            # getpass reads from the terminal itself rather than stdin
+            password = password or getpass.getpass("Password: ", stream=tty)
+    except OSError:
+        return None
+    return (username, password) if username and password else None
+
+
+def run(args):
+    """Fix the listed courses, writing a JSON line for every result. Returns the exit code."""
+    courses = read_courses(sys.stdin if args.courses == "-" else open(args.courses))
+    if args.shard is not None:
+        courses = select_shard(courses, *args.shard)
+    if not courses:
+        print("No courses to fix")
+        return 0
+    print("Fixing {} course(s) with {} browser(s)".format(len(courses), args.workers))
+
+    credentials = get_credentials()
+    if credentials is None:
+        print("There is no terminal to ask for the login on, set XID_USERNAME and XID_PASSWORD")
+        return 1
+    username, password = credentials
+    browsers = BrowserPool(args.workers, warm=0, create=functools.partial(create_browser, log_network=BLOCK_RESOURCES),
+                           max_items=BROWSER_MAX_ITEMS, max_rss_mb=BROWSER_RSS_MB)
+    journal = CourseJournal(JOURNAL_PATH)
+    if args.restart:
+        for course in courses:
+            journal.clear(get_course_id(course) or course)
+    validation_cache = LinkValidationCache(VALIDATION_CACHE_DIR)
+    memo = get_memo()
+
+    errors = 0
+    verified, verify_failed = 0, 0
+    memo_hits, memo_misses = 0, 0
+    timings = []
+    try:
+        with open(args.output, "a") as output:
+            for event in run_courses(courses, browsers, username, password, args.revalidate, workers=args.workers,
+                                     backend=args.backend, journal=journal,
+                                     link_validator=LinkValidationPoller(cache=validation_cache),
+                                     validation_cache=validation_cache, session=CanvasSession(BASE_URL),
+                                     resource_filter=get_resource_filter(),
+                                     wait_policy=WaitPolicy(timeout_scale=WAIT_TIMEOUT_SCALE), memo=memo,
+                                     verify=args.verify):
+                if isinstance(event, CourseError):
+                    errors += 1
+                elif isinstance(event, StageTimed):
+                    timings.append(event.timing)
+                elif isinstance(event, ItemVerified):
+                    verified += 1
+                    verify_failed += not event.passed
+                elif isinstance(event, MemoUsage):
+                    memo_hits += event.hits
+                    memo_misses += event.misses
+                if args.all_events or isinstance(event, RESULT_EVENTS):
+                    output.write(json.dumps(event_to_dict(event)) + "\n")
+                    output.flush()
+    finally:
+        browsers.close()
+        journal.close()
+        if memo is not None:
+            memo.close()
+
+    if memo_hits + memo_misses > 0:
+        print("Reused {} of {} rewrites".format(memo_hits, memo_hits + memo_misses))
+    if verified > 0:
+        print("Verified {} fixed items: {} passed, {} failed".format(verified, verified - verify_failed,
+                                                                   verify_failed))
+    if TIMINGS_PATH and timings:
+        with open(TIMINGS_PATH, "a") as f:
+            write_jsonl(timings, f)
+    return 1 if errors or verify_failed else 0
+
+
+def merge(args):
+    """Combine result files from several shards into one and print a summary. Returns the exit code."""
+    records = []
+    for path in args.results:
+        with open(path) as f:
+            records.extend(json.loads(line) for line in f if line.strip())
+
+    # Reruns append to the same result file, so only the last result of each item and course counts
+    latest = {}
+    result_types = {event_type.__name__ for event_type in RESULT_EVENTS}
+    for index, record in enumerate(records):
+        key = (record["course"], record.get("url"), record["type"]) if record["type"] in result_types else index
+        latest.pop(key, None)
+        latest[key] = record
+
+    # Group by course, keeping each course's records in the order they were written
+    by_course = {}
+    for record in latest.values():
+        by_course.setdefault(record["course"], []).append(record)
+
+    counts = {ITEM_SUCCESS: 0, ITEM_FAILED: 0, ITEM_SKIPPED: 0}
+    done, errored = 0, 0
+    verified, verify_failed = 0, 0
+    with open(args.output, "w") as output:
+        for course in sorted(by_course):
+            for record in by_course[course]:
+                output.write(json.dumps(record) + "\n")
+                if record["type"] == ItemResult.__name__:
+                    counts[record["status"]] += 1
+                elif record["type"] == ItemVerified.__name__:
+                    verified += 1
+                    verify_failed += not record["passed"]
+            # A course that stopped with an error and was finished by a rerun is done, and the other way around
+            outcomes = [record["type"] for record in by_course[course]
+                        if record["type"] in (CourseDone.__name__, CourseError.__name__)]
+            done += outcomes[-1:] == [CourseDone.__name__]
+            errored += outcomes[-1:] == [CourseError.__name__]
+
+    print("{} course(s): {} done, {} stopped with an error, {} unfinished".format(
+        len(by_course), done, errored, len(by_course) - done - errored))
+    print("Items: {} succeeded, {} failed, {} skipped".format(counts[ITEM_SUCCESS], counts[ITEM_FAILED],
+                                                             counts[ITEM_SKIPPED]))
+    if verified > 0:
+        print("Verified: {} passed, {} failed".format(verified - verify_failed, verify_failed))
+    return 0
+
+
+def discover(args):
+    """Find courses and write them in the order they should be fixed, with an estimate of how long that takes.
+    Returns the exit code."""
+    api = CanvasAPI(BASE_URL, token=API_TOKEN) if API_TOKEN else None
+    if args.courses is not None:
+        courses = [(get_course_id(c) or c, "")
+                   for c in read_courses(sys.stdin if args.courses == "-" else open(args.courses))]
+    elif api is None:
+        print("Set CANVAS_API_TOKEN to list courses through the Canvas API, or give a course list with --courses")
+        return 1
+    else:
+        try:
+            courses = list_courses(api, args.account, args.term)
+        except CanvasAPIException as e:
+            print("Unable to list courses: {}".format(e))
+            return 1
+    if not courses:
+        print("No courses found")
+        return 0
+
+    estimates = estimate_courses(courses, LinkValidationCache(VALIDATION_CACHE_DIR), api)
+    scheduled, seconds = schedule(estimates, args.policy, args.workers, get_item_seconds())
+    with open(args.output, "w") as output:
+        for course in scheduled:
+            output.write("# {}: {} xid items{}, done after {}\n{}\n".format(
+                course.name or "Course {}".format(course.course), course.items, "" if course.known else " (guessed)",
+                datetime.timedelta(seconds=round(course.finish)), course.course))
+
+    print("{} course(s) with about {} xid items, {} never validated".format(
+        len(scheduled), sum(course.items for course in scheduled), sum(not course.known for course in scheduled)))
+    print("Estimated time with {} browser(s): {}".format(args.workers, datetime.timedelta(seconds=round(seconds))))
+    print("Wrote the courses to {}, fix them with `python3 main.py run {} --workers {}`".format(
+        args.output, args.output, args.workers))
+    return 0
+
+
+def fix_packages(args):
+    """Fix exported course packages offline, writing the fixed copies to the output folder. Returns the exit code."""
+    os.makedirs(args.output_dir, exist_ok=True)
+    destinations = [os.path.join(args.output_dir, os.path.basename(path)) for path in args.packages]
+    if any(os.path.abspath(s) == os.path.abspath(d) for s, d in zip(args.packages, destinations)):
+        print("The output folder must be different from the folder of the packages")
+        return 1
+
+    missing = 0
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        for source, report in zip(args.packages, executor.map(fix_package, args.packages, destinations)):
+            print("{}: replaced {} images in {} entries".format(source, report["replaced"], report["entries"]))
+            if report["missing"]:
+                missing += 1
+                print("  No file in the package for: {}".format(", ".join(sorted(report["missing"]))))
+    return 1 if missing else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fix xid image links in Canvas courses imported from Blackboard.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser("run", help="fix a list of courses")
+    run_parser.add_argument("courses", nargs="?", default="-",
+                            help="file listing course IDs or URLs separated by whitespace, - for stdin (default)")
+    run_parser.add_argument("-o", "--output", default="xid_results.jsonl",
+                            help="file to append JSON line results to (default: %(default)s)")
+    run_parser.add_argument("-w", "--workers", type=int, default=1, help="browsers to run in parallel (default: 1)")
+    run_parser.add_argument("--shard", type=parse_shard,
+                            help="only fix shard i of N, like 2/4, to split one course list across N machines")
+    run_parser.add_argument("--backend", choices=(BACKEND_SELENIUM, BACKEND_API), default=BACKEND_SELENIUM,
+                            help="edit through the browser or the Canvas API (default: %(default)s)")
+    run_parser.add_argument("--revalidate", action="store_true", help="force Canvas to revalidate course links")
+    run_parser.add_argument("--restart", action="store_true", help="ignore progress from previous runs")
+    run_parser.add_argument("--verify", action="store_true",
+                            help="read fixed items back after each course and check that they are clean")
+    run_parser.add_argument("--all-events", action="store_true",
+                            help="write every event (progress, timings, ...) instead of only results")
+    run_parser.set_defaults(handler=run)
+
+    merge_parser = subparsers.add_parser("merge", help="combine the result files of several shards")
+    merge_parser.add_argument("results", nargs="+", help="result files to combine")
+    merge_parser.add_argument("-o", "--output", default="xid_results_merged.jsonl",
+                              help="file to write the combined results to (default: %(default)s)")
+    merge_parser.set_defaults(handler=merge)
+
+    discover_parser = subparsers.add_parser("discover", help="list the courses of an account or term in the order "
+                                                             "they should be fixed")
+    discover_parser.add_argument("--account", help="account to list the courses of (default: your own courses)")
+    discover_parser.add_argument("--term", help="only list courses of this enrollment term ID")
+    discover_parser.add_argument("--courses",
+                                 help="order this course list (a file, - for stdin) instead of listing courses")
+    discover_parser.add_argument("--policy", choices=POLICIES, default=LARGEST_FIRST,
+                                 help="fix the largest courses first to keep every browser busy until the end, or "
+                                      "the smallest first to finish many courses early (default: %(default)s)")
+    discover_parser.add_argument("-w", "--workers", type=int, default=1,
+                                 help="browsers the courses will be fixed with, for the estimate (default: 1)")
+    discover_parser.add_argument("-o", "--output", default="xid_courses.txt",
+                                 help="file to write the ordered course list to (default: %(default)s)")
+    discover_parser.set_defaults(handler=discover)
+
+    cartridge_parser = subparsers.add_parser("cartridge", help="fix exported course packages (.imscc or .zip) offline")
+    cartridge_parser.add_argument("packages", nargs="+", help="course packages to fix")
+    cartridge_parser.add_argument("-d", "--output-dir", default="fixed_packages",
+                                  help="folder to write the fixed packages to (default: %(default)s)")
+    cartridge_parser.add_argument("-w", "--workers", type=int, default=os.cpu_count(),
+                                  help="packages to fix in parallel (default: number of CPUs)")
+    cartridge_parser.set_defaults(handler=fix_packages)
+
+    args = parser.parse_args()
+    if getattr(args, "workers", 1) < 1:
+        parser.error("--workers must be at least 1")
+    sys.exit(args.handler(args))
+
+
+if __name__ == "__main__":
+    main()
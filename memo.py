@@ -0,0 +1,90 @@
+import sqlite3
+import threading
+import time
+
+from journal import hash_content
+
+MAX_MEMO_BYTES = 256 * 1024 * 1024
+
+##
+#
+#   This file remembers the rewrites the fixer has made. Courses copied from the same Blackboard course contain the
+#   same question texts, answers and page bodies many times over, so a rewrite is stored under a hash of the course
+#   and the original HTML and reused whenever that HTML comes up again instead of resolving every image again.
+#   The store is on disk and bounded in size, evicting the least recently used rewrites first.
+#
+##
+
+
+def get_memo_key(course, html):
+    """Returns the key of a rewrite. The course is part of it since replacement images link to the course's files."""
+    return hash_content("{}\n{}".format(course, html))
+
+
+class RewriteMemo:
+    """SQLite-backed LRU store of rewritten HTML, holding at most about `max_bytes` of rewrites.
+    A single memo file can be shared by several workers and processes. The memo only saves time, so database errors
+    (such as another process holding the lock for too long) are logged and treated as misses."""
+
+    def __init__(self, path, max_bytes=MAX_MEMO_BYTES):
+        self.__max_bytes = max_bytes
+        self.__lock = threading.Lock()
+        self.__connection = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        with self.__lock:
+            self.__connection.execute("PRAGMA journal_mode=WAL")
+            self.__connection.execute(
+                "CREATE TABLE IF NOT EXISTS rewrites ("
+                "key TEXT PRIMARY KEY, html TEXT NOT NULL, replaced INTEGER NOT NULL, size INTEGER NOT NULL, "
+                "used REAL NOT NULL)")
+            # Covers the size total and the eviction order, so neither has to read the rewritten HTML
+            self.__connection.execute("CREATE INDEX IF NOT EXISTS rewrites_lru ON rewrites (used, size)")
+
+    def get(self, course, html):
+        """Returns a tuple of the rewritten HTML and the number of references replaced, or None if this HTML hasn't
+        been rewritten in this course before."""
+        key = get_memo_key(course, html)
+        try:
+            with self.__lock:
+                row = self.__connection.execute("SELECT html, replaced FROM rewrites WHERE key = ?",
+                                                (key,)).fetchone()
+                if row is not None:
+                    self.__connection.execute("UPDATE rewrites SET used = ? WHERE key = ?", (time.time(), key))
+        except sqlite3.Error as e:
+            print("Unable to read the rewrite memo: {}".format(e))
+            return None
+        return row
+
+    def put(self, course, html, rewritten, replaced):
+        """Remember the rewrite of some HTML, evicting the least recently used rewrites if the memo is full.
+        The size of the memo is summed up in the same transaction, so the limit holds for every process using it."""
+        key = get_memo_key(course, html)
+        size = len(rewritten.encode("utf-8"))
+        try:
+            with self.__lock:
+                self.__connection.execute("BEGIN IMMEDIATE")
+                try:
+                    self.__connection.execute("INSERT OR REPLACE INTO rewrites VALUES (?, ?, ?, ?, ?)",
+                                              (key, rewritten, replaced, size, time.time()))
+                    self.__evict()
+                    self.__connection.execute("COMMIT")
+                except Exception:
+                    self.__connection.execute("ROLLBACK")
+                    raise
+        except sqlite3.Error as e:
+            print("Unable to write to the rewrite memo: {}".format(e))
+
+    def __evict(self):
+        total = self.__connection.execute("SELECT COALESCE(SUM(size), 0) FROM rewrites").fetchone()[0]
+        while total > self.__max_bytes:
+            rows = self.__connection.execute("SELECT rowid, size FROM rewrites ORDER BY used LIMIT 100").fetchall()
+            if not rows:
+                break
+            for rowid, evicted_size in rows:
+                self.__connection.execute("DELETE FROM rewrites WHERE rowid = ?", (rowid,))
+                total -= evicted_size
+                if total <= self.__max_bytes:
+                    break
+
+    def close(self):
+        with self.__lock:
+            self.__connection.close()
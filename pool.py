@@ -0,0 +1,165 @@
+import asyncio
+import queue
+import threading
+
+from canvas_api import CanvasAPIException
+from events import CourseError, CourseStarted
+from fixer import XIDFixer, get_course_id
+
+##
+#
+#   This file runs several courses at once, each worker owning its own browser (taken from a BrowserPool) and XIDFixer.
+#   Courses are taken from a shared queue and the events each worker's `do_course` yields are merged into a
+#   single stream, so callers can display one combined progress view. `run_courses_async` offers the same stream to
+#   asyncio code without blocking its event loop.
+#
+##
+
+_WORKER_DONE = object()
+
+# Seconds between checks for a logged in session to start link validations with
+SESSION_POLL_INTERVAL = 1
+
+
+def submit_link_validations(courses, link_validator, session, restart, stop, validation_cache=None, fresh_after=None):
+    """Submit the link validation of every course as soon as `session` is logged in, so the validations run while
+    earlier courses are being fixed instead of once a worker reaches each course.
+    Courses with recent cached results are left alone unless `restart` is set, in which case only results newer than
+    `fresh_after` are. Stops early once `stop` is set."""
+    while not session.is_captured():
+        if stop.wait(SESSION_POLL_INTERVAL):
+            return
+
+    for course in courses:
+        if stop.is_set():
+            return
+        course_id = get_course_id(course) or course
+        if validation_cache is not None and (not restart or fresh_after is not None) and \
+                validation_cache.get(course_id, since=fresh_after if restart else None) is not None:
+            continue
+        api = session.get_api()
+        try:
+            link_validator.submit(api, course_id, restart=restart, fresh_after=fresh_after)
+        except CanvasAPIException as e:
+            print("Unable to start the link validation of course {} ahead of time: {}".format(course_id, e))
+
+
+def run_courses(courses, browsers, username, password, revalidate_links=False, workers=1, upcoming=(), cancel=None,
+                **fixer_options):
+    """Fix the given courses using up to `workers` browsers from the `browsers` pool in parallel.
+    Each worker holds its browser for the whole run, replacing it between items if the pool says it needs recycling.
+    `fixer_options` are passed to every worker's XIDFixer, so objects like a journal are shared by all workers.
+    With a `link_validator` and a `session`, the link validation of every course, and of the `upcoming` courses
+    that will be fixed by later runs, is started as soon as the first worker has logged in.
+    Yields every event of every course (see events.py). Besides the `do_course` events, a CourseStarted event is
+    yielded when a worker picks up a course. Setting `cancel` (a threading.Event) from another thread stops the run
+    the same way as no longer iterating: workers stop after the event they are on and release their browsers."""
+    course_queue = queue.Queue()
+    for course in courses:
+        course_queue.put(course)
+
+    events = queue.Queue()
+    stop = threading.Event()
+
+    def stopping():
+        return stop.is_set() or (cancel is not None and cancel.is_set())
+
+    link_validator, session = fixer_options.get("link_validator"), fixer_options.get("session")
+    if link_validator is not None and session is not None:
+        threading.Thread(target=submit_link_validations, daemon=True,
+                         args=(list(courses) + list(upcoming), link_validator, session, revalidate_links, stop,
+                               fixer_options.get("validation_cache"), fixer_options.get("fresh_after"))).start()
+
+    def work():
+        try:
+            driver = browsers.acquire()
+        except Exception as e:
+            print("Unable to start a browser: {}".format(e))
+            events.put(_WORKER_DONE)
+            return
+
+        xid_fix = None
+        try:
+            xid_fix = XIDFixer(driver, browsers=browsers, **fixer_options)
+            while not stopping():
+                try:
+                    course = course_queue.get_nowait()
+                except queue.Empty:
+                    break
+
+                events.put(CourseStarted(course))
+                for event in xid_fix.do_course(course, username, password, revalidate_links):
+                    events.put(event)
+                    if isinstance(event, CourseError) and event.fatal:
+                        stop.set()
+                    if stopping():
+                        break
+
+                # The fixer replaces its browser between items when needed, so ask it which one it ended up with
+                driver = xid_fix.get_driver()
+                renewed = browsers.renew(driver)
+                if renewed is not driver:
+                    driver = renewed
+                    xid_fix = XIDFixer(driver, browsers=browsers, **fixer_options)
+        except Exception as e:
+            print("Worker stopped unexpectedly: {}".format(e))
+        finally:
+            if xid_fix is not None:
+                driver = xid_fix.get_driver()
+            browsers.release(driver)
+            events.put(_WORKER_DONE)
+
+    worker_count = max(1, min(workers, len(courses), browsers.get_max_size()))
+    threads = [threading.Thread(target=work, daemon=True) for _ in range(worker_count)]
+    for thread in threads:
+        thread.start()
+
+    try:
+        running = worker_count
+        while running > 0:
+            event = events.get()
+            if event is _WORKER_DONE:
+                running -= 1
+            else:
+                yield event
+    finally:
+        # Stop handing out courses if the consumer stops listening
+        stop.set()
+
+
+async def run_courses_async(courses, browsers, username, password, revalidate_links=False, workers=1,
+                            **fixer_options):
+    """Same as `run_courses`, as an async generator. The browsers are driven from a background thread, so the event
+    loop keeps running while courses are being fixed. The run is cancelled once the consumer stops iterating or the
+    event loop closes."""
+    loop = asyncio.get_running_loop()
+    events = asyncio.Queue()
+    cancel = threading.Event()
+
+    def deliver(event):
+        try:
+            loop.call_soon_threadsafe(events.put_nowait, event)
+        except RuntimeError:
+            # The event loop closed without waiting for the run to end
+            cancel.set()
+
+    def forward():
+        try:
+            for event in run_courses(courses, browsers, username, password, revalidate_links, workers,
+                                     cancel=cancel, **fixer_options):
+                if cancel.is_set():
+                    break
+                deliver(event)
+        finally:
+            if not cancel.is_set():
+                deliver(_WORKER_DONE)
+
+    threading.Thread(target=forward, daemon=True).start()
+    try:
+        while True:
+            event = await events.get()
+            if event is _WORKER_DONE:
+                return
+            yield event
+    finally:
+        cancel.set()
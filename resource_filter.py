@@ -0,0 +1,76 @@
+import json
+
+from selenium.common.exceptions import WebDriverException
+
+##
+#
+#   This file blocks the parts of Canvas pages the fixer never needs (fonts, images, media, analytics, avatars and
+#   LTI frames) through the Chrome DevTools protocol, and counts the requests each item blocked and loaded.
+#   Counting reads the browser's performance log, so browsers must be started with network logging enabled
+#   (see `create_browser(log_network=True)`). Blocking is off unless XID_BLOCK_RESOURCES is set (see config.py).
+#
+##
+
+# Resource type -> URL patterns that select it. DevTools can only block by URL, and a pattern matches any URL that
+# contains its parts in order, anywhere, query string included. An extension on its own would also block API calls
+# such as `/api/v1/courses/1/files?search_term=a.png`, so types are matched by the paths Canvas serves them from.
+RESOURCE_TYPE_PATTERNS = {
+    "Font": ["*/fonts/*", "*/dist/*.woff*", "*/dist/*.ttf*"],
+    "Image": ["*/files/*/preview*", "*/files/*/thumbnail*", "*/images/thumbnails/*", "*/dist/images/*",
+              "*/images/*.png", "*/images/*.svg", "*/images/*.gif"],
+    "Media": ["*/media_objects/*/thumbnail*", "*/media_objects_iframe/*", "*/media_attachments_iframe/*"],
+}
+
+DEFAULT_BLOCKED_TYPES = ("Font", "Image", "Media")
+
+DEFAULT_DENY_PATTERNS = (
+    "*google-analytics.com*",
+    "*googletagmanager.com*",
+    "*pendo.io*",
+    "*nr-data.net*",
+    "*/images/users/*",
+    "*/images/messages/avatar*",
+    "*/external_tools/*",
+)
+
+
+class ResourceFilter:
+    """Blocks requests by resource type and URL pattern.
+    `allow` patterns are removed from the generated block list, so they can keep something a type would block
+    (for example allowing "*.svg*" while blocking images)."""
+
+    def __init__(self, blocked_types=DEFAULT_BLOCKED_TYPES, deny=DEFAULT_DENY_PATTERNS, allow=()):
+        patterns = list(deny)
+        for resource_type in blocked_types:
+            patterns.extend(RESOURCE_TYPE_PATTERNS.get(resource_type, []))
+        self.__patterns = [p for p in dict.fromkeys(patterns) if p not in allow]
+
+    def apply(self, driver):
+        """Start blocking in the driver's current tab. DevTools settings are per tab, so call this for every new tab."""
+        try:
+            driver.execute_cdp_cmd("Network.enable", {})
+            driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": self.__patterns})
+        except WebDriverException as e:
+            print("Unable to block page resources: {}".format(e))
+
+    @staticmethod
+    def collect(driver):
+        """Returns counters of the requests blocked and loaded since the last call.
+        Bytes are only known for loaded requests, since blocked requests are never downloaded."""
+        counters = {"blocked_requests": 0, "loaded_requests": 0, "loaded_bytes": 0}
+        try:
+            entries = driver.get_log("performance")
+        except WebDriverException:
+            return counters
+
+        for entry in entries:
+            try:
+                message = json.loads(entry["message"])["message"]
+            except (KeyError, ValueError):
+                continue
+            if message.get("method") == "Network.loadingFailed" and message["params"].get("blockedReason"):
+                counters["blocked_requests"] += 1
+            elif message.get("method") == "Network.loadingFinished":
+                counters["loaded_requests"] += 1
+                counters["loaded_bytes"] += int(message["params"].get("encodedDataLength", 0))
+        return counters
@@ -0,0 +1,72 @@
+import threading
+
+from canvas_api import CanvasAPI
+
+##
+#
+#   This file contains the authenticated Canvas session shared by every course, browser and API client of a run.
+#   The first browser to log in captures its cookies, and every later course or extra browser loads them instead of
+#   going through the login page and another Duo push. Logging in again only happens once Canvas stops accepting
+#   the captured cookies.
+#
+##
+
+# A page on the Canvas domain that loads without authentication, used to set cookies before navigating anywhere
+COOKIE_PAGE = "/robots.txt"
+COOKIE_FIELDS = ("name", "value", "path", "domain", "secure", "httpOnly", "expiry", "sameSite")
+
+
+class CanvasSession:
+    """Cookies of a logged in Canvas session.
+    `login_lock` is held by whoever is logging in, so only one browser prompts for Duo at a time and the others
+    can reuse the session it captures."""
+
+    def __init__(self, base_url):
+        self.__base_url = base_url
+        self.__lock = threading.Lock()
+        self.__cookies = None
+        self.__api = None
+        self.__version = 0
+        self.login_lock = threading.Lock()
+
+    def get_version(self):
+        """Returns a number that changes every time a new session is captured."""
+        return self.__version
+
+    def is_captured(self):
+        return self.__cookies is not None
+
+    def capture(self, driver):
+        """Store the cookies of a driver that has just logged into Canvas."""
+        self.load(driver.get_cookies())
+
+    def load(self, cookies):
+        """Store cookies captured elsewhere, for example by another worker process."""
+        with self.__lock:
+            self.__cookies = cookies
+            self.__api = None
+            self.__version += 1
+
+    def get_cookies(self):
+        """Returns the captured cookies, or None if there is no session yet."""
+        with self.__lock:
+            return self.__cookies
+
+    def apply(self, driver):
+        """Load the captured session into another driver. Returns False if there is no session yet."""
+        with self.__lock:
+            cookies = self.__cookies
+        if cookies is None:
+            return False
+
+        driver.get(self.__base_url + COOKIE_PAGE)
+        for cookie in cookies:
+            driver.add_cookie({k: v for k, v in cookie.items() if k in COOKIE_FIELDS and v is not None})
+        return True
+
+    def get_api(self):
+        """Returns an API client authenticated with the captured session, or None if there is no session yet."""
+        with self.__lock:
+            if self.__api is None and self.__cookies is not None:
+                self.__api = CanvasAPI(self.__base_url, cookies=self.__cookies)
+            return self.__api
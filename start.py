@@ -1,23 +1,45 @@
-import contextlib
 import time
 import datetime
 import os
+import subprocess
+import sys
 
-from selenium import webdriver
 import streamlit as st
-from selenium.webdriver.chrome.service import Service
-from webdriver_manager.chrome import ChromeDriverManager
-from selenium.webdriver.chrome.options import Options
 
-from fixer import XIDFixer
-
-GOOGLE_CHROME_PATH = os.environ.get('GOOGLE_CHROME_BIN', "/app/.apt/usr/bin/google_chrome")
+from canvas_api import CanvasAPI, CanvasAPIException
+from config import VALIDATION_CACHE_DIR, API_TOKEN, get_item_seconds
+from discovery import LARGEST_FIRST, SMALLEST_FIRST, AS_GIVEN, estimate_courses, list_courses, schedule
+from events import WAITING_FOR_DUO, DUO_SUCCESS, TOTAL_ITEMS, ERR_LOGIN_FAIL, ERR_LOGIN_NOT_INTERACTABLE, \
+    ERR_DUO_FAIL, ERR_TIMEOUT_FAIL, ERR_COURSE_DNE, ERR_BROWSER_FAIL, ERR_LOGIN_EXPIRED
+from fixer import BACKEND_SELENIUM, BACKEND_API, BASE_URL, get_course_id
+from jobs import JobQueue, QUEUED, DONE, FAILED, CANCELLED, FINISHED_STATUSES
+from link_validation import LinkValidationCache
+from worker import send_login
+from timing import StageTiming, summarize, format_summary
+
+MAX_WORKERS = int(os.environ.get('XID_MAX_WORKERS', 4))
+
+# Seconds between status refreshes while jobs are running
+REFRESH_INTERVAL = 2
+
+BACKEND_OPTIONS = {
+    "Browser (rich content editor)": BACKEND_SELENIUM,
+    "Canvas API (faster, browser fallback)": BACKEND_API,
+}
+
+ORDER_OPTIONS = {
+    "Largest courses first": LARGEST_FIRST,
+    "Smallest courses first": SMALLEST_FIRST,
+    "As entered": AS_GIVEN,
+}
 
 ##
 #
 #   This file creates a web-based UI for the XID Fixer class using Streamlit.
 #   It expects that Chrome and ChromeDriver are installed on the host machine.
 #   Start this code by running `streamlit run start.py` after installing dependencies.
+#   The UI only submits courses to the job queue (see jobs.py) and shows their status. The fixing is done by worker
+#   processes that the UI starts, so it keeps going if the page is closed or rerun.
 #   Nate St. George, LTS
 #
 ##
@@ -40,120 +62,181 @@ def draw_sidebar():
 
         if st.sidebar.button("Clear"):
             del st.session_state.courses
+            st.session_state.pop("batch", None)
             st.experimental_rerun()
 
 
-def get_item_fail_message(fail_type):
-    """Returns a detailed fail message for a given fail type."""
-    if fail_type == "already_fixed":
-        return "Item has already been fixed because it's from the same pool as a previous question."
+def get_job_message(job):
+    """Returns a short description of where a job is."""
+    if job["status"] == QUEUED:
+        return "Waiting for a free browser"
+    if job["status"] == CANCELLED:
+        return "Cancelled"
+    if job["status"] in (DONE, FAILED):
+        return "{} of {} items failed".format(job["failed"], job["attempted"])
+    if job["message"] == WAITING_FOR_DUO:
+        return "Waiting for Duo approval"
+    if job["message"] == DUO_SUCCESS:
+        return "Duo approved, reading course links"
+    if job["message"] == TOTAL_ITEMS:
+        return "Fixed {} of {} items".format(job["attempted"], job["total_items"])
+    return "Starting"
+
+
+@st.experimental_singleton
+def get_job_queue():
+    return JobQueue()
+
+
+@st.experimental_singleton
+def start_workers():
+    """Start the worker processes that run the queued jobs, one browser each.
+    Workers that are still running from an earlier start finish their course and exit, then the new ones take
+    their slot. Jobs still queued from an earlier start are cancelled, since their login information is gone."""
+    get_job_queue().cancel_orphans()
+    worker_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "worker.py")
+    return [subprocess.Popen([sys.executable, worker_path, "--slot", str(slot)], stdin=subprocess.PIPE, text=True)
+            for slot in range(MAX_WORKERS)]
+
+
+def show_course_error(course, err):
+    """Display the error a course stopped with."""
+    if err == ERR_LOGIN_FAIL:
+        alert.error("Failed to log into your Boise State account. Please log out "
+                    "and re-enter your information.")
+    elif err == ERR_LOGIN_NOT_INTERACTABLE:
+        alert.error("Unable to interact with login page. This is usually fixed with a rerun.")
+    elif err == ERR_DUO_FAIL:
+        alert.error("The Duo request has timed out. "
+                    "If you didn't receive a push notification, make sure your Duo account is set up "
+                    "to automatically send push notifications instead of asking for an authentication "
+                    "method.")
+    elif err == ERR_TIMEOUT_FAIL:
+        alert.error("The course link validation for {} has taken too long. "
+                    "It is still running, so try rerunning the course.".format(course))
+    elif err == ERR_COURSE_DNE:
+        alert.error("The course {} does not exist, skipping.".format(course))
+    elif err == ERR_BROWSER_FAIL:
+        alert.error("The browser fixing {} stopped responding and couldn't be restarted.".format(course))
+    elif err == ERR_LOGIN_EXPIRED:
+        alert.error("The fixer restarted before {} was started. Please rerun it.".format(course))
+    else:
+        alert.error("An unknown error occurred in {}. Code: {}.".format(course, err))
+
+
+def get_api():
+    """Returns a Canvas API client using the configured access token, or None if there is none."""
+    return CanvasAPI(BASE_URL, token=API_TOKEN) if API_TOKEN else None
+
+
+@st.experimental_memo(ttl=600)
+def get_estimates(courses):
+    """Returns the estimated workload of each course, from the link validation cache or Canvas."""
+    return estimate_courses([(get_course_id(c) or c, "") for c in courses], LinkValidationCache(VALIDATION_CACHE_DIR),
+                            get_api())
+
+
+def find_courses(account, term):
+    """List the courses of an account or term to fix, or show an error if they can't be listed."""
+    try:
+        courses = list_courses(get_api(), account or None, term or None)
+    except CanvasAPIException as e:
+        alert.error("Unable to list courses: {}".format(e))
+        return
+    if not courses:
+        alert.warning("No courses found.")
+        return
+    st.session_state.courses = [course_id for course_id, _ in courses]
+    st.experimental_rerun()
+
+
+def submit_fix():
+    """Queue the selected courses and remember their batch, so the status survives reruns of the page."""
+    batch = get_job_queue().submit(ordered_courses, backend=BACKEND_OPTIONS[backend],
+                                   revalidate_links=revalidate_links, restart=restart, verify=verify)
+    for process in start_workers():
+        send_login(process, batch, st.session_state.username, st.session_state.password)
+    st.session_state.batch = batch
+    st.experimental_rerun()
+
+
+def show_status(batch):
+    """Show the status of a batch of jobs, refreshing the page until all of them have finished."""
+    job_queue = get_job_queue()
+    jobs = job_queue.get_batch(batch)
+
+    total_items = sum(job["total_items"] for job in jobs)
+    total_attempted = sum(job["attempted"] for job in jobs)
+    total_failed = sum(job["failed"] for job in jobs)
+    blocked_requests = sum(job["blocked_requests"] for job in jobs)
+    loaded_bytes = sum(job["loaded_bytes"] for job in jobs)
+    memo_hits = sum(job["memo_hits"] for job in jobs)
+    memo_misses = sum(job["memo_misses"] for job in jobs)
+    verified = sum(job["verified"] for job in jobs)
+    verify_failed = sum(job["verify_failed"] for job in jobs)
+    courses_done = sum(1 for job in jobs if job["status"] in FINISHED_STATUSES)
+
+    if total_items != 0:
+        st.progress(min(total_attempted / total_items, 1.0))
     else:
-        return "Unknown reason."
-
-
-def run_fix():
-    start_time = time.time()
-    options = Options()
-    options.add_argument("--window-size=1920,1080")
-    options.add_argument("--start-maximized")
-    options.add_argument('--no-sandbox')
-    options.add_argument('--disable-gpu')
-    options.add_argument('--disable-dev-shm-usage')
-    options.binary_location = GOOGLE_CHROME_PATH
-    options.headless = True
-    service = Service(ChromeDriverManager().install())
-    browser = webdriver.Chrome(service=service, options=options)
-    progress_container = btn_container.container()
-    status = progress_container.empty()
-    progress = progress_container.empty()
-    course_status = progress_container.empty()
-
-    err = None
-
-    total_failed = 0
-    total_attempted = 0
-    total_items = 0
-
-    with contextlib.closing(browser) as driver:
-        xid_fix = XIDFixer(driver)
-        for i, course in enumerate(st.session_state.courses):
-            status.caption("Starting work on {}...".format(course))
-            for msg, arg in xid_fix.do_course(course, st.session_state.username,
-                                                              st.session_state.password, revalidate_links):
-                if total_items != 0:
-                    progress.progress(max(total_attempted / total_items, 1.0))
-                else:
-                    progress.progress(0)
-
-                # Handle errors
-                print(msg[:3])
-                if msg[:3] == "err":
-                    err = msg[4:]
-                    print(err)
-                # Handle other message types
-                if msg == "waiting_for_duo":
-                    course_status.caption("You should have received a Duo push. Please approve the login request. "
-                                          "Note: The location shown on the push will not be your real location.")
-                if msg == "duo_success":
-                    course_status.caption("Duo approved, beginning course fix...")
-                if msg == "total_items":
-                    total_items = arg
-                if msg == "item_failed":
-                    total_failed += 1
-                    total_attempted += 1
-                    course_status.caption("Previous item failed to fix: {}".format(get_item_fail_message(arg)))
-                if msg == "item_success":
-                    course_status.caption("Previous item succeeded")
-                    total_attempted += 1
-                if msg == "done":
-                    course_status.caption("Course complete!")
-
-                status.markdown("**Course {} ({}/{}):** **{}** of **{}** failed so far, **{}** total items".format(
-                    course,
-                    i + 1,
-                    len(st.session_state.courses),
-                    total_failed,
-                    total_attempted,
-                    total_items
-                ))
-
-            if err is not None:
-                if err == "login_fail":
-                    alert.error("Failed to log into your Boise State account. Please log out "
-                                "and re-enter your information.")
-                elif err == "login_not_interactable":
-                    alert.error("Unable to interact with login page. This is usually fixed with a rerun.")
-                elif err == "duo_fail":
-                    alert.error("The Duo request has timed out. "
-                                "If you didn't receive a push notification, make sure your Duo account is set up "
-                                "to automatically send push notifications instead of asking for an authentication "
-                                "method.")
-                elif err == "timeout_fail":
-                    alert.error("The course link validation has taken too long. "
-                                "It is still running, so try rerunning the course.")
-                elif err == "course_dne":
-                    alert.error("The course {} does not exist, skipping.".format(course))
-                else:
-                    alert.error("An unknown error occurred. Code: {}. Stopping.".format(err))
-                break
-
-    if not err:
-        progress.progress(100)
-        status.caption("Done!")
+        st.progress(0)
+
+    st.markdown("**Courses done ({}/{}):** **{}** of **{}** failed so far, **{}** total items".format(
+        courses_done,
+        len(jobs),
+        total_failed,
+        total_attempted,
+        total_items
+    ))
+    st.table([{"Course": job["course"], "Status": job["status"], "Progress": get_job_message(job)} for job in jobs])
+
+    for job in jobs:
+        if job["error"]:
+            show_course_error(job["course"], job["error"])
+
+    if courses_done < len(jobs):
+        if st.button("Cancel queued courses"):
+            job_queue.cancel(batch)
+        time.sleep(REFRESH_INTERVAL)
+        st.experimental_rerun()
+
+    if not any(job["error"] for job in jobs):
+        started = min(job["submitted"] for job in jobs)
+        finished = max(job["finished"] or started for job in jobs)
         alert.success("Fix complete for all courses! {} of {} attempted items were successful. Time: {}.".format(
             total_attempted - total_failed, total_attempted,
-            datetime.timedelta(seconds=time.time() - start_time)
+            datetime.timedelta(seconds=finished - started)
         ))
+        if blocked_requests > 0:
+            st.caption("Blocked {} unneeded requests, loaded {:.1f} MB.".format(
+                blocked_requests, loaded_bytes / (1024 * 1024)))
+        if memo_hits > 0:
+            st.caption("Reused {} of {} rewrites from earlier items.".format(memo_hits, memo_hits + memo_misses))
+
+    if verified > 0:
+        if verify_failed > 0:
+            st.warning("{} of {} fixed items still have xid references or broken images, or couldn't be read back. "
+                       "Try rerunning their courses.".format(verify_failed, verified))
+        else:
+            st.caption("All {} fixed items were read back without xid references or broken images.".format(verified))
 
-    time.sleep(3)
-    if btn_container.button("Rerun"):
-        run_fix()
+    timings = [StageTiming(None, stage, duration, None, None, None)
+               for stage, duration in job_queue.get_timings(batch)]
+    if timings:
+        with st.expander("Time spent per stage"):
+            st.text(format_summary(summarize(timings)))
+
+    if st.button("Rerun"):
+        submit_fix()
 
 
 if __name__ == "__main__":
 
     alert = st.empty()
 
+    # Start the workers (and their browsers) while the user signs in and picks courses
+    start_workers()
+
     if "username" not in st.session_state or "password" not in st.session_state:
         # Show login screen
         with st.form(key="login_form"):
@@ -185,6 +268,16 @@ if __name__ == "__main__":
             if submitted:
                 st.session_state.courses = courses.split()
                 st.experimental_rerun()
+
+        if API_TOKEN:
+            with st.form(key="discovery_form"):
+                st.title("Find Courses")
+                st.caption("List every course of a Canvas account, optionally only those of one enrollment term. "
+                           "Leave the account empty to list the courses you teach.")
+                account = st.text_input("Account ID")
+                term = st.text_input("Term ID")
+                if st.form_submit_button("Find"):
+                    find_courses(account, term)
     else:
         draw_sidebar()
 
@@ -197,10 +290,22 @@ if __name__ == "__main__":
                     "**Please ensure that your Duo is set to [automatically send push requests.]"
                     "(https://www.boisestate.edu/oit-myboisestate/customize-your-duo-security-preferences/)**")
 
-        btn_container = st.empty()
-        col1, col2 = btn_container.columns(2)
+        col1, col2, col3 = st.columns(3)
         start = col1.button("Start")
         revalidate_links = col2.checkbox("Force revalidate course links")
+        restart = col2.checkbox("Ignore progress from previous runs")
+        verify = col2.checkbox("Verify fixed items")
+        backend = col3.selectbox("Editing method", list(BACKEND_OPTIONS.keys()))
+        order = col3.selectbox("Order", list(ORDER_OPTIONS.keys()))
+
+        # Largest first keeps every worker busy until the end, smallest first finishes many courses early
+        scheduled, seconds = schedule(get_estimates(tuple(st.session_state.courses)), ORDER_OPTIONS[order],
+                                      MAX_WORKERS, get_item_seconds())
+        ordered_courses = [course.course for course in scheduled]
+        st.caption("About {} xid items in {} courses, estimated time: {}.".format(
+            sum(course.items for course in scheduled), len(scheduled), datetime.timedelta(seconds=round(seconds))))
 
         if start:
-            run_fix()
+            submit_fix()
+        elif "batch" in st.session_state:
+            show_status(st.session_state.batch)
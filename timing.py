@@ -0,0 +1,97 @@
+import contextlib
+import json
+import math
+import time
+from collections import namedtuple
+
+##
+#
+#   This file times the stages of a course fix (login, Duo wait, link validation, item navigation, opening editors,
+#   resolving images, saving and verifying) so the fixer can report where the time goes. Timings can be exported as
+#   JSON lines and summarized as a table of p50/p95 durations per stage.
+#
+##
+
+STAGE_LOGIN = "login"
+STAGE_DUO_WAIT = "duo_wait"
+STAGE_VALIDATOR_REFRESH = "validator_refresh"
+STAGE_NAVIGATION = "navigation"
+STAGE_EDITOR_OPEN = "editor_open"
+STAGE_IMAGE_RESOLUTION = "image_resolution"
+STAGE_SAVE = "save"
+STAGE_VERIFICATION = "verification"
+
+# One timed stage. `item_type` and `url` are None for stages that aren't part of an item.
+StageTiming = namedtuple("StageTiming", ["course", "stage", "duration", "item_type", "url", "started"])
+
+
+class StageTimer:
+    """Records how long each stage takes. Timings are collected until they are drained."""
+
+    def __init__(self):
+        self.__course = None
+        self.__item_type = None
+        self.__url = None
+        self.__timings = []
+
+    def set_course(self, course):
+        self.__course = course
+        self.set_item(None, None)
+
+    def set_item(self, item_type, url):
+        """Set the item that the following stages belong to."""
+        self.__item_type = item_type
+        self.__url = url
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """Time the enclosed block as the given stage. Failed stages are recorded too."""
+        started = time.time()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.__timings.append(StageTiming(self.__course, name, time.perf_counter() - start, self.__item_type,
+                                              self.__url, started))
+
+    def drain(self):
+        """Returns the timings recorded since the last call."""
+        timings, self.__timings = self.__timings, []
+        return timings
+
+
+def write_jsonl(timings, file):
+    """Write timings to an open text file as one JSON object per line."""
+    for timing in timings:
+        file.write(json.dumps(timing._asdict()) + "\n")
+
+
+def read_jsonl(file):
+    """Read timings written by `write_jsonl`."""
+    return [StageTiming(**json.loads(line)) for line in file if line.strip()]
+
+
+def percentile(values, p):
+    """Returns the `p`th percentile of the given values using the nearest-rank method."""
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)]
+
+
+def summarize(timings):
+    """Returns a row per stage with its count, total, p50 and p95 durations in seconds, slowest total first."""
+    durations = {}
+    for timing in timings:
+        durations.setdefault(timing.stage, []).append(timing.duration)
+
+    rows = [{"stage": stage, "count": len(values), "total": sum(values), "p50": percentile(values, 50),
+             "p95": percentile(values, 95)} for stage, values in durations.items()]
+    return sorted(rows, key=lambda row: row["total"], reverse=True)
+
+
+def format_summary(rows):
+    """Format summary rows as a plain text table."""
+    lines = ["{:<20}{:>8}{:>12}{:>10}{:>10}".format("stage", "count", "total (s)", "p50 (s)", "p95 (s)")]
+    for row in rows:
+        lines.append("{:<20}{:>8}{:>12.2f}{:>10.2f}{:>10.2f}".format(row["stage"], row["count"], row["total"],
+                                                                    row["p50"], row["p95"]))
+    return "\n".join(lines)
@@ -0,0 +1,94 @@
+import html
+import re
+
+from canvas_api import CanvasAPIException, ITEM_ENDPOINTS, parse_item_url
+from events import ItemVerified
+from xid_scanner import find_xid_references, iter_attributes
+
+##
+#
+#   This file checks fixed items right after a run, without revalidating every link in the course.
+#   Only the items the run touched are read back (pages, assignments and discussions through the API, quiz questions
+#   through the quiz questions API and question banks from their page), their HTML is scanned again for xid references
+#   and image sources that don't load, and every item gets a pass or fail.
+#
+##
+
+QUIZ_URL_PATTERN = re.compile(r"/courses/(\d+)/quizzes/(\d+)")
+FILE_SOURCE_PATTERN = re.compile(r"/courses/(\d+)/files/(\d+)")
+# Left behind by course exports when a file was never imported
+PACKAGE_PLACEHOLDER = "$IMS-CC-FILEBASE$"
+
+QUIZ_QUESTION_FIELDS = ("question_text", "correct_comments_html", "incorrect_comments_html", "neutral_comments_html")
+QUIZ_ANSWER_FIELDS = ("html", "comments_html")
+
+
+def find_image_sources(text):
+    """Returns the source of every image in the HTML document, with entities decoded."""
+    return [html.unescape(text[start:end]) for tag, attribute, start, end, _, _ in iter_attributes(text)
+            if tag == "img" and attribute == "src"]
+
+
+class ItemVerifier:
+    """Reads fixed items back through a CanvasAPI and checks that they are clean.
+    Whether a course file exists is only looked up once per verifier."""
+
+    def __init__(self, api):
+        self.__api = api
+        self.__files = {}
+
+    def __read(self, url, item_type):
+        """Returns the HTML fragments of an item. Raises a CanvasAPIException if the item can't be read."""
+        if item_type in ITEM_ENDPOINTS:
+            course_id, item_id = parse_item_url(url)
+            return [self.__api.get_item_body(course_id, item_type, item_id)]
+
+        if item_type == "quiz_question":
+            match = QUIZ_URL_PATTERN.search(url)
+            if match is None:
+                raise CanvasAPIException("Unable to parse quiz link {}.".format(url))
+            texts = []
+            for question in self.__api.get_paginated("/courses/{}/quizzes/{}/questions".format(*match.groups())):
+                texts.extend(question.get(field) or "" for field in QUIZ_QUESTION_FIELDS)
+                for answer in question.get("answers") or []:
+                    texts.extend(answer.get(field) or "" for field in QUIZ_ANSWER_FIELDS)
+            return texts
+
+        # Question banks have no API, but their page lists every question
+        return [self.__api.get_html(url)]
+
+    def __file_exists(self, course_id, file_id):
+        """Returns False if Canvas says the course file doesn't exist. Other errors don't count as missing files."""
+        key = (course_id, file_id)
+        if key not in self.__files:
+            try:
+                self.__api.get("/courses/{}/files/{}".format(course_id, file_id))
+                self.__files[key] = True
+            except CanvasAPIException as e:
+                self.__files[key] = e.status_code not in (404, 410)
+        return self.__files[key]
+
+    def is_broken_image(self, source):
+        """Return true if an image source is empty, an unresolved package link or a course file that doesn't exist."""
+        if not source.strip() or PACKAGE_PLACEHOLDER in source:
+            return True
+        match = FILE_SOURCE_PATTERN.search(source)
+        return match is not None and not self.__file_exists(*match.groups())
+
+    def verify_item(self, course, url, item_type):
+        """Read an item back and returns an ItemVerified event for it."""
+        try:
+            texts = self.__read(url, item_type)
+        except CanvasAPIException as e:
+            print("Unable to verify {}: {}".format(url, e))
+            return ItemVerified(course, url, False, reason="unreadable")
+
+        xid_references = sum(len(find_xid_references(text)) for text in texts)
+        broken_images = tuple(source for text in texts for source in find_image_sources(text)
+                              if "xid" not in source and self.is_broken_image(source))
+        return ItemVerified(course, url, xid_references == 0 and not broken_images, xid_references, broken_images)
+
+    def verify(self, course, items):
+        """Yield an ItemVerified event for each `(url, item_type)` item."""
+        for url, item_type in items:
+            yield self.verify_item(course, url, item_type)
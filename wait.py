@@ -0,0 +1,65 @@
+import time
+
+from selenium.common.exceptions import NoSuchElementException, TimeoutException
+
+##
+#
+#   This file contains the wait policy used throughout the fixer.
+#   Instead of fixed sleeps and fixed polling, every wait checks a condition (an element appearing, the page's
+#   requests finishing, ...) with an interval that starts short and backs off exponentially up to a limit, so waits
+#   end as soon as the page is ready without hammering the browser while it isn't.
+#
+##
+
+# Condition that is true once the page has loaded and has no jQuery requests in flight
+PAGE_SETTLED_SCRIPT = """
+return document.readyState === "complete" && (!window.jQuery || window.jQuery.active === 0);
+"""
+
+
+def page_settled(driver):
+    """Return true once the page has finished loading and has no requests in flight."""
+    return driver.execute_script(PAGE_SETTLED_SCRIPT)
+
+
+class PolicyWait:
+    """A wait on a driver or element following a WaitPolicy. Has the same interface as WebDriverWait."""
+
+    def __init__(self, policy, target, timeout, ignored_exceptions):
+        self.__policy = policy
+        self.__target = target
+        self.__timeout = timeout
+        self.__ignored_exceptions = ignored_exceptions
+
+    def until(self, condition, message=""):
+        """Returns the first truthy value of `condition(target)`, raising a TimeoutException at the timeout."""
+        deadline = time.monotonic() + self.__timeout
+        interval = self.__policy.initial_interval
+        while True:
+            try:
+                value = condition(self.__target)
+                if value:
+                    return value
+            except self.__ignored_exceptions:
+                pass
+
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise TimeoutException(message)
+            time.sleep(min(interval, remaining))
+            interval = min(interval * self.__policy.backoff, self.__policy.max_interval)
+
+
+class WaitPolicy:
+    """How the fixer waits: polling starts at `initial_interval` seconds and is multiplied by `backoff` after every
+    check, up to `max_interval`. Every timeout is multiplied by `timeout_scale`, for slow browsers or networks."""
+
+    def __init__(self, initial_interval=0.05, backoff=2.0, max_interval=1.0, timeout_scale=1.0):
+        self.initial_interval = initial_interval
+        self.backoff = backoff
+        self.max_interval = max_interval
+        self.timeout_scale = timeout_scale
+
+    def on(self, target, timeout, ignored_exceptions=(NoSuchElementException,)):
+        """Returns a wait on the given driver or element, used like `WebDriverWait(target, timeout)`."""
+        return PolicyWait(self, target, timeout * self.timeout_scale, ignored_exceptions)
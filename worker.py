@@ -0,0 +1,256 @@
+import argparse
+import functools
+import json
+import socket
+import sys
+import threading
+import time
+
+from browsers import BrowserPool, create_browser
+from config import WARM_BROWSERS, JOURNAL_PATH, VALIDATION_CACHE_DIR, BLOCK_RESOURCES, WAIT_TIMEOUT_SCALE, \
+    TIMINGS_PATH, BROWSER_RSS_MB, BROWSER_MAX_ITEMS, get_memo, get_resource_filter
+from events import CourseDone, CourseError, StageTimed
+from fixer import BACKEND_SELENIUM, BASE_URL, get_course_id
+from jobs import JobQueue, JOBS_PATH, DONE, FAILED, QUEUED, HEARTBEAT_INTERVAL
+from journal import CourseJournal
+from link_validation import LinkValidationCache, LinkValidationPoller
+from pool import run_courses
+from session import CanvasSession
+from timing import write_jsonl
+from wait import WaitPolicy
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+POLL_INTERVAL = 2
+# Queued courses of the batch whose link validation is started while a worker fixes its course
+UPCOMING_VALIDATIONS = 8
+
+##
+#
+#   This file is a worker process for the job queue in jobs.py.
+#   Each worker owns one browser and fixes one course at a time, so the number of workers bounds how many browsers
+#   run on a host. The web UI starts its workers with `python3 worker.py --slot N` and hands them the login
+#   information of every batch it submits through their standard input, so it is only ever kept in memory.
+#   A worker stops taking jobs once the UI that started it is gone, and only one worker can hold a slot at a time,
+#   so the workers of a restarted UI wait for the old ones to finish their last course.
+#
+##
+
+
+def take_slot(slot, logins):
+    """Lock the given worker slot for this process, waiting for the worker that holds it to exit.
+    Returns the lock file, or None if the UI went away while waiting."""
+    lock_file = open("{}.worker{}.lock".format(JOBS_PATH, slot), "w")
+    if fcntl is None:
+        return lock_file
+    while not logins.closed:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return lock_file
+        except OSError:
+            time.sleep(POLL_INTERVAL)
+    lock_file.close()
+    return None
+
+
+def send_login(process, batch, username, password):
+    """Hand the login information of a batch to a worker process started with a pipe as its standard input.
+    Returns False if the worker has exited."""
+    try:
+        process.stdin.write(json.dumps({"batch": batch, "username": username, "password": password}) + "\n")
+        process.stdin.flush()
+        return True
+    except (OSError, ValueError):
+        return False
+
+
+class Logins:
+    """The login information of each batch, read from a stream of JSON lines (see `send_login`) in the background.
+    `closed` is set once the stream ends, meaning the UI that started the worker is gone."""
+
+    def __init__(self, stream):
+        self.__logins = {}
+        self.__lock = threading.Lock()
+        self.closed = False
+        threading.Thread(target=self.__read, args=(stream,), daemon=True).start()
+
+    def __read(self, stream):
+        for line in stream:
+            try:
+                login = json.loads(line)
+                with self.__lock:
+                    self.__logins[login["batch"]] = (login["username"], login["password"])
+            except (ValueError, KeyError, TypeError):
+                print("Ignoring malformed login information")
+        self.closed = True
+
+    def get_batches(self):
+        with self.__lock:
+            return list(self.__logins)
+
+    def get(self, batch):
+        """Returns `(username, password)` for a batch, or None if the worker was never given it."""
+        with self.__lock:
+            return self.__logins.get(batch)
+
+    def forget(self, batch):
+        with self.__lock:
+            self.__logins.pop(batch, None)
+
+
+class Worker:
+    """Claims jobs from a JobQueue and fixes their courses. Keeps a Canvas session per user between jobs, so Duo is
+    only needed again once Canvas ends the session, and shares it with the other workers running the same batch."""
+
+    def __init__(self, job_queue, name, logins):
+        self.__jobs = job_queue
+        self.__name = name
+        self.__logins = logins
+        self.__browsers = BrowserPool(1, warm=WARM_BROWSERS,
+                                      create=functools.partial(create_browser, log_network=BLOCK_RESOURCES),
+                                      max_items=BROWSER_MAX_ITEMS, max_rss_mb=BROWSER_RSS_MB)
+        self.__journal = CourseJournal(JOURNAL_PATH)
+        self.__validation_cache = LinkValidationCache(VALIDATION_CACHE_DIR)
+        self.__link_validator = LinkValidationPoller(cache=self.__validation_cache)
+        self.__resource_filter = get_resource_filter()
+        self.__wait_policy = WaitPolicy(timeout_scale=WAIT_TIMEOUT_SCALE)
+        self.__memo = get_memo()
+        self.__sessions = {}
+
+    def __send_heartbeats(self, job, stopped):
+        """Mark a job as alive every HEARTBEAT_INTERVAL seconds until `stopped` is set. Long stretches without events
+        (a question pool, a link validation) would otherwise get the job requeued and fixed twice."""
+        while not stopped.wait(HEARTBEAT_INTERVAL):
+            try:
+                self.__jobs.heartbeat(job)
+            except Exception as e:
+                print("Unable to mark job {} as alive: {}".format(job, e))
+
+    def run_job(self, job):
+        """Fix the course of a claimed job, recording its progress in the queue."""
+        stopped = threading.Event()
+        heartbeat = threading.Thread(target=self.__send_heartbeats, args=(job["id"], stopped), daemon=True)
+        heartbeat.start()
+        try:
+            self.__run_job(job)
+        finally:
+            stopped.set()
+            heartbeat.join()
+
+    def __wait_for_session(self, batch, session):
+        """Load the Canvas session another worker shared for a batch, waiting while that worker logs in, unless this
+        worker is the one to log in. Returns the error code if logging in for the batch failed, otherwise None."""
+        while True:
+            shared = self.__jobs.claim_session(batch, self.__name)
+            if shared["error"] is not None:
+                return shared["error"]
+            if shared["cookies"] is not None:
+                if shared["cookies"] != session.get_cookies():
+                    session.load(shared["cookies"])
+                return None
+            if shared["worker"] == self.__name:
+                if session.is_captured():
+                    # The session of an earlier batch of the same user is most likely still accepted
+                    self.__jobs.share_session(batch, self.__name, session.get_cookies())
+                return None
+            time.sleep(POLL_INTERVAL)
+
+    def __run_job(self, job):
+        course, options, batch = job["course"], job["options"], job["batch"]
+        if options.get("restart"):
+            self.__journal.clear(get_course_id(course) or course)
+        username, password = self.__logins.get(batch)
+        session = self.__sessions.setdefault(username, CanvasSession(BASE_URL))
+        error = self.__wait_for_session(batch, session)
+        if error is not None:
+            self.__jobs.finish(job["id"], FAILED, error)
+            return
+        shared_version = session.get_version() if session.is_captured() else None
+
+        error = None
+        done = False
+        timings = []
+        upcoming = [j["course"] for j in self.__jobs.get_batch(batch) if j["status"] == QUEUED]
+        for event in run_courses([course], self.__browsers, username, password,
+                                 options.get("revalidate_links", False),
+                                 backend=options.get("backend", BACKEND_SELENIUM), journal=self.__journal,
+                                 link_validator=self.__link_validator, validation_cache=self.__validation_cache,
+                                 session=session, resource_filter=self.__resource_filter,
+                                 wait_policy=self.__wait_policy, memo=self.__memo,
+                                 verify=options.get("verify", False), upcoming=upcoming[:UPCOMING_VALIDATIONS],
+                                 fresh_after=job["submitted"]):
+            self.__jobs.record_event(job["id"], event)
+            if session.get_version() != shared_version and session.is_captured():
+                # Logged in, or logged in again after Canvas ended the session, so the other workers can stop waiting
+                self.__jobs.share_session(batch, self.__name, session.get_cookies())
+                shared_version = session.get_version()
+            if isinstance(event, CourseError):
+                error = event.code
+                if event.fatal:
+                    # The rest of the batch would fail the same way, and might prompt Duo for every course
+                    self.__jobs.cancel(batch)
+                    self.__jobs.fail_session(batch, event.code)
+            elif isinstance(event, StageTimed):
+                timings.append(event.timing)
+            elif isinstance(event, CourseDone):
+                done = True
+        self.__jobs.release_session(batch, self.__name)
+
+        if TIMINGS_PATH and timings:
+            with open(TIMINGS_PATH, "a") as f:
+                write_jsonl(timings, f)
+        if done:
+            self.__jobs.finish(job["id"], DONE)
+        else:
+            self.__jobs.finish(job["id"], FAILED, error or "worker_error")
+
+    def run(self):
+        """Run jobs until the UI that started the worker is gone."""
+        self.__browsers.prewarm()
+        print("Worker {} waiting for jobs".format(self.__name))
+        while not self.__logins.closed:
+            self.__jobs.requeue_stale()
+            # Batches that are over won't be rerun under the same id, their login information is no longer needed
+            for batch in self.__logins.get_batches():
+                if self.__jobs.is_finished(batch):
+                    self.__logins.forget(batch)
+                    self.__jobs.forget_session(batch)
+                    # Validations started ahead of time for courses other workers fixed shouldn't be reused later
+                    for j in self.__jobs.get_batch(batch):
+                        self.__link_validator.forget(get_course_id(j["course"]) or j["course"])
+
+            job = self.__jobs.claim(self.__name, self.__logins.get_batches())
+            if job is None:
+                time.sleep(POLL_INTERVAL)
+                continue
+
+            print("Worker {} starting course {}".format(self.__name, job["course"]))
+            try:
+                self.run_job(job)
+            except Exception as e:
+                print("Job {} stopped unexpectedly: {}".format(job["id"], e))
+                self.__jobs.finish(job["id"], FAILED, "worker_error")
+
+        print("Worker {} stopping, the UI that started it is gone".format(self.__name))
+        self.__browsers.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fix courses from the XID fixer job queue.")
+    parser.add_argument("--slot", type=int, default=0, help="worker slot to run in, one worker per slot")
+    args = parser.parse_args()
+
+    logins = Logins(sys.stdin)
+    slot_lock = take_slot(args.slot, logins)
+    if slot_lock is None:
+        print("Worker slot {} was never freed".format(args.slot))
+        return
+
+    Worker(JobQueue(), "{}:{}".format(socket.gethostname(), args.slot), logins).run()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+import html
+import re
+import urllib.parse
+from collections import namedtuple
+
+##
+#
+#   This file finds and rewrites xid references in raw HTML in a single pass, without building a document tree.
+#   Tags are tokenized with regular expressions and only the attributes that can hold an xid reference are looked at:
+#   image sources and srcsets, links, frames, embedded media and `url(...)` in inline styles.
+#   Every reference is reported with its offsets, so rewriting only replaces those spans and leaves the rest of the
+#   document exactly as it was.
+#
+##
+
+# Tag -> attributes that can refer to an xid file. Any tag's inline style is checked as well.
+XID_ATTRIBUTES = {
+    "img": ("src", "srcset"),
+    "a": ("href",),
+    "iframe": ("src",),
+    "source": ("src", "srcset"),
+    "embed": ("src",),
+}
+
+# Comments and the contents of script and style elements are skipped, everything else that looks like a tag is read.
+# Like in a browser, an unclosed comment, script or style runs to the end of the document, and a tag ends at the next
+# `<` if it isn't closed before it, so malformed markup doesn't rescan the rest of the document from every `<`.
+TOKEN_PATTERN = re.compile(
+    r"<!--(?:.*?-->|.*)"
+    r"|<(script|style)\b[^<>]*>(?:.*?</\1\s*>|.*)"
+    r"|<([a-zA-Z][a-zA-Z0-9-]*)((?:\s+[^\s=/<>]+(?:\s*=\s*(?:\"[^\"]*\"|'[^']*'|[^\s\"'<>]+))?)*)\s*/?>",
+    re.DOTALL | re.IGNORECASE)
+ATTRIBUTE_PATTERN = re.compile(r"([^\s=/<>]+)(?:\s*=\s*(?:\"([^\"]*)\"|'([^']*)'|([^\s\"'<>]+)))?")
+SRCSET_CANDIDATE_PATTERN = re.compile(r"\s*([^\s,][^\s]*?)(?:\s+[^,]*)?(?:,|$)")
+# The value is still escaped, so a quoted URL may be delimited by entities such as `url(&quot;...&quot;)`
+STYLE_URL_PATTERN = re.compile(
+    r"url\(\s*(?:(\"|'|&quot;|&apos;|&#0*3[49];|&#x0*2[27];)(.*?)\1|([^\s'\")]+))\s*\)", re.IGNORECASE)
+
+# One xid reference: the `tag` and `attribute` it was found in, the `start` and `end` offsets of the raw reference
+# in the document, its `url` with entities decoded, and the `tag_start` and `tag_end` offsets of the whole tag
+XIDReference = namedtuple("XIDReference", ["tag", "attribute", "start", "end", "url", "tag_start", "tag_end"])
+
+
+def iter_attributes(text):
+    """Yield `(tag, attribute, value_start, value_end, tag_start, tag_end)` for every attribute with a value of every
+    tag in the document. Offsets index the raw, still escaped, value."""
+    for token in TOKEN_PATTERN.finditer(text):
+        tag = token.group(2)
+        if tag is None:
+            continue
+        tag = tag.lower()
+        offset = token.start(3)
+        for attribute in ATTRIBUTE_PATTERN.finditer(token.group(3)):
+            for group in (2, 3, 4):
+                if attribute.group(group) is not None:
+                    yield (tag, attribute.group(1).lower(), offset + attribute.start(group),
+                           offset + attribute.end(group), token.start(), token.end())
+                    break
+
+
+def find_xid_references(text):
+    """Returns every xid reference in the HTML document, in document order."""
+    if "xid" not in text:
+        return []
+
+    references = []
+    for tag, attribute, start, end, tag_start, tag_end in iter_attributes(text):
+        value = text[start:end]
+        if "xid" not in value:
+            continue
+
+        if attribute == "style":
+            for match in STYLE_URL_PATTERN.finditer(value):
+                group = 2 if match.group(2) is not None else 3
+                url = html.unescape(match.group(group))
+                if "xid" in url:
+                    references.append(XIDReference(tag, attribute, start + match.start(group),
+                                                   start + match.end(group), url, tag_start, tag_end))
+        elif attribute in XID_ATTRIBUTES.get(tag, ()):
+            if attribute == "srcset":
+                for match in SRCSET_CANDIDATE_PATTERN.finditer(value):
+                    url = html.unescape(match.group(1) or "")
+                    if "xid" in url:
+                        references.append(XIDReference(tag, attribute, start + match.start(1), start + match.end(1),
+                                                       url, tag_start, tag_end))
+            else:
+                url = html.unescape(value)
+                if "xid" in url:
+                    references.append(XIDReference(tag, attribute, start, end, url, tag_start, tag_end))
+    return references
+
+
+def get_attribute(text, tag, attribute):
+    """Returns the raw value of an attribute of the first matching tag in the document, or None."""
+    for t, a, start, end, _, _ in iter_attributes(text):
+        if t == tag and a == attribute:
+            return text[start:end]
+    return None
+
+
+def apply_edits(text, edits):
+    """Replace spans of the document. `edits` are `(start, end, replacement)` tuples. An edit that overlaps an earlier
+    one (for example a reference inside a tag that is replaced as a whole) is dropped.
+    Returns the new document and the number of edits applied."""
+    parts = []
+    position = 0
+    applied = 0
+    for start, end, replacement in sorted(edits, key=lambda edit: (edit[0], -edit[1])):
+        if start < position:
+            continue
+        parts.append(text[position:start])
+        parts.append(replacement)
+        position = end
+        applied += 1
+    parts.append(text[position:])
+    return "".join(parts), applied
+
+
+def get_xid_image_name(src):
+    """Returns the name of the file an xid image source refers to."""
+    return urllib.parse.urlsplit(src).path.split("/")[-1]
+
+
+def replace_xid_images(text, resolve_image, resolve_file=None):
+    """Replace every xid reference in the given HTML using the markup returned by `resolve_image(image_name)`.
+    xid images are replaced with the markup, while other references (links, srcsets, frames, inline styles) get the
+    source of the image in the markup. References outside of `<img>` tags, which may not be images at all, are
+    resolved with `resolve_file(image_name)` instead if it is given. References that resolve to None are left as
+    they are. Each distinct name is resolved only once, and only the references themselves are rewritten.
+    Returns a tuple of the new HTML and the number of references that were replaced."""
+    references = find_xid_references(text)
+    if len(references) == 0:
+        return text, 0
+
+    def get_key(reference):
+        return get_xid_image_name(reference.url), resolve_file is None or reference.tag == "img"
+
+    # Resolve every image before touching the document
+    replacements = {}
+    for reference in references:
+        key = get_key(reference)
+        if key not in replacements:
+            replacements[key] = (resolve_image if key[1] else resolve_file)(key[0])
+
+    edits = []
+    for reference in references:
+        markup = replacements[get_key(reference)]
+        if markup is None:
+            continue
+        if reference.tag == "img" and reference.attribute == "src":
+            edits.append((reference.tag_start, reference.tag_end, markup))
+        else:
+            source = get_attribute(markup, "img", "src")
+            if source is not None:
+                edits.append((reference.start, reference.end, source))
+
+    return apply_edits(text, edits)